@@ -0,0 +1,314 @@
+"""
+Условия-аномалии: отклонение дневных показателей кампаний от их собственной истории
+
+Пример condition_json:
+    {"type": "anomaly", "metric": "Cost", "method": "mad",
+     "window": 14, "threshold": 3.5, "direction": "up", "min_value": 100}
+
+Последний закрытый день каждой кампании сравнивается с ее базой за
+предыдущие window дней: z-score (среднее/стандартное отклонение) или
+робастная оценка (медиана/MAD). Все кампании считаются одной матрицей
+кампании x дни, без цикла по кампаниям.
+"""
+import logging
+import warnings
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+ANOMALY_CONDITION_TYPE = 'anomaly'
+
+# Метрики: аддитивные берутся как есть, относительные считаются из аддитивных
+ANOMALY_METRICS = ['Cost', 'Clicks', 'Impressions', 'Conversions', 'Ctr', 'AvgCpc', 'ConversionRate']
+RATE_METRICS = {
+    'Ctr': ('Clicks', 'Impressions', 100),
+    'AvgCpc': ('Cost', 'Clicks', 1),
+    'ConversionRate': ('Conversions', 'Clicks', 100)
+}
+
+ANOMALY_METHODS = ['zscore', 'mad']
+ANOMALY_DIRECTIONS = ['both', 'up', 'down']
+
+DEFAULT_WINDOW = 14
+DEFAULT_THRESHOLD = 3.0
+
+# Сколько кампаний перечислять в уведомлении
+ANOMALY_MESSAGE_LIMIT = 5
+
+# MAD * 1.4826 оценивает стандартное отклонение нормального распределения
+MAD_SCALE = 1.4826
+
+# Нижняя граница разброса как доля уровня базы: у ровной или почти нулевой
+# базы разброс нулевой, и без нее любое изменение давало бы бесконечный score
+SCALE_FLOOR_RATIO = 0.1
+
+
+def is_anomaly_condition(condition_data):
+    """Check whether condition_json describes an anomaly condition"""
+    return condition_data.get('type') == ANOMALY_CONDITION_TYPE
+
+
+def parse_anomaly_condition(condition_data):
+    """
+    Validate an anomaly condition and fill in defaults
+
+    Args:
+        condition_data: Dictionary from condition_json
+
+    Returns:
+        dict: metric, method, window, threshold, direction, min_value, min_history
+
+    Raises:
+        ValueError: If the condition is invalid
+    """
+    metric = condition_data.get('metric')
+    if metric not in ANOMALY_METRICS:
+        raise ValueError(f"metric must be one of {', '.join(ANOMALY_METRICS)}")
+
+    method = condition_data.get('method', 'zscore')
+    if method not in ANOMALY_METHODS:
+        raise ValueError(f"method must be one of {', '.join(ANOMALY_METHODS)}")
+
+    direction = condition_data.get('direction', 'both')
+    if direction not in ANOMALY_DIRECTIONS:
+        raise ValueError(f"direction must be one of {', '.join(ANOMALY_DIRECTIONS)}")
+
+    try:
+        window = int(condition_data.get('window', DEFAULT_WINDOW))
+        threshold = float(condition_data.get('threshold', DEFAULT_THRESHOLD))
+        min_value = float(condition_data.get('min_value', 0))
+        min_history = int(condition_data.get('min_history', (window + 1) // 2))
+    except (TypeError, ValueError):
+        raise ValueError("window, threshold, min_value and min_history must be numbers")
+
+    if not 3 <= window <= 90:
+        raise ValueError("window must be between 3 and 90 days")
+    if threshold <= 0:
+        raise ValueError("threshold must be positive")
+    if not 2 <= min_history <= window:
+        raise ValueError("min_history must be between 2 and window")
+
+    return {
+        'metric': metric,
+        'method': method,
+        'window': window,
+        'threshold': threshold,
+        'direction': direction,
+        'min_value': min_value,
+        'min_history': min_history
+    }
+
+
+def build_metric_matrix(daily_df, metric, date_from, date_to):
+    """
+    Build a campaign x day matrix of a metric from daily statistics
+
+    Days without statistics count as zero activity; rate metrics are NaN
+    on days where their denominator is zero.
+
+    Args:
+        daily_df: pandas.DataFrame with Date, CampaignId, CampaignName and metric columns
+        metric: Metric name from ANOMALY_METRICS
+        date_from: First day (date)
+        date_to: Last day (date)
+
+    Returns:
+        tuple: (campaigns, matrix) where campaigns is a DataFrame with Id and
+            Name per matrix row and matrix is a float ndarray (campaigns x days)
+    """
+    days = pd.date_range(date_from, date_to)
+    dates = pd.to_datetime(daily_df['Date'], errors='coerce')
+    day_index = ((dates - days[0]).dt.days).to_numpy()
+    valid = (day_index >= 0) & (day_index < len(days))
+
+    campaign_codes, campaign_ids = pd.factorize(daily_df['CampaignId'].astype(str))
+    shape = (len(campaign_ids), len(days))
+    rows, cols = campaign_codes[valid], day_index[valid].astype(int)
+
+    def additive(column):
+        matrix = np.zeros(shape)
+        if column in daily_df.columns:
+            values = pd.to_numeric(daily_df[column], errors='coerce').fillna(0).to_numpy()
+            np.add.at(matrix, (rows, cols), values[valid])
+        return matrix
+
+    if metric in RATE_METRICS:
+        numerator, denominator, factor = RATE_METRICS[metric]
+        bottom = additive(denominator)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            matrix = np.where(bottom > 0, additive(numerator) / bottom * factor, np.nan)
+    else:
+        matrix = additive(metric)
+
+    names = daily_df['CampaignName'] if 'CampaignName' in daily_df.columns else daily_df['CampaignId']
+    last_names = pd.Series(names.to_numpy()).groupby(campaign_codes).last()
+    campaigns = pd.DataFrame({'Id': campaign_ids, 'Name': last_names.reindex(range(len(campaign_ids))).to_numpy()})
+
+    return campaigns, matrix
+
+
+def score_anomalies(matrix, method='zscore', min_history=2):
+    """
+    Score the last day of each row against the preceding days
+
+    Args:
+        matrix: ndarray (campaigns x days); the last column is the day to check
+        method: 'zscore' (mean/std) or 'mad' (median/MAD)
+        min_history: Minimum number of active (non-NaN, non-zero) baseline days
+
+    Returns:
+        tuple: (current, center, scores) arrays, one value per row. Scores are
+            NaN where there is not enough active history, so new and resumed
+            campaigns are not scored. The scale is at least SCALE_FLOOR_RATIO
+            of the baseline level, so a flat baseline gives finite scores.
+    """
+    baseline, current = matrix[:, :-1], matrix[:, -1]
+
+    with warnings.catch_warnings():
+        # Строки без истории дают All-NaN slice, для них score будет NaN
+        warnings.simplefilter('ignore', category=RuntimeWarning)
+        if method == 'mad':
+            center = np.nanmedian(baseline, axis=1)
+            scale = np.nanmedian(np.abs(baseline - center[:, None]), axis=1) * MAD_SCALE
+        else:
+            center = np.nanmean(baseline, axis=1)
+            scale = np.nanstd(baseline, axis=1, ddof=1)
+        # Уровень базы берется и по центру, и по среднему модулю: медиана
+        # базы с редкими активными днями бывает нулевой
+        level = np.fmax(np.abs(center), np.nanmean(np.abs(baseline), axis=1))
+        scale = np.fmax(scale, level * SCALE_FLOOR_RATIO)
+
+    deviation = current - center
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scores = deviation / scale
+
+    # Дни без статистики заполнены нулями, поэтому история - это дни с активностью
+    history = np.count_nonzero(np.nan_to_num(baseline) != 0, axis=1)
+    scores[(history < min_history) | np.isnan(deviation) | ~(scale > 0)] = np.nan
+
+    return current, center, scores
+
+
+def detect_anomalies(daily_df, config, date_to):
+    """
+    Find campaigns whose metric on date_to deviates from their own baseline
+
+    Args:
+        daily_df: Daily statistics covering config['window'] days before date_to and date_to
+        config: Result of parse_anomaly_condition
+        date_to: Day to check (date)
+
+    Returns:
+        list: Anomalies as dicts (Id, Name, value, baseline, score), largest deviation first
+    """
+    if daily_df is None or daily_df.empty:
+        return []
+
+    date_from = date_to - timedelta(days=config['window'])
+    campaigns, matrix = build_metric_matrix(daily_df, config['metric'], date_from, date_to)
+    current, center, scores = score_anomalies(matrix, config['method'], config['min_history'])
+
+    threshold = config['threshold']
+    if config['direction'] == 'up':
+        flagged = scores > threshold
+    elif config['direction'] == 'down':
+        flagged = scores < -threshold
+    else:
+        flagged = np.abs(scores) > threshold
+
+    # Мелкие кампании не должны поднимать тревогу из-за шума
+    if config['min_value']:
+        flagged &= np.fmax(current, center) >= config['min_value']
+
+    positions = np.flatnonzero(flagged)
+    positions = positions[np.argsort(-np.abs(scores[positions]), kind='stable')]
+
+    return [
+        {
+            'Id': campaigns['Id'].iat[i],
+            'Name': campaigns['Name'].iat[i],
+            'value': current[i].item(),
+            'baseline': center[i].item(),
+            'score': scores[i].item()
+        }
+        for i in positions
+    ]
+
+
+def evaluate_anomaly_condition(yandex_client, condition_data, local_stats=None):
+    """
+    Check an anomaly condition for the last closed day
+
+    Daily history is read from local statistics when stored, otherwise it
+    is fetched from the API with one report and stored for the next check.
+
+    Args:
+        yandex_client: YandexDirectAPI instance
+        condition_data: Dictionary from condition_json
+        local_stats: rollups.LocalStats for the account (optional)
+
+    Returns:
+        tuple: (anomalies, date_to) - list from detect_anomalies and the checked day
+    """
+    config = parse_anomaly_condition(condition_data)
+
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    date_to = today - timedelta(days=1)
+    date_from = date_to - timedelta(days=config['window'])
+
+    daily_df = local_stats.daily_stats(date_from, date_to) if local_stats else None
+    if daily_df is None:
+        daily_df = yandex_client.get_campaign_daily_stats_dataframe(
+            date_from=date_from.strftime('%Y-%m-%d'),
+            date_to=date_to.strftime('%Y-%m-%d')
+        )
+        if local_stats:
+            local_stats.store_daily(daily_df, date_from, date_to)
+
+    return detect_anomalies(daily_df, config, date_to.date()), date_to.date()
+
+
+def describe_anomaly_condition(condition_data):
+    """
+    Format a human-readable description of an anomaly condition
+
+    Args:
+        condition_data: Dictionary from condition_json
+
+    Returns:
+        str: Description
+    """
+    config = parse_anomaly_condition(condition_data)
+    method = 'median/MAD' if config['method'] == 'mad' else 'z-score'
+    direction = {'up': 'above', 'down': 'below', 'both': 'away from'}[config['direction']]
+    return (f"daily {config['metric']} {direction} its {config['window']}-day baseline "
+            f"by more than {config['threshold']:g} ({method})")
+
+
+def format_anomaly_message(condition_data, anomalies, day, limit=ANOMALY_MESSAGE_LIMIT):
+    """
+    Format the alert text for detected anomalies
+
+    Args:
+        condition_data: Dictionary from condition_json
+        anomalies: List from detect_anomalies
+        day: Checked day (date)
+        limit: Maximum number of campaigns to list
+
+    Returns:
+        str: Alert text
+    """
+    lines = [f"{len(anomalies)} campaign(s) on {day.strftime('%Y-%m-%d')}: "
+             + describe_anomaly_condition(condition_data)]
+
+    for anomaly in anomalies[:limit]:
+        lines.append(f"   {anomaly['Name']}: {anomaly['value']:,.2f} vs {anomaly['baseline']:,.2f} "
+                     f"({anomaly['score']:+.1f})")
+
+    if len(anomalies) > limit:
+        lines.append(f"   ... and {len(anomalies) - limit} more")
+
+    return "\n".join(lines)
@@ -1,10 +1,14 @@
 import logging
-from flask import Blueprint, render_template, redirect, url_for, request, flash
+from datetime import datetime, timedelta
+from flask import Blueprint, render_template, redirect, url_for, request, flash, jsonify
 from flask_login import login_required
 
 from app import app, db
-from models import User, YandexToken, ReportTemplate
+from models import User, YandexToken, ReportTemplate, SchedulerWorker, SchedulerLease, Schedule, Condition
 from auth import admin_required
+from events import user_changed
+from job_pools import get_pool_stats
+from telemetry import summarize_job_runs, JOB_RUN_RETENTION_DAYS
 
 # Set up logging
 logger = logging.getLogger(__name__)
@@ -50,6 +54,7 @@ def edit_user(user_id):
         email = request.form.get('email')
         is_admin = 'is_admin' in request.form
         timezone = request.form.get('timezone', 'UTC')
+        digest_interval = request.form.get('digest_interval', type=int)
         
         # Validate form data
         if not username or not email:
@@ -71,7 +76,9 @@ def edit_user(user_id):
         user.username = username
         user.email = email
         user.is_admin = is_admin
+        timezone_changed = user.timezone != timezone
         user.timezone = timezone
+        user.digest_interval = digest_interval or None
         
         # Update password if provided
         new_password = request.form.get('new_password')
@@ -80,6 +87,10 @@ def edit_user(user_id):
         
         db.session.commit()
         
+        # Scheduled reports run in the user's timezone
+        if timezone_changed:
+            user_changed.send(app, user_id=user_id)
+        
         flash('User updated successfully', 'success')
         return redirect(url_for('admin.users_list'))
     
@@ -101,6 +112,9 @@ def delete_user(user_id):
     db.session.delete(user)
     db.session.commit()
     
+    # Remove jobs of the user's schedules and conditions
+    user_changed.send(app, user_id=user_id)
+    
     flash('User deleted successfully', 'success')
     return redirect(url_for('admin.users_list'))
 
@@ -133,4 +147,54 @@ def templates_list():
     templates = ReportTemplate.query.join(User).order_by(User.username, ReportTemplate.name).all()
     return render_template('admin/templates.html', templates=templates)
 
+@admin_bp.route('/scheduler')
+@login_required
+@admin_required
+def scheduler_pools():
+    """Queue depth and wait times of the scheduler pools"""
+    pools = get_pool_stats()
+    
+    user_ids = {user['user_id'] for pool in pools for user in pool['users']}
+    usernames = dict(db.session.query(User.id, User.username).filter(User.id.in_(user_ids))) if user_ids else {}
+    
+    # Живые процессы планировщика и их разделы
+    now = datetime.utcnow()
+    leases = SchedulerLease.query.filter(SchedulerLease.expires_at > now).all()
+    partitions = {}
+    for lease in leases:
+        partitions.setdefault(lease.holder, []).append(lease.name)
+    workers = SchedulerWorker.query.order_by(SchedulerWorker.started_at).all()
+    
+    return render_template('admin/scheduler.html', pools=pools, usernames=usernames,
+                           workers=workers, partitions=partitions, now=now)
+
+@admin_bp.route('/scheduler/stats')
+@login_required
+@admin_required
+def scheduler_pools_stats():
+    """Scheduler pool statistics as JSON for monitoring"""
+    return jsonify(get_pool_stats())
+
+@admin_bp.route('/scheduler/jobs')
+@login_required
+@admin_required
+def scheduler_jobs():
+    """Durations of scheduler jobs and the slowest schedules, conditions and accounts"""
+    days = min(max(request.args.get('days', 1, type=int), 1), JOB_RUN_RETENTION_DAYS)
+    summary = summarize_job_runs(datetime.utcnow() - timedelta(days=days))
+    
+    def names(model, column, items):
+        ids = [item['id'] for item in items]
+        return dict(db.session.query(model.id, column).filter(model.id.in_(ids))) if ids else {}
+    
+    schedule_names = names(Schedule, Schedule.name, summary['schedules'])
+    condition_names = names(Condition, Condition.name, summary['conditions'])
+    account_ids = [item['id'] for item in summary['accounts']]
+    account_names = {token.id: token.display_name
+                     for token in YandexToken.query.filter(YandexToken.id.in_(account_ids))} if account_ids else {}
+    
+    return render_template('admin/jobs.html', summary=summary, days=days,
+                           schedule_names=schedule_names, condition_names=condition_names,
+                           account_names=account_names)
+
 # Blueprint будет зарегистрирован в main.py
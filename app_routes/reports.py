@@ -1,18 +1,113 @@
 import json
 import logging
-import pandas as pd
 from flask import Blueprint, render_template, redirect, url_for, request, flash, jsonify, Response
 from flask_login import login_required, current_user
 from datetime import datetime
 
 from app import app, db
-from models import ReportTemplate, Schedule, Condition, Report
-from yandex_direct import get_user_client
-from report_generator import generate_report, get_date_range
+from models import ReportTemplate, Schedule, Condition, Report, YandexToken, ReportJob
+from yandex_direct import get_user_tokens
+from report_generator import get_date_range, expand_report_data, COMPARISON_TYPES
+from anomalies import is_anomaly_condition, parse_anomaly_condition
+from events import schedule_changed, condition_changed, report_requested
+from report_store import expire_queued_jobs
+from sharding import has_live_workers
 
 # Set up logging
 logger = logging.getLogger(__name__)
 
+# Колонки кампаний, которые выводятся на странице отчета
+REPORT_VIEW_COLUMNS = ['Id', 'Name', 'Account', 'Cost', 'Clicks', 'Impressions', 'Ctr',
+                       'Conversions', 'ConversionRate', 'CostPerConversion',
+                       'CostDeltaPct', 'ClicksDeltaPct']
+
+def parse_comparison_form(form):
+    """
+    Read comparison period settings from the template form
+    
+    Args:
+        form: request.form
+        
+    Returns:
+        tuple: (comparison, comparison_date_from, comparison_date_to) or None if invalid
+    """
+    comparison = form.get('comparison', 'NONE')
+    if comparison not in COMPARISON_TYPES:
+        return None
+    
+    if comparison != 'CUSTOM':
+        return comparison, None, None
+    
+    try:
+        date_from = datetime.strptime(form.get('comparison_date_from', ''), '%Y-%m-%d').date()
+        date_to = datetime.strptime(form.get('comparison_date_to', ''), '%Y-%m-%d').date()
+    except ValueError:
+        return None
+    
+    if date_from > date_to:
+        return None
+    
+    return comparison, date_from, date_to
+
+def parse_alert_form(form):
+    """
+    Read the hysteresis and cooldown of a condition from the condition form
+    
+    Hysteresis is a share of each rule threshold (see condition_alerts.relax_rules),
+    so it must stay below 1: a larger margin moves the threshold past zero and
+    the condition would never resolve. Empty fields mean the defaults.
+    
+    Args:
+        form: request.form
+        
+    Returns:
+        tuple: (hysteresis, cooldown) or None if invalid
+    """
+    try:
+        hysteresis = float(form['hysteresis']) if form.get('hysteresis', '').strip() else None
+        cooldown = int(form['cooldown']) if form.get('cooldown', '').strip() else None
+    except ValueError:
+        return None
+    
+    if hysteresis is not None and not 0 <= hysteresis < 1:
+        return None
+    if cooldown is not None and cooldown < 0:
+        return None
+    
+    return hysteresis, cooldown
+
+def parse_accounts_form(form, user_id):
+    """
+    Read the accounts a template or schedule should report on
+    
+    Args:
+        form: request.form with accounts_mode (DEFAULT/TEMPLATE, ALL or SELECTED) and account_ids
+        user_id: Owner of the accounts
+        
+    Returns:
+        tuple: (valid, accounts) where accounts is the JSON value of the
+            accounts column or None for the default
+    """
+    mode = form.get('accounts_mode')
+    if mode == 'ALL':
+        return True, json.dumps('ALL')
+    if mode != 'SELECTED':
+        return True, None
+    
+    account_ids = sorted({int(value) for value in form.getlist('account_ids') if value.isdigit()})
+    if not account_ids:
+        return False, None
+    
+    owned = YandexToken.query.filter(YandexToken.user_id == user_id, YandexToken.id.in_(account_ids)).count()
+    if owned != len(account_ids):
+        return False, None
+    
+    return True, json.dumps(account_ids)
+
+def get_account_choices(user_id):
+    """Get the active accounts a user can select in template and schedule forms"""
+    return YandexToken.query.filter_by(user_id=user_id, is_active=True).order_by(YandexToken.id).all()
+
 # Create Blueprint
 reports_bp = Blueprint('reports', __name__, url_prefix='/reports')
 
@@ -39,8 +134,8 @@ def view_report(report_id):
         flash('Access denied', 'danger')
         return redirect(url_for('reports.reports_list'))
     
-    # Parse the report data
-    report_data = json.loads(report.data_json)
+    # Decode only the columns shown on the page
+    report_data = expand_report_data(report.get_data().to_report_data(REPORT_VIEW_COLUMNS))
     
     return render_template('report.html', report=report, report_data=report_data)
 
@@ -75,13 +170,27 @@ def create_template():
             flash('Name and at least one metric are required', 'danger')
             return redirect(url_for('reports.create_template'))
         
+        comparison = parse_comparison_form(request.form)
+        if not comparison:
+            flash('Invalid comparison period', 'danger')
+            return redirect(url_for('reports.create_template'))
+        
+        accounts_valid, accounts = parse_accounts_form(request.form, current_user.id)
+        if not accounts_valid:
+            flash('Select at least one of your accounts', 'danger')
+            return redirect(url_for('reports.create_template'))
+        
         # Create new template
         template = ReportTemplate(
             user_id=current_user.id,
             name=name,
             description=description,
             metrics=json.dumps(metrics),
-            date_range=date_range
+            date_range=date_range,
+            comparison=comparison[0],
+            comparison_date_from=comparison[1],
+            comparison_date_to=comparison[2],
+            accounts=accounts
         )
         
         db.session.add(template)
@@ -90,7 +199,7 @@ def create_template():
         flash('Report template created successfully', 'success')
         return redirect(url_for('reports.templates_list'))
     
-    return render_template('reports/template_form.html')
+    return render_template('reports/template_form.html', accounts=get_account_choices(current_user.id))
 
 @reports_bp.route('/templates/edit/<int:template_id>', methods=['GET', 'POST'])
 @login_required
@@ -120,11 +229,23 @@ def edit_template(template_id):
             flash('Name and at least one metric are required', 'danger')
             return redirect(url_for('reports.edit_template', template_id=template_id))
         
+        comparison = parse_comparison_form(request.form)
+        if not comparison:
+            flash('Invalid comparison period', 'danger')
+            return redirect(url_for('reports.edit_template', template_id=template_id))
+        
+        accounts_valid, accounts = parse_accounts_form(request.form, template.user_id)
+        if not accounts_valid:
+            flash('Select at least one of your accounts', 'danger')
+            return redirect(url_for('reports.edit_template', template_id=template_id))
+        
         # Update template
         template.name = name
         template.description = description
         template.metrics = json.dumps(metrics)
         template.date_range = date_range
+        template.comparison, template.comparison_date_from, template.comparison_date_to = comparison
+        template.accounts = accounts
         
         db.session.commit()
         
@@ -134,7 +255,8 @@ def edit_template(template_id):
     # Parse template metrics for form
     template_metrics = json.loads(template.metrics)
     
-    return render_template('reports/template_form.html', template=template, template_metrics=template_metrics)
+    return render_template('reports/template_form.html', template=template, template_metrics=template_metrics,
+                           accounts=get_account_choices(template.user_id))
 
 @reports_bp.route('/templates/delete/<int:template_id>', methods=['POST'])
 @login_required
@@ -184,48 +306,68 @@ def generate_report_view():
             flash('Access denied', 'danger')
             return redirect(url_for('reports.generate_report_view'))
         
-        try:
-            # Get user's Yandex Direct client
-            yandex_client = get_user_client(current_user.id)
-            
-            if not yandex_client:
-                flash('Подключите аккаунт Яндекс Директ', 'warning')
-                return redirect(url_for('auth.yandex_authorize'))
-            
-            # Generate the report
-            report_data, summary = generate_report(yandex_client, template)
-            
-            if not report_data:
-                flash('Не удалось сгенерировать отчет - нет данных за выбранный период', 'warning')
-                return redirect(url_for('reports.generate_report_view'))
-                
-        except Exception as e:
-            logger.error(f"Error generating report: {str(e)}")
-            flash('Ошибка доступа к API Яндекс Директ. Пожалуйста, переподключите аккаунт.', 'danger')
-            return redirect(url_for('auth.yandex_authorize'))
+        # Get the Yandex Direct accounts of the template
+        tokens = get_user_tokens(current_user.id, template.get_accounts())
         
-        # Create report record
-        date_from = datetime.strptime(report_data['date_from'], '%Y-%m-%d').date()
-        date_to = datetime.strptime(report_data['date_to'], '%Y-%m-%d').date()
+        if not tokens:
+            flash('Подключите аккаунт Яндекс Директ', 'warning')
+            return redirect(url_for('auth.yandex_authorize'))
         
-        report = Report(
-            user_id=current_user.id,
-            template_id=template.id,
-            title=f"{template.name} - {datetime.now().strftime('%Y-%m-%d %H:%M')}",
-            summary=summary,
-            data_json=json.dumps(report_data),
-            date_from=date_from,
-            date_to=date_to
-        )
+        # The report is built by the scheduler worker, not in this request
+        if not has_live_workers():
+            flash('Фоновый обработчик отчетов не запущен, отчет сейчас построить нельзя. '
+                  'Попробуйте позже или сообщите администратору.', 'danger')
+            return redirect(url_for('reports.generate_report_view'))
         
-        db.session.add(report)
+        job = ReportJob(user_id=current_user.id, template_id=template.id)
+        db.session.add(job)
         db.session.commit()
         
-        flash('Report generated successfully', 'success')
-        return redirect(url_for('reports.view_report', report_id=report.id))
+        report_requested.send(app, job_id=job.id, user_id=current_user.id)
+        
+        return redirect(url_for('reports.report_job_view', job_id=job.id))
     
     return render_template('reports/generate.html', templates=templates)
 
+@reports_bp.route('/jobs/<int:job_id>')
+@login_required
+def report_job_view(job_id):
+    """Wait for a requested report to be built"""
+    job = ReportJob.query.get_or_404(job_id)
+    
+    if job.user_id != current_user.id and not current_user.is_admin:
+        flash('Access denied', 'danger')
+        return redirect(url_for('reports.reports_list'))
+    
+    expire_stale_job(job)
+    if job.status == ReportJob.DONE and job.report_id:
+        flash('Report generated successfully', 'success')
+        return redirect(url_for('reports.view_report', report_id=job.report_id))
+    
+    return render_template('reports/job.html', job=job)
+
+@reports_bp.route('/jobs/<int:job_id>/status')
+@login_required
+def report_job_status(job_id):
+    """Status of a requested report for polling"""
+    job = ReportJob.query.get_or_404(job_id)
+    
+    if job.user_id != current_user.id and not current_user.is_admin:
+        return jsonify({'error': 'Access denied'}), 403
+    
+    expire_stale_job(job)
+    return jsonify({
+        'status': job.status,
+        'finished': job.is_finished,
+        'error': job.error,
+        'url': url_for('reports.report_job_view', job_id=job.id) if job.status == ReportJob.DONE else None
+    })
+
+def expire_stale_job(job):
+    """Fail a requested report that no worker has taken for too long (the page stops waiting)"""
+    if job.status == ReportJob.QUEUED and expire_queued_jobs(ReportJob.id == job.id):
+        db.session.refresh(job)
+
 @reports_bp.route('/schedules', methods=['GET'])
 @login_required
 def schedules_list():
@@ -261,26 +403,32 @@ def create_schedule():
             flash('All fields are required', 'danger')
             return redirect(url_for('reports.create_schedule'))
         
+        accounts_valid, accounts = parse_accounts_form(request.form, current_user.id)
+        if not accounts_valid:
+            flash('Select at least one of your accounts', 'danger')
+            return redirect(url_for('reports.create_schedule'))
+        
         # Create new schedule
         schedule = Schedule(
             user_id=current_user.id,
             template_id=template_id,
             name=name,
             cron_expression=cron_expression,
+            accounts=accounts,
             is_active=is_active
         )
         
         db.session.add(schedule)
         db.session.commit()
         
-        # Restart the scheduler to pick up the new schedule
-        from scheduler import refresh_schedules
-        refresh_schedules()
+        # Let the scheduler add the job for the new schedule
+        schedule_changed.send(app, schedule_id=schedule.id)
         
         flash('Report schedule created successfully', 'success')
         return redirect(url_for('reports.schedules_list'))
     
-    return render_template('reports/schedule_form.html', templates=templates)
+    return render_template('reports/schedule_form.html', templates=templates,
+                           accounts=get_account_choices(current_user.id))
 
 @reports_bp.route('/schedules/edit/<int:schedule_id>', methods=['GET', 'POST'])
 @login_required
@@ -310,22 +458,28 @@ def edit_schedule(schedule_id):
             flash('All fields are required', 'danger')
             return redirect(url_for('reports.edit_schedule', schedule_id=schedule_id))
         
+        accounts_valid, accounts = parse_accounts_form(request.form, schedule.user_id)
+        if not accounts_valid:
+            flash('Select at least one of your accounts', 'danger')
+            return redirect(url_for('reports.edit_schedule', schedule_id=schedule_id))
+        
         # Update schedule
         schedule.name = name
         schedule.template_id = template_id
         schedule.cron_expression = cron_expression
+        schedule.accounts = accounts
         schedule.is_active = is_active
         
         db.session.commit()
         
-        # Restart the scheduler to pick up the updated schedule
-        from scheduler import refresh_schedules
-        refresh_schedules()
+        # Let the scheduler update the job of the schedule
+        schedule_changed.send(app, schedule_id=schedule_id)
         
         flash('Report schedule updated successfully', 'success')
         return redirect(url_for('reports.schedules_list'))
     
-    return render_template('reports/schedule_form.html', schedule=schedule, templates=templates)
+    return render_template('reports/schedule_form.html', schedule=schedule, templates=templates,
+                           accounts=get_account_choices(schedule.user_id))
 
 @reports_bp.route('/schedules/delete/<int:schedule_id>', methods=['POST'])
 @login_required
@@ -343,9 +497,8 @@ def delete_schedule(schedule_id):
     db.session.delete(schedule)
     db.session.commit()
     
-    # Restart the scheduler to remove the deleted schedule
-    from scheduler import refresh_schedules
-    refresh_schedules()
+    # Let the scheduler remove the job of the deleted schedule
+    schedule_changed.send(app, schedule_id=schedule_id)
     
     flash('Report schedule deleted successfully', 'success')
     return redirect(url_for('reports.schedules_list'))
@@ -380,18 +533,36 @@ def create_condition():
         template_id = request.form.get('template_id')
         condition_json = request.form.get('condition_json')
         check_interval = request.form.get('check_interval', 3600)
+        max_check_interval = request.form.get('max_check_interval', type=int)
+        alert_settings = parse_alert_form(request.form)
         is_active = 'is_active' in request.form
         
         if not name or not template_id or not condition_json:
             flash('All fields are required', 'danger')
             return redirect(url_for('reports.create_condition'))
         
+        # Верхняя граница адаптивного интервала проверки (пусто - по умолчанию)
+        if max_check_interval is not None and max_check_interval < int(check_interval):
+            flash('Максимальный интервал проверки не может быть меньше минимального', 'danger')
+            return redirect(url_for('reports.create_condition'))
+        
+        # Гистерезис - доля порога от 0 до 1, пауза - неотрицательное число секунд
+        if alert_settings is None:
+            flash('Гистерезис должен быть от 0 до 1, пауза между срабатываниями - не меньше 0 секунд', 'danger')
+            return redirect(url_for('reports.create_condition'))
+        hysteresis, cooldown = alert_settings
+        
         try:
             # Validate JSON
-            json.loads(condition_json)
+            condition_data = json.loads(condition_json)
+            if is_anomaly_condition(condition_data):
+                parse_anomaly_condition(condition_data)
         except json.JSONDecodeError:
             flash('Invalid condition JSON', 'danger')
             return redirect(url_for('reports.create_condition'))
+        except ValueError as e:
+            flash(f'Invalid anomaly condition: {e}', 'danger')
+            return redirect(url_for('reports.create_condition'))
         
         # Create new condition
         condition = Condition(
@@ -400,15 +571,17 @@ def create_condition():
             name=name,
             condition_json=condition_json,
             check_interval=int(check_interval),
+            max_check_interval=max_check_interval,
+            hysteresis=hysteresis,
+            cooldown=cooldown,
             is_active=is_active
         )
         
         db.session.add(condition)
         db.session.commit()
         
-        # Restart the scheduler to pick up the new condition
-        from scheduler import refresh_schedules
-        refresh_schedules()
+        # Let the scheduler add the job for the new condition
+        condition_changed.send(app, condition_id=condition.id, user_id=condition.user_id)
         
         flash('Report condition created successfully', 'success')
         return redirect(url_for('reports.conditions_list'))
@@ -438,31 +611,51 @@ def edit_condition(condition_id):
         template_id = request.form.get('template_id')
         condition_json = request.form.get('condition_json')
         check_interval = request.form.get('check_interval', 3600)
+        max_check_interval = request.form.get('max_check_interval', type=int)
+        alert_settings = parse_alert_form(request.form)
         is_active = 'is_active' in request.form
         
         if not name or not template_id or not condition_json:
             flash('All fields are required', 'danger')
             return redirect(url_for('reports.edit_condition', condition_id=condition_id))
         
+        # Верхняя граница адаптивного интервала проверки (пусто - по умолчанию)
+        if max_check_interval is not None and max_check_interval < int(check_interval):
+            flash('Максимальный интервал проверки не может быть меньше минимального', 'danger')
+            return redirect(url_for('reports.edit_condition', condition_id=condition_id))
+        
+        # Гистерезис - доля порога от 0 до 1, пауза - неотрицательное число секунд
+        if alert_settings is None:
+            flash('Гистерезис должен быть от 0 до 1, пауза между срабатываниями - не меньше 0 секунд', 'danger')
+            return redirect(url_for('reports.edit_condition', condition_id=condition_id))
+        hysteresis, cooldown = alert_settings
+        
         try:
             # Validate JSON
-            json.loads(condition_json)
+            condition_data = json.loads(condition_json)
+            if is_anomaly_condition(condition_data):
+                parse_anomaly_condition(condition_data)
         except json.JSONDecodeError:
             flash('Invalid condition JSON', 'danger')
             return redirect(url_for('reports.edit_condition', condition_id=condition_id))
+        except ValueError as e:
+            flash(f'Invalid anomaly condition: {e}', 'danger')
+            return redirect(url_for('reports.edit_condition', condition_id=condition_id))
         
         # Update condition
         condition.name = name
         condition.template_id = template_id
         condition.condition_json = condition_json
         condition.check_interval = int(check_interval)
+        condition.max_check_interval = max_check_interval
+        condition.hysteresis = hysteresis
+        condition.cooldown = cooldown
         condition.is_active = is_active
         
         db.session.commit()
         
-        # Restart the scheduler to pick up the updated condition
-        from scheduler import refresh_schedules
-        refresh_schedules()
+        # Let the scheduler update the jobs of the condition
+        condition_changed.send(app, condition_id=condition_id, user_id=condition.user_id)
         
         flash('Report condition updated successfully', 'success')
         return redirect(url_for('reports.conditions_list'))
@@ -481,13 +674,13 @@ def delete_condition(condition_id):
         flash('Access denied', 'danger')
         return redirect(url_for('reports.conditions_list'))
     
-    # Delete the condition
+    # Delete the condition; the owner is kept for the scheduler
+    user_id = condition.user_id
     db.session.delete(condition)
     db.session.commit()
     
-    # Restart the scheduler to remove the deleted condition
-    from scheduler import refresh_schedules
-    refresh_schedules()
+    # Let the scheduler reconcile the ticks of the owner without the deleted condition
+    condition_changed.send(app, condition_id=condition_id, user_id=user_id)
     
     flash('Report condition deleted successfully', 'success')
     return redirect(url_for('reports.conditions_list'))
@@ -504,11 +697,8 @@ def export_report(report_id):
         flash('Access denied', 'danger')
         return redirect(url_for('reports.reports_list'))
     
-    # Parse the report data
-    report_data = json.loads(report.data_json)
-    
-    # Create DataFrame from campaigns data
-    df = pd.DataFrame(report_data.get('campaigns', []))
+    # Create DataFrame directly from the stored campaign columns
+    df = report.get_data().to_dataframe()
     
     if df.empty:
         flash('No data to export', 'warning')
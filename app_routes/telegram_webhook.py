@@ -0,0 +1,36 @@
+import hmac
+import logging
+from flask import Blueprint, request, abort
+
+from telegram_bot import (webhook_runner, TELEGRAM_BOT_TOKEN, TELEGRAM_MODE, TELEGRAM_WEBHOOK_SECRET,
+                          TELEGRAM_WEBHOOK_PATH)
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Create Blueprint
+telegram_bp = Blueprint('telegram', __name__)
+
+@telegram_bp.route(TELEGRAM_WEBHOOK_PATH, methods=['POST'])
+def webhook():
+    """Receive a Telegram update and queue it for the bot handlers"""
+    if TELEGRAM_MODE != 'webhook' or not TELEGRAM_BOT_TOKEN or not TELEGRAM_WEBHOOK_SECRET:
+        abort(404)
+    
+    # Запросы без секрета, заданного при регистрации webhook, пришли не от Telegram
+    secret = request.headers.get('X-Telegram-Bot-Api-Secret-Token', '')
+    if not hmac.compare_digest(secret, TELEGRAM_WEBHOOK_SECRET):
+        abort(403)
+    
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        abort(400)
+    
+    try:
+        webhook_runner.process(data)
+    except Exception as e:
+        # Telegram повторит обновление, если ответ не 2xx
+        logger.exception(f"Could not queue Telegram update {data.get('update_id')}: {e}")
+        abort(503)
+    
+    return '', 200
@@ -0,0 +1,342 @@
+"""
+Микробенчмарки генерации отчетов на синтетических аккаунтах
+
+Измеряет время и пиковую память для process_report_data, generate_summary,
+check_condition_rules, YandexDirectAPI.get_top_active_campaigns и сериализации
+данных отчета (JSON и report_codec) на аккаунтах от 10 до 100k кампаний и
+периодах от 1 до 365 дней. Обращений к API и базе данных нет.
+
+Запуск из корня проекта:
+    python -m benchmarks.report_benchmarks
+    python -m benchmarks.report_benchmarks --campaigns 10 1000 --days 1 30 --repeat 7
+    python -m benchmarks.report_benchmarks --compare benchmarks/results/<commit>.json
+
+Результаты сохраняются в benchmarks/results/<commit>.json; при --compare
+печатается отношение медиан к сохраненному прогону.
+"""
+import argparse
+import gc
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+# Модули приложения импортируют app, которому нужна база данных
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
+from report_codec import LazyReportData, encode_report_data
+from report_generator import (process_report_data, generate_summary, check_condition_rules,
+                              aggregate_daily_stats, prepare_stats_dataframe)
+from yandex_direct import YandexDirectAPI
+
+logger = logging.getLogger(__name__)
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+# Размеры аккаунтов и периодов по умолчанию
+DEFAULT_CAMPAIGNS = [10, 1000, 10000, 100000]
+DEFAULT_DAYS = [1, 30, 365]
+
+# Дневные таблицы больше этого числа строк пропускаются (100k x 365 = 36.5M строк)
+DEFAULT_MAX_DAILY_ROWS = 5_000_000
+
+# Фиксированное зерно - одинаковые данные между прогонами и коммитами
+SEED = 20250601
+
+REPORT_METRICS = ['Impressions', 'Clicks', 'Cost', 'Ctr', 'Conversions']
+
+CONDITION = {
+    'logic': 'AND',
+    'rules': [
+        {'metric': 'Cost', 'operator': '>', 'value': 1000},
+        {'metric': 'Ctr', 'operator': '<', 'value': 5},
+        {'metric': 'Conversions', 'operator': '>=', 'value': 1}
+    ]
+}
+
+
+def make_campaign_stats(campaigns, seed=SEED):
+    """
+    Build per-campaign totals in the layout returned by the reports API
+
+    Args:
+        campaigns: Number of campaigns
+        seed: Random seed
+
+    Returns:
+        pandas.DataFrame: CampaignId, CampaignName and metric columns
+    """
+    rng = np.random.default_rng(seed)
+    impressions = rng.integers(0, 200_000, campaigns)
+    clicks = rng.binomial(impressions, 0.03)
+    return pd.DataFrame({
+        'CampaignId': np.arange(1, campaigns + 1),
+        'CampaignName': [f'Campaign {i}' for i in range(1, campaigns + 1)],
+        'Impressions': impressions,
+        'Clicks': clicks,
+        'Cost': np.round(clicks * rng.gamma(2.0, 15.0, campaigns), 2),
+        'Conversions': rng.binomial(clicks, 0.05).astype(float)
+    })
+
+
+def make_daily_stats(campaigns, days, date_to, seed=SEED):
+    """
+    Build daily campaign statistics in the layout of get_campaign_daily_stats_dataframe
+
+    Args:
+        campaigns: Number of campaigns
+        days: Number of days
+        date_to: Last day of the period (datetime)
+        seed: Random seed
+
+    Returns:
+        pandas.DataFrame: Date, CampaignId, CampaignName and metric columns
+    """
+    rng = np.random.default_rng(seed)
+    rows = campaigns * days
+    dates = pd.date_range(end=date_to, periods=days).strftime('%Y-%m-%d')
+    impressions = rng.integers(0, 5_000, rows)
+    clicks = rng.binomial(impressions, 0.03)
+    return pd.DataFrame({
+        'Date': np.repeat(dates.to_numpy(), campaigns),
+        'CampaignId': np.tile(np.arange(1, campaigns + 1), days),
+        'CampaignName': np.tile(np.array([f'Campaign {i}' for i in range(1, campaigns + 1)], dtype=object), days),
+        'Impressions': impressions,
+        'Clicks': clicks,
+        'Cost': np.round(clicks * rng.gamma(2.0, 15.0, rows), 2),
+        'Conversions': rng.binomial(clicks, 0.05).astype(float)
+    })
+
+
+class FakeDirectClient(YandexDirectAPI):
+    """YandexDirectAPI with in-memory campaigns and statistics"""
+
+    def __init__(self, campaigns, stats_df):
+        super().__init__()
+        self._campaigns = campaigns
+        self._stats_df = stats_df
+
+    def get_campaigns(self, *args, **kwargs):
+        return self._campaigns
+
+    def get_campaign_stats_dataframe(self, *args, **kwargs):
+        return self._stats_df
+
+
+def measure(func, setup=None, repeat=5):
+    """
+    Time a function and record its peak memory
+
+    setup() runs outside the measured region and its result is passed to
+    func; warm-up and memory runs are separate from the timed runs because
+    tracemalloc slows allocations down.
+
+    Args:
+        func: Callable under test
+        setup: Callable building fresh arguments for each run (optional)
+        repeat: Number of timed runs
+
+    Returns:
+        dict: Timing statistics in seconds and peak memory in bytes
+    """
+    def run():
+        args = setup() if setup else ()
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            func(*args)
+            return time.perf_counter() - start
+        finally:
+            gc.enable()
+
+    run()  # прогрев
+    timings = sorted(run() for _ in range(repeat))
+
+    args = setup() if setup else ()
+    gc.collect()
+    tracemalloc.start()
+    try:
+        func(*args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'median': statistics.median(timings),
+        'min': timings[0],
+        'max': timings[-1],
+        'stdev': statistics.stdev(timings) if len(timings) > 1 else 0.0,
+        'runs': repeat,
+        'peak_memory': peak
+    }
+
+
+def campaign_benchmarks(campaigns, repeat):
+    """Benchmarks that depend only on the number of campaigns"""
+    stats = make_campaign_stats(campaigns)
+    previous = make_campaign_stats(campaigns, seed=SEED + 1)
+
+    prepared = prepare_stats_dataframe(stats)
+    report_data = process_report_data(prepared, REPORT_METRICS, previous)
+    comparison = report_data['comparison']
+    payload = encode_report_data(report_data)
+    payload_json = json.dumps(report_data)
+
+    # Отчет за LAST_N_DAYS без поля Date отдает одну строку на кампанию
+    campaign_list = [
+        {'Id': str(i), 'Name': f'Campaign {i}', 'State': 'ON'}
+        for i in range(1, campaigns + 1)
+    ]
+    client = FakeDirectClient(campaign_list, stats)
+
+    results = {
+        'process_report_data': measure(
+            lambda df: process_report_data(prepare_stats_dataframe(df), REPORT_METRICS),
+            setup=lambda: (stats,), repeat=repeat),
+        'process_report_data_comparison': measure(
+            lambda df, prev: process_report_data(prepare_stats_dataframe(df), REPORT_METRICS, prev),
+            setup=lambda: (stats, previous), repeat=repeat),
+        'generate_summary': measure(
+            lambda: generate_summary(prepared, comparison), repeat=repeat),
+        'get_top_active_campaigns': measure(
+            lambda: client.get_top_active_campaigns(limit=10, days=30), repeat=repeat),
+        'check_condition_rules': measure(
+            lambda: check_condition_rules(report_data, CONDITION), repeat=repeat),
+        'json_dumps': measure(lambda: json.dumps(report_data), repeat=repeat),
+        'json_loads': measure(lambda: json.loads(payload_json), repeat=repeat),
+        'codec_encode': measure(lambda: encode_report_data(report_data), repeat=repeat),
+        'codec_decode': measure(
+            lambda: LazyReportData.from_blob(payload).to_report_data(), repeat=repeat),
+        'codec_decode_view': measure(
+            lambda: LazyReportData.from_blob(payload).to_report_data(['Name', 'Cost', 'Clicks']),
+            repeat=repeat)
+    }
+
+    sizes = {'json_bytes': len(payload_json.encode('utf-8')), 'codec_bytes': len(payload)}
+    return results, sizes
+
+
+def daily_benchmarks(campaigns, days, repeat):
+    """Benchmarks over daily statistics (campaigns x days rows)"""
+    date_to = datetime(2025, 5, 31)
+    date_from = date_to - timedelta(days=days - 1)
+    daily = make_daily_stats(campaigns, days, date_to)
+    return {
+        'aggregate_daily_stats': measure(
+            lambda: aggregate_daily_stats(daily, date_from, date_to), repeat=repeat),
+        'daily_report_pipeline': measure(
+            lambda: process_report_data(prepare_stats_dataframe(aggregate_daily_stats(daily, date_from, date_to)),
+                                        REPORT_METRICS),
+            repeat=repeat)
+    }
+
+
+def git_commit():
+    """Get the current commit hash and whether the tree has local changes"""
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True).strip()
+        dirty = bool(subprocess.check_output(['git', 'status', '--porcelain', '--untracked-files=no'], text=True).strip())
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown', False
+
+
+def run_benchmarks(campaign_sizes, day_sizes, repeat, max_daily_rows):
+    """
+    Run all benchmarks over the size grid
+
+    Returns:
+        list: One entry per (benchmark, campaigns, days) with its measurements
+    """
+    entries = []
+
+    for campaigns in campaign_sizes:
+        results, sizes = campaign_benchmarks(campaigns, repeat)
+        for name, stats in results.items():
+            entries.append(dict(benchmark=name, campaigns=campaigns, days=None, **stats))
+        print(f"campaigns={campaigns}: json {sizes['json_bytes']:,} B, codec {sizes['codec_bytes']:,} B")
+
+        for days in day_sizes:
+            if campaigns * days > max_daily_rows:
+                print(f"campaigns={campaigns} days={days}: skipped ({campaigns * days:,} daily rows)")
+                continue
+            for name, stats in daily_benchmarks(campaigns, days, repeat).items():
+                entries.append(dict(benchmark=name, campaigns=campaigns, days=days, **stats))
+
+    return entries
+
+
+def entry_key(entry):
+    return entry['benchmark'], entry['campaigns'], entry['days']
+
+
+def print_results(entries, baseline=None):
+    """Print results, with the ratio to a baseline run if given"""
+    previous = {entry_key(entry): entry for entry in (baseline or {}).get('results', [])}
+
+    print(f"\n{'benchmark':<32}{'campaigns':>10}{'days':>6}{'median ms':>12}{'stdev ms':>10}{'peak MB':>10}"
+          + (f"{'vs base':>9}" if baseline else ''))
+    for entry in entries:
+        line = (f"{entry['benchmark']:<32}{entry['campaigns']:>10}{entry['days'] or '-':>6}"
+                f"{entry['median'] * 1000:>12.3f}{entry['stdev'] * 1000:>10.3f}"
+                f"{entry['peak_memory'] / 2 ** 20:>10.2f}")
+        base = previous.get(entry_key(entry))
+        if base and base['median']:
+            line += f"{entry['median'] / base['median']:>8.2f}x"
+        print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Report generation micro-benchmarks")
+    parser.add_argument('--campaigns', type=int, nargs='+', default=DEFAULT_CAMPAIGNS,
+                        help="Account sizes in campaigns")
+    parser.add_argument('--days', type=int, nargs='+', default=DEFAULT_DAYS,
+                        help="Period lengths in days for daily statistics")
+    parser.add_argument('--repeat', type=int, default=5, help="Timed runs per benchmark")
+    parser.add_argument('--max-daily-rows', type=int, default=DEFAULT_MAX_DAILY_ROWS,
+                        help="Skip daily benchmarks with more rows than this")
+    parser.add_argument('--output', help="Results file (default: benchmarks/results/<commit>.json)")
+    parser.add_argument('--compare', help="Previous results file to compare with")
+    args = parser.parse_args(argv)
+
+    # app включает DEBUG-логирование, которое искажает время
+    logging.getLogger().setLevel(logging.WARNING)
+
+    commit, dirty = git_commit()
+    entries = run_benchmarks(args.campaigns, args.days, args.repeat, args.max_daily_rows)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+    print_results(entries, baseline)
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{commit}{'-dirty' if dirty else ''}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump({
+            'commit': commit,
+            'dirty': dirty,
+            'created_at': datetime.utcnow().isoformat(timespec='seconds'),
+            'python': sys.version.split()[0],
+            'pandas': pd.__version__,
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'repeat': args.repeat,
+            'results': entries
+        }, f, indent=2)
+    print(f"\nSaved results to {output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,366 @@
+"""
+Быстрые ответы бота на /stats, /top и /account
+
+Закрытые периоды (вчера, последние 7 и 30 дней по вчерашний день) считаются
+по локальной статистике (rollups.load_campaign_totals) без запросов к API.
+Сегодняшний день и периоды, которых еще нет в базе, запрашиваются у API
+Директа одним отчетом на аккаунт; ответ хранится в памяти процесса
+BOT_STATS_TTL секунд, поэтому повторные вопросы не тратят баллы, а
+одновременные вопросы об одном аккаунте ждут один запрос.
+
+Состояние кампаний и бюджеты для /account берутся из yandex_campaigns
+(последняя синхронизация кампаний).
+"""
+import os
+import time
+import logging
+import threading
+from datetime import datetime, timedelta
+
+import pandas as pd
+from sqlalchemy import func
+from telegram.helpers import escape_markdown
+
+from app import db
+from models import YandexCampaign
+from rollups import load_campaign_totals
+from yandex_direct import get_user_tokens, get_client_for_token
+from yandex_campaigns import get_campaign_summary
+
+logger = logging.getLogger(__name__)
+
+# Сколько секунд отвечать из кэша, прежде чем снова спросить API
+BOT_STATS_TTL = int(os.environ.get('BOT_STATS_TTL', 300))
+
+# Сколько кампаний показывать в /top по умолчанию и не больше
+BOT_TOP_LIMIT = 5
+BOT_TOP_MAX = 20
+
+# Периоды команд: название и (дней назад от начала, дней назад до конца)
+PERIODS = {
+    'today': ('Today', 0, 0),
+    'yesterday': ('Yesterday', 1, 1),
+    'week': ('Last 7 days', 7, 1),
+    'month': ('Last 30 days', 30, 1)
+}
+DEFAULT_PERIOD = 'today'
+
+METRICS = ['Impressions', 'Clicks', 'Cost', 'Conversions']
+
+
+class TTLCache:
+    """
+    Thread-safe in-memory cache with expiring entries
+
+    Concurrent misses of one key wait for a single load.
+
+    Args:
+        ttl: Seconds an entry stays fresh
+        max_entries: Entries kept at most; expired and then oldest entries are dropped
+    """
+
+    def __init__(self, ttl, max_entries=1000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = {}
+        self._loading = {}
+        self._lock = threading.Lock()
+
+    def get_or_load(self, key, loader):
+        """
+        Get a fresh value or load and store it
+
+        Args:
+            key: Cache key
+            loader: Callable returning the value
+
+        Returns:
+            tuple: (value, loaded_at as datetime)
+        """
+        with self._lock:
+            entry = self._fresh(key)
+            if entry:
+                return entry[1:]
+            key_lock = self._loading.setdefault(key, threading.Lock())
+
+        with key_lock:
+            with self._lock:
+                entry = self._fresh(key)
+                if entry:
+                    return entry[1:]
+
+            try:
+                value = loader()
+            finally:
+                with self._lock:
+                    self._loading.pop(key, None)
+
+            loaded_at = datetime.now()
+            with self._lock:
+                self._entries[key] = (time.monotonic() + self.ttl, value, loaded_at)
+                self._evict()
+
+        return value, loaded_at
+
+    def _fresh(self, key):
+        """Get an unexpired entry (called under the lock)"""
+        entry = self._entries.get(key)
+        if entry and entry[0] > time.monotonic():
+            return entry
+        return None
+
+    def _evict(self):
+        """Drop expired entries, then the oldest ones above max_entries (called under the lock)"""
+        now = time.monotonic()
+        for key in [key for key, entry in self._entries.items() if entry[0] <= now]:
+            del self._entries[key]
+
+        excess = len(self._entries) - self.max_entries
+        if excess > 0:
+            for key in sorted(self._entries, key=lambda key: self._entries[key][0])[:excess]:
+                del self._entries[key]
+
+
+stats_cache = TTLCache(BOT_STATS_TTL)
+
+
+def period_range(period, today=None):
+    """
+    Get the dates of a command period
+
+    Returns:
+        tuple: (date_from, date_to) as dates
+    """
+    today = today or datetime.now().date()
+    _, start, end = PERIODS[period]
+    return today - timedelta(days=start), today - timedelta(days=end)
+
+
+def fetch_campaign_totals(token_id, date_from, date_to):
+    """
+    Get per-campaign totals of an account from the Direct API
+
+    Returns:
+        pandas.DataFrame: Columns CampaignName and METRICS (empty on API errors)
+    """
+    client = get_client_for_token(token_id)
+    if not client:
+        return pd.DataFrame(columns=['CampaignName'] + METRICS)
+
+    df = client.get_campaign_stats_dataframe(
+        date_from=date_from.strftime('%Y-%m-%d'),
+        date_to=date_to.strftime('%Y-%m-%d')
+    )
+    return normalize_totals(df)
+
+
+def normalize_totals(df):
+    """Keep the name and metric columns of campaign totals as numbers"""
+    df = df.reindex(columns=['CampaignName'] + METRICS)
+    for column in METRICS:
+        df[column] = pd.to_numeric(df[column], errors='coerce').fillna(0)
+    return df
+
+
+def account_totals(token, date_from, date_to):
+    """
+    Get per-campaign totals of an account from local data or the cached API report
+
+    Returns:
+        tuple: (pandas.DataFrame, loaded_at) - loaded_at is None for local data
+    """
+    if date_to < datetime.now().date():
+        df = load_campaign_totals(token.id, date_from, date_to)
+        if df is not None:
+            return normalize_totals(df), None
+
+    return stats_cache.get_or_load(
+        (token.id, date_from, date_to),
+        lambda: fetch_campaign_totals(token.id, date_from, date_to)
+    )
+
+
+def collect_totals(user_id, period):
+    """
+    Get per-campaign totals of all active accounts of a user
+
+    Returns:
+        tuple: (pandas.DataFrame with an Account column, list of tokens,
+            oldest API load time or None if all data is local)
+    """
+    date_from, date_to = period_range(period)
+    tokens = get_user_tokens(user_id, 'ALL')
+
+    frames, loaded = [], []
+    for token in tokens:
+        df, loaded_at = account_totals(token, date_from, date_to)
+        frames.append(df.assign(Account=token.display_name))
+        if loaded_at:
+            loaded.append(loaded_at)
+
+    df = pd.concat(frames, ignore_index=True) if frames else normalize_totals(pd.DataFrame())
+    return df, tokens, min(loaded, default=None)
+
+
+def format_number(value, decimals=0):
+    """Format a number with space grouping: 12 345.67"""
+    return f"{value:,.{decimals}f}".replace(',', ' ')
+
+
+def format_source(loaded_at):
+    """Footer line telling where the numbers come from"""
+    if loaded_at is None:
+        return "_Local statistics_"
+    return f"_Direct API data as of {loaded_at.strftime('%H:%M')}_"
+
+
+def parse_period(args):
+    """
+    Get the period from command arguments
+
+    Returns:
+        str: Period key, or None if the argument is unknown
+    """
+    words = [arg.lower() for arg in args if not arg.isdigit()]
+    if not words:
+        return DEFAULT_PERIOD
+    return words[0] if words[0] in PERIODS else None
+
+
+def period_help():
+    """List of periods for error messages"""
+    return ", ".join(PERIODS)
+
+
+def build_stats_message(user_id, args):
+    """
+    Build the answer to /stats [period]
+
+    Must be called inside an application context.
+
+    Returns:
+        str: Message text in Markdown
+    """
+    period = parse_period(args)
+    if period is None:
+        return f"Unknown period. Use one of: {period_help()}\nExample: /stats yesterday"
+
+    df, tokens, loaded_at = collect_totals(user_id, period)
+    if not tokens:
+        return "⚠️ No active Yandex Direct accounts. Connect an account in the web interface first."
+
+    impressions, clicks, cost, conversions = (df[column].sum() for column in METRICS)
+    lines = [
+        f"📈 *{PERIODS[period][0]}*",
+        "",
+        f"Impressions: {format_number(impressions)}",
+        f"Clicks: {format_number(clicks)}",
+        f"CTR: {clicks / impressions * 100 if impressions else 0:.2f}%",
+        f"Cost: {format_number(cost, 2)}",
+        f"CPC: {format_number(cost / clicks if clicks else 0, 2)}",
+        f"Conversions: {format_number(conversions)}"
+    ]
+
+    if len(tokens) > 1:
+        lines.append("")
+        by_account = df.groupby('Account', sort=False)[['Cost', 'Clicks']].sum()
+        for name, row in by_account.sort_values('Cost', ascending=False).iterrows():
+            lines.append(f"• {escape_markdown(name)}: {format_number(row['Cost'], 2)}, "
+                         f"{format_number(row['Clicks'])} clicks")
+
+    lines += ["", format_source(loaded_at)]
+    return "\n".join(lines)
+
+
+def build_top_message(user_id, args):
+    """
+    Build the answer to /top [period] [N]
+
+    Must be called inside an application context.
+
+    Returns:
+        str: Message text in Markdown
+    """
+    period = parse_period(args)
+    if period is None:
+        return f"Unknown period. Use one of: {period_help()}\nExample: /top week 10"
+
+    limit = next((int(arg) for arg in args if arg.isdigit()), BOT_TOP_LIMIT)
+    limit = min(max(limit, 1), BOT_TOP_MAX)
+
+    df, tokens, loaded_at = collect_totals(user_id, period)
+    if not tokens:
+        return "⚠️ No active Yandex Direct accounts. Connect an account in the web interface first."
+
+    top = df[df['Cost'] > 0].nlargest(limit, 'Cost')
+    lines = [f"🏆 *Top campaigns by cost: {PERIODS[period][0]}*", ""]
+    if top.empty:
+        lines.append("No spend in this period.")
+
+    for number, row in enumerate(top.itertuples(), 1):
+        ctr = row.Clicks / row.Impressions * 100 if row.Impressions else 0
+        account = f" ({escape_markdown(row.Account)})" if len(tokens) > 1 else ""
+        lines.append(f"{number}. {escape_markdown(str(row.CampaignName))}{account}\n"
+                     f"    {format_number(row.Cost, 2)}, {format_number(row.Clicks)} clicks, CTR {ctr:.2f}%")
+
+    lines += ["", format_source(loaded_at)]
+    return "\n".join(lines)
+
+
+def build_account_message(user_id, args):
+    """
+    Build the answer to /account [number]
+
+    Without a number lists the accounts, with a number shows the synced
+    campaigns of that account. Must be called inside an application context.
+
+    Returns:
+        str: Message text in Markdown
+    """
+    tokens = get_user_tokens(user_id, 'ALL')
+    if not tokens:
+        return "⚠️ No active Yandex Direct accounts. Connect an account in the web interface first."
+
+    if not args:
+        counts = dict(db.session.query(YandexCampaign.token_id, func.count(YandexCampaign.id)).filter(
+            YandexCampaign.token_id.in_([token.id for token in tokens]),
+            YandexCampaign.status == 'ON'
+        ).group_by(YandexCampaign.token_id).all())
+
+        lines = ["💼 *Your accounts*", ""]
+        for number, token in enumerate(tokens, 1):
+            default = " (default)" if token.is_default else ""
+            lines.append(f"{number}. {escape_markdown(token.display_name)}{default}: "
+                         f"{counts.get(token.id, 0)} active campaigns")
+        lines += ["", "Send /account 1 to see an account."]
+        return "\n".join(lines)
+
+    if not args[0].isdigit() or not 1 <= int(args[0]) <= len(tokens):
+        return f"Please provide an account number from 1 to {len(tokens)}.\nSend /account to list them."
+
+    token = tokens[int(args[0]) - 1]
+    summary = get_campaign_summary(user_id, token.id)
+    if not summary['campaigns_total']:
+        return (f"💼 *{escape_markdown(token.display_name)}*\n\n"
+                f"No synced campaigns yet. Sync campaigns in the web interface first.")
+
+    lines = [
+        f"💼 *{escape_markdown(token.display_name)}*",
+        "",
+        f"Campaigns: {summary['campaigns_total']} ({summary['active_campaigns']} active, "
+        f"{summary['paused_campaigns']} suspended, {summary['off_campaigns']} off)",
+        f"Impressions: {format_number(summary['total_impressions'])}",
+        f"Clicks: {format_number(summary['total_clicks'])}",
+        f"CTR: {summary['ctr']:.2f}%",
+        f"Cost: {format_number(summary['total_cost'], 2)}",
+        f"CPC: {format_number(summary['avg_cpc'], 2)}",
+        ""
+    ]
+
+    active = [c for c in summary['campaigns'] if c['status'] == 'ON']
+    for campaign in sorted(active, key=lambda c: c['cost'], reverse=True)[:BOT_TOP_LIMIT]:
+        budget = f", budget {format_number(campaign['daily_budget'], 2)}/day" if campaign['daily_budget'] else ""
+        lines.append(f"• {escape_markdown(campaign['name'])}: {format_number(campaign['cost'], 2)}{budget}")
+
+    lines += ["", f"_Last 7 days as of campaign sync {summary['last_updated']}_"]
+    return "\n".join(lines)
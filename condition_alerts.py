@@ -0,0 +1,98 @@
+"""
+Срабатывание условий по фронту
+
+Условие, которое остается истинным, не создает отчет и сообщение на каждой
+проверке. Состояние условия (срабатывает ли оно сейчас, когда сработало и
+когда вернулось в норму) хранится в condition_states, а переходы - в
+condition_events:
+
+    - условие стало истинным - событие fired, отчет и сообщение в Telegram,
+      если с прошлого срабатывания прошло не меньше cooldown секунд;
+      иначе срабатывание откладывается до конца паузы;
+    - срабатывающее условие возвращается в норму (событие resolved), только
+      когда оно ложно и с порогами, сдвинутыми на долю hysteresis в сторону
+      срабатывания, поэтому колебания около порога не дают новых сообщений.
+
+Параметры задаются в условии; без них действуют CONDITION_HYSTERESIS и
+CONDITION_COOLDOWN.
+"""
+import os
+import copy
+import json
+from datetime import timedelta
+
+from app import db
+from models import ConditionEvent
+
+DEFAULT_HYSTERESIS = float(os.environ.get('CONDITION_HYSTERESIS', 0.1))
+DEFAULT_COOLDOWN = int(os.environ.get('CONDITION_COOLDOWN', 3600))
+
+EVENT_FIRED = 'fired'
+EVENT_RESOLVED = 'resolved'
+
+
+def alert_settings(condition):
+    """
+    Get the hysteresis and cooldown of a condition
+
+    Returns:
+        tuple: (hysteresis as a share of the threshold, cooldown in seconds)
+    """
+    hysteresis = condition.hysteresis if condition.hysteresis is not None else DEFAULT_HYSTERESIS
+    cooldown = condition.cooldown if condition.cooldown is not None else DEFAULT_COOLDOWN
+    return hysteresis, cooldown
+
+
+def relax_rules(condition_data, hysteresis):
+    """
+    Move the rule thresholds towards firing by a share of their value
+
+    A firing condition is checked with the relaxed rules, so it resolves only
+    after the metric moves past the threshold by the hysteresis margin.
+
+    Returns:
+        dict: Copy of condition_data with relaxed thresholds
+    """
+    relaxed = copy.deepcopy(condition_data)
+    for rule in relaxed.get('rules', []):
+        value = rule.get('value', 0)
+        margin = abs(value) * hysteresis
+        if rule.get('operator') in ('>', '>='):
+            rule['value'] = value - margin
+        elif rule.get('operator') in ('<', '<='):
+            rule['value'] = value + margin
+    return relaxed
+
+
+def in_cooldown(state, cooldown, now):
+    """Check whether the condition fired less than cooldown seconds ago"""
+    return bool(state.last_triggered_at) and now - state.last_triggered_at < timedelta(seconds=cooldown)
+
+
+def record_event(condition, state, kind, now, details=None, report=None):
+    """
+    Change the firing state of a condition and record the transition
+
+    Args:
+        condition: Condition model instance
+        state: ConditionState of the condition
+        kind: EVENT_FIRED or EVENT_RESOLVED
+        now: Time of the check (UTC)
+        details: Dictionary stored with the event (metric totals, anomaly count)
+        report: Report created for the alert
+    """
+    if kind == EVENT_FIRED:
+        state.is_firing = True
+        state.last_triggered_at = now
+    else:
+        state.is_firing = False
+        state.last_resolved_at = now
+
+    db.session.add(ConditionEvent(
+        condition_id=condition.id,
+        user_id=condition.user_id,
+        kind=kind,
+        created_at=now,
+        details=json.dumps(details) if details else None,
+        report=report
+    ))
@@ -0,0 +1,85 @@
+"""
+Адаптивный интервал проверки условий
+
+Статистика Директа обновляется с задержкой, и у большинства условий между
+проверками итоги отчета не меняются. Для каждого условия в condition_states
+хранятся итоги метрик его правил с последней проверки и текущий интервал:
+
+    - итоги не изменились - интервал удваивается;
+    - метрика подошла к порогу правила ближе чем на NEAR_THRESHOLD - интервал
+      сбрасывается до минимального;
+    - итоги изменились - интервал уменьшается вдвое.
+
+Интервал остается в границах, заданных пользователем: минимальный -
+check_interval условия (с ним срабатывает тик), максимальный -
+max_check_interval или check_interval * DEFAULT_BACKOFF_LIMIT. Тик проверяет
+только условия, срок проверки которых наступил. Условия аномалий считаются
+по дневной истории и проверяются с минимальным интервалом.
+"""
+import os
+
+# Во сколько раз по умолчанию максимальный интервал больше минимального
+DEFAULT_BACKOFF_LIMIT = int(os.environ.get('CONDITION_BACKOFF_LIMIT', 8))
+
+# Относительное расстояние до порога, при котором проверки учащаются
+NEAR_THRESHOLD = float(os.environ.get('CONDITION_NEAR_THRESHOLD', 0.2))
+
+
+def interval_bounds(condition):
+    """
+    Get the minimum and maximum check interval of a condition
+
+    Returns:
+        tuple: (minimum, maximum) in seconds
+    """
+    minimum = condition.check_interval
+    maximum = condition.max_check_interval or minimum * DEFAULT_BACKOFF_LIMIT
+    return minimum, max(minimum, maximum)
+
+
+def rule_totals(report_data, condition_data):
+    """Get the report totals of the metrics used by the condition rules"""
+    totals = report_data.get('totals', {})
+    return {
+        rule['metric']: totals[rule['metric']]
+        for rule in condition_data.get('rules', [])
+        if rule.get('metric') in totals
+    }
+
+
+def is_near_threshold(totals, condition_data):
+    """
+    Check whether a metric is within NEAR_THRESHOLD of the threshold of its rule
+
+    Args:
+        totals: Metric totals from rule_totals
+        condition_data: Dictionary containing condition rules
+    """
+    for rule in condition_data.get('rules', []):
+        value = totals.get(rule.get('metric'))
+        threshold = rule.get('value', 0)
+        if value is None:
+            continue
+        if abs(value - threshold) <= NEAR_THRESHOLD * max(abs(threshold), 1):
+            return True
+    return False
+
+
+def next_interval(interval, bounds, changed, near):
+    """
+    Get the interval until the next check
+
+    Args:
+        interval: Current interval in seconds (None before the first check)
+        bounds: (minimum, maximum) from interval_bounds
+        changed: Whether the totals changed since the previous check
+        near: Whether a metric is close to its threshold
+
+    Returns:
+        int: Interval in seconds
+    """
+    minimum, maximum = bounds
+    if interval is None or near:
+        return minimum
+    interval = interval // 2 if changed else interval * 2
+    return min(maximum, max(minimum, interval))
@@ -0,0 +1,24 @@
+"""
+Сигналы об изменениях, влияющих на задачи планировщика
+
+Блюпринты отправляют сигналы после commit. Планировщик, если он запущен в
+этом процессе, подписывается на них в init_scheduler и сразу обновляет
+только затронутые задачи (или берет в работу запрошенный отчет); без
+подписчиков сигналы ничего не делают.
+"""
+from blinker import Namespace
+
+signals = Namespace()
+
+# Отправитель - приложение Flask, аргумент schedule_id
+schedule_changed = signals.signal('schedule-changed')
+
+# Отправитель - приложение Flask, аргументы condition_id, user_id (владелец условия;
+# после удаления условие уже не загрузить)
+condition_changed = signals.signal('condition-changed')
+
+# Отправитель - приложение Flask, аргумент user_id (часовой пояс, удаление пользователя)
+user_changed = signals.signal('user-changed')
+
+# Отправитель - приложение Flask, аргументы job_id, user_id (отчет поставлен в очередь report_jobs)
+report_requested = signals.signal('report-requested')
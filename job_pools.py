@@ -0,0 +1,384 @@
+"""
+Пулы выполнения задач планировщика
+
+APScheduler только ставит задачу в очередь пула, выполняют ее рабочие
+потоки пула. Отчеты и проверки условий выполняются в разных пулах, поэтому
+сотни проверок одного пользователя не задерживают утренние отчеты.
+
+Внутри пула:
+    - у каждого пользователя своя очередь; очереди обслуживаются по схеме
+      start-time fair queueing: задача получает метку max(V, метка конца
+      предыдущей задачи пользователя), а ее стоимость делится на вес
+      пользователя. Выполняется задача с наименьшей меткой, поэтому
+      пользователь с длинной очередью не вытесняет остальных;
+    - одновременно выполняется не больше user_limit задач пользователя;
+    - задача с ключом, который уже в очереди или выполняется, не
+      добавляется повторно.
+
+Лимит задач, обращающихся к одному аккаунту Директа, общий для всех пулов
+(AccountSlots): отчеты и проверки условий одного аккаунта вместе не
+превышают его.
+"""
+import os
+import time
+import logging
+import threading
+from collections import Counter, deque
+
+logger = logging.getLogger(__name__)
+
+# Сколько последних ожиданий хранить для перцентилей
+WAIT_SAMPLES = 1000
+
+# Задача, которую выполняет текущий рабочий поток
+_local = threading.local()
+
+
+def current_task():
+    """Get the pool task run by the current thread, or None outside pool workers"""
+    return getattr(_local, 'task', None)
+
+
+class PoolTask:
+    """A queued pool task"""
+
+    __slots__ = ('key', 'user_id', 'accounts', 'func', 'args', 'enqueued_at', 'started_at', 'start_tag')
+
+    def __init__(self, key, user_id, accounts, func, args, start_tag):
+        self.key = key
+        self.user_id = user_id
+        self.accounts = accounts
+        self.func = func
+        self.args = args
+        self.enqueued_at = time.monotonic()
+        self.started_at = None
+        self.start_tag = start_tag
+
+
+class AccountSlots:
+    """
+    Per-account cap on running tasks shared by several pools
+
+    Args:
+        limit: Maximum number of running tasks using one account
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self._lock = threading.Lock()
+        self._running = Counter()
+        self._pools = []
+
+    def try_acquire(self, accounts):
+        """
+        Take a slot of every account if all of them are below the cap
+
+        Returns:
+            bool: True if the slots were taken
+        """
+        with self._lock:
+            if any(self._running[account] >= self.limit for account in accounts):
+                return False
+            self._running.update(accounts)
+            return True
+
+    def release(self, accounts):
+        """Free the slots taken by try_acquire"""
+        with self._lock:
+            for account in accounts:
+                self._running[account] -= 1
+                if not self._running[account]:
+                    del self._running[account]
+
+    def notify(self, source):
+        """
+        Wake the workers of the other pools after slots were freed
+
+        Called without holding the lock of source, so two pools never wait
+        for each other's locks.
+        """
+        for pool in self._pools:
+            if pool is not source:
+                with pool._cond:
+                    pool._cond.notify_all()
+
+
+class FairPool:
+    """
+    Bounded worker pool with per-user fair queueing and concurrency caps
+
+    Args:
+        name: Pool name for logs and statistics
+        workers: Number of worker threads
+        user_limit: Maximum number of running tasks of one user
+        account_slots: AccountSlots with the per-account cap, shared with other pools
+        max_queue: Maximum number of queued tasks; new tasks are rejected above it
+    """
+
+    def __init__(self, name, workers, user_limit, account_slots, max_queue=10000):
+        self.name = name
+        self.workers = workers
+        self.user_limit = user_limit
+        self.account_slots = account_slots
+        self.max_queue = max_queue
+        account_slots._pools.append(self)
+
+        self._cond = threading.Condition()
+        self._queues = {}
+        self._finish_tags = {}
+        self._virtual_time = 0.0
+        self._keys = set()
+        self._queued = 0
+        self._running_users = Counter()
+        self._threads = []
+        self._stopped = False
+
+        self._waits = deque(maxlen=WAIT_SAMPLES)
+        self._counters = Counter()
+
+    def submit(self, key, user_id, accounts, func, *args, weight=1.0, cost=1.0):
+        """
+        Queue a task
+
+        Args:
+            key: Task key (e.g. job ID); duplicates are skipped
+            user_id: Tenant the task belongs to
+            accounts: IDs of the Yandex Direct accounts the task uses
+            func: Callable to run in a worker thread
+            *args: Arguments for func
+            weight: Share of the tenant relative to other tenants
+            cost: Relative cost of the task (e.g. number of accounts)
+
+        Returns:
+            bool: True if the task was queued
+        """
+        with self._cond:
+            if key in self._keys:
+                self._counters['skipped'] += 1
+                logger.info(f"Pool {self.name}: task {key} is already queued or running, skipped")
+                return False
+
+            if self._queued >= self.max_queue:
+                self._counters['rejected'] += 1
+                logger.error(f"Pool {self.name}: queue is full ({self._queued}), task {key} rejected")
+                return False
+
+            start_tag = max(self._virtual_time, self._finish_tags.get(user_id, 0.0))
+            self._finish_tags[user_id] = start_tag + cost / weight
+
+            task = PoolTask(key, user_id, tuple(accounts), func, args, start_tag)
+            self._queues.setdefault(user_id, deque()).append(task)
+            self._keys.add(key)
+            self._queued += 1
+            self._counters['submitted'] += 1
+
+            self._start_workers()
+            self._cond.notify()
+
+        return True
+
+    def __contains__(self, key):
+        """Check whether a task with the key is queued or running"""
+        with self._cond:
+            return key in self._keys
+
+    def stats(self):
+        """
+        Get queue depth, wait times and counters of the pool
+
+        Returns:
+            dict: Pool statistics (times in seconds)
+        """
+        with self._cond:
+            now = time.monotonic()
+            waits = sorted(self._waits)
+            oldest = min((queue[0].enqueued_at for queue in self._queues.values()), default=None)
+            users = sorted(
+                ((user_id, len(self._queues.get(user_id, ())), self._running_users[user_id])
+                 for user_id in self._queues.keys() | self._running_users.keys()),
+                key=lambda item: (-item[1], -item[2])
+            )
+
+            return {
+                'name': self.name,
+                'workers': self.workers,
+                'user_limit': self.user_limit,
+                'account_limit': self.account_slots.limit,
+                'queued': self._queued,
+                'running': sum(self._running_users.values()),
+                'oldest_wait': now - oldest if oldest is not None else 0.0,
+                'wait_avg': sum(waits) / len(waits) if waits else 0.0,
+                'wait_p95': waits[int(len(waits) * 0.95)] if waits else 0.0,
+                'wait_max': waits[-1] if waits else 0.0,
+                'users': [{'user_id': u, 'queued': q, 'running': r} for u, q, r in users],
+                **{name: self._counters[name] for name in ('submitted', 'completed', 'failed', 'skipped', 'rejected')}
+            }
+
+    def pending(self, user_filter=None):
+        """
+        Count queued and running tasks
+
+        Args:
+            user_filter: Callable taking a user ID; only tasks of users it
+                accepts are counted (all tasks by default)
+
+        Returns:
+            int: Number of queued and running tasks
+        """
+        with self._cond:
+            queued = sum(len(queue) for user_id, queue in self._queues.items()
+                         if user_filter is None or user_filter(user_id))
+            running = sum(count for user_id, count in self._running_users.items()
+                          if user_filter is None or user_filter(user_id))
+        return queued + running
+
+    def clear(self, user_filter=None):
+        """
+        Drop queued tasks; running tasks are not interrupted
+
+        Args:
+            user_filter: Callable taking a user ID; only tasks of users it
+                accepts are dropped (all tasks by default)
+
+        Returns:
+            int: Number of dropped tasks
+        """
+        dropped = 0
+        with self._cond:
+            for user_id in list(self._queues):
+                if user_filter is not None and not user_filter(user_id):
+                    continue
+
+                queue = self._queues.pop(user_id)
+                for task in queue:
+                    self._keys.discard(task.key)
+                dropped += len(queue)
+                if user_id not in self._running_users:
+                    self._finish_tags.pop(user_id, None)
+
+            self._queued -= dropped
+
+        return dropped
+
+    def shutdown(self, wait=True):
+        """Stop worker threads after the running tasks finish; queued tasks are dropped"""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+            threads = list(self._threads)
+
+        if wait:
+            for thread in threads:
+                thread.join()
+
+    def _start_workers(self):
+        """Start worker threads on first use (called under the lock)"""
+        if self._threads:
+            return
+
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"{self.name}-pool-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _is_eligible(self, task):
+        """Check the per-user cap (called under the lock)"""
+        return self._running_users[task.user_id] < self.user_limit
+
+    def _take_task(self):
+        """
+        Remove and return the eligible queue head with the smallest start tag
+
+        Each user's queue is served in order, so a head task blocked by an
+        account cap also holds back the rest of that user's queue. Account
+        slots are taken here; heads are tried by start tag until one gets them.
+        """
+        heads = sorted((queue[0] for queue in self._queues.values() if self._is_eligible(queue[0])),
+                       key=lambda task: task.start_tag)
+        best = next((task for task in heads if self.account_slots.try_acquire(task.accounts)), None)
+
+        if best is None:
+            return None
+
+        queue = self._queues[best.user_id]
+        queue.popleft()
+        if not queue:
+            del self._queues[best.user_id]
+
+        self._queued -= 1
+        self._virtual_time = max(self._virtual_time, best.start_tag)
+        self._running_users[best.user_id] += 1
+        best.started_at = time.monotonic()
+        self._waits.append(best.started_at - best.enqueued_at)
+        return best
+
+    def _release(self, task):
+        """Free the caps held by a finished task (called under the lock)"""
+        self._keys.discard(task.key)
+
+        self._running_users[task.user_id] -= 1
+        if not self._running_users[task.user_id]:
+            del self._running_users[task.user_id]
+            # Простаивающий пользователь не копит ни долг, ни запас
+            if task.user_id not in self._queues:
+                self._finish_tags.pop(task.user_id, None)
+
+        self.account_slots.release(task.accounts)
+
+    def _worker(self):
+        """Worker thread loop"""
+        while True:
+            with self._cond:
+                while True:
+                    if self._stopped:
+                        return
+                    task = self._take_task()
+                    if task:
+                        break
+                    self._cond.wait()
+
+            _local.task = task
+            try:
+                task.func(*task.args)
+                outcome = 'completed'
+            except Exception as e:
+                outcome = 'failed'
+                logger.exception(f"Pool {self.name}: task {task.key} failed: {e}")
+            finally:
+                _local.task = None
+
+            with self._cond:
+                self._counters[outcome] += 1
+                self._release(task)
+                # Освободились лимиты: задачи других пользователей могли стать доступны
+                self._cond.notify_all()
+            # Слоты аккаунтов общие: задачи этих аккаунтов могут ждать и в других пулах
+            if task.accounts:
+                self.account_slots.notify(self)
+
+
+# Лимит задач одного аккаунта Директа, общий для отчетов и проверок условий
+account_slots = AccountSlots(int(os.environ.get('SCHEDULER_ACCOUNT_LIMIT', 2)))
+
+# Отчеты по расписанию: долгие, несколько запросов к API на задачу
+report_pool = FairPool(
+    'reports',
+    workers=int(os.environ.get('SCHEDULER_REPORT_WORKERS', 8)),
+    user_limit=int(os.environ.get('SCHEDULER_REPORT_USER_LIMIT', 2)),
+    account_slots=account_slots
+)
+
+# Проверки условий: частые, одна проверка не должна ждать чужих отчетов
+condition_pool = FairPool(
+    'conditions',
+    workers=int(os.environ.get('SCHEDULER_CONDITION_WORKERS', 4)),
+    user_limit=int(os.environ.get('SCHEDULER_CONDITION_USER_LIMIT', 1)),
+    account_slots=account_slots
+)
+
+POOLS = [report_pool, condition_pool]
+
+
+def get_pool_stats():
+    """Get statistics of all scheduler pools"""
+    return [pool.stats() for pool in POOLS]
@@ -0,0 +1,204 @@
+"""
+Выбор лидера между процессами
+
+В каждом процессе (воркеры gunicorn, реплики) работает LeaderElector, но
+служебные задачи планировщика и бот Telegram запускаются только в процессе,
+который держит аренду - строку в таблице scheduler_leases. Те же аренды
+закрепляют разделы задач за процессами (см. sharding.py).
+
+Лидер продлевает аренду каждые
+LEASE_RENEW_INTERVAL секунд. Если он умер или потерял связь с базой,
+аренда истекает через LEASE_TTL секунд и ее забирает другой процесс.
+
+Захват и продление - один условный UPDATE, поэтому аренду держит не больше
+одного процесса. Лидер, который не смог продлить аренду, слагает роль
+заранее, до истечения аренды. Время берется по часам процесса: расхождение
+часов узлов должно быть заметно меньше LEASE_TTL.
+"""
+import os
+import uuid
+import socket
+import logging
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy.exc import IntegrityError
+
+from app import app, db
+from models import SchedulerLease
+
+logger = logging.getLogger(__name__)
+
+LEASE_TTL = int(os.environ.get('SCHEDULER_LEASE_TTL', 30))
+LEASE_RENEW_INTERVAL = int(os.environ.get('SCHEDULER_LEASE_RENEW_INTERVAL', 10))
+
+
+def make_holder_id():
+    """Build an ID unique to this process"""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def acquire_leases(names, holder, ttl):
+    """
+    Renew the leases held by holder and take over free or expired ones
+
+    Must be called inside an application context; commits the session.
+
+    Args:
+        names: Lease names
+        holder: Holder ID of this process
+        ttl: Lease duration in seconds
+
+    Returns:
+        tuple: (held, expires_at) - set of names held by holder and their expiry
+    """
+    names = list(names)
+    now = datetime.utcnow()
+    expires_at = now + timedelta(seconds=ttl)
+    if not names:
+        return set(), expires_at
+
+    SchedulerLease.query.filter(
+        SchedulerLease.name.in_(names),
+        SchedulerLease.holder == holder
+    ).update({'expires_at': expires_at}, synchronize_session=False)
+
+    SchedulerLease.query.filter(
+        SchedulerLease.name.in_(names),
+        SchedulerLease.holder != holder,
+        SchedulerLease.expires_at < now
+    ).update({'holder': holder, 'acquired_at': now, 'expires_at': expires_at}, synchronize_session=False)
+
+    existing = {name for (name,) in db.session.query(SchedulerLease.name).filter(SchedulerLease.name.in_(names))}
+    for name in names:
+        if name in existing:
+            continue
+        try:
+            with db.session.begin_nested():
+                db.session.add(SchedulerLease(name=name, holder=holder, acquired_at=now, expires_at=expires_at))
+        except IntegrityError:
+            # Другой процесс одновременно создал строку аренды
+            pass
+
+    held = {name for (name,) in db.session.query(SchedulerLease.name).filter(
+        SchedulerLease.name.in_(names),
+        SchedulerLease.holder == holder
+    )}
+    db.session.commit()
+
+    return held, expires_at
+
+
+def release_leases(names, holder):
+    """
+    Expire the leases held by holder so that other processes can take them at once
+
+    Must be called inside an application context; commits the session.
+    """
+    names = list(names)
+    if not names:
+        return
+
+    SchedulerLease.query.filter(
+        SchedulerLease.name.in_(names),
+        SchedulerLease.holder == holder
+    ).update({'expires_at': datetime.utcnow()}, synchronize_session=False)
+    db.session.commit()
+
+
+class LeaderElector:
+    """
+    Hold a named lease and run callbacks when leadership changes
+
+    Callbacks run in the elector thread: on_elected after the lease is
+    acquired, on_lost after it is lost or released.
+
+    Args:
+        name: Lease name
+        on_elected: Callable run when this process becomes the leader
+        on_lost: Callable run when this process stops being the leader
+        ttl: Lease duration in seconds
+        renew_interval: Seconds between renewals (and acquisition attempts)
+    """
+
+    def __init__(self, name, on_elected, on_lost, ttl=LEASE_TTL, renew_interval=LEASE_RENEW_INTERVAL):
+        if renew_interval * 2 > ttl:
+            raise ValueError("Lease TTL must be at least twice the renew interval")
+
+        self.name = name
+        self.holder = make_holder_id()
+        self.on_elected = on_elected
+        self.on_lost = on_lost
+        self.ttl = ttl
+        self.renew_interval = renew_interval
+
+        self.is_leader = False
+        self._valid_until = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start the election thread"""
+        self._thread = threading.Thread(target=self._run, name=f"leader-{self.name}", daemon=True)
+        self._thread.start()
+        logger.info(f"Leader election for {self.name} started as {self.holder}")
+
+    def stop(self):
+        """Stop the election thread and release the lease so another process takes over at once"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+        if self.is_leader:
+            self._demote("lease released")
+            try:
+                with app.app_context():
+                    release_leases([self.name], self.holder)
+            except Exception as e:
+                logger.warning(f"Could not release lease {self.name}: {e}")
+
+    def _run(self):
+        """Election loop"""
+        while not self._stop.is_set():
+            try:
+                with app.app_context():
+                    held = self._acquire_or_renew()
+            except Exception as e:
+                logger.warning(f"Lease {self.name} check failed: {e}")
+                # Без связи с базой лидер слагает роль до того, как аренду заберет другой процесс
+                held = self.is_leader and datetime.utcnow() + timedelta(seconds=self.renew_interval) < self._valid_until
+
+            if held and not self.is_leader:
+                self.is_leader = True
+                logger.info(f"Elected leader for {self.name} as {self.holder}")
+                self._callback(self.on_elected)
+            elif not held and self.is_leader:
+                self._demote("lease lost")
+
+            self._stop.wait(self.renew_interval)
+
+    def _acquire_or_renew(self):
+        """
+        Renew the lease if held, otherwise try to take it over
+
+        Returns:
+            bool: True if this process holds the lease
+        """
+        held, expires_at = acquire_leases([self.name], self.holder, self.ttl)
+        if held:
+            self._valid_until = expires_at
+        return bool(held)
+
+    def _demote(self, reason):
+        """Stop being the leader and run on_lost"""
+        self.is_leader = False
+        self._valid_until = None
+        logger.warning(f"No longer leader for {self.name}: {reason}")
+        self._callback(self.on_lost)
+
+    def _callback(self, callback):
+        """Run a leadership callback, logging errors"""
+        try:
+            callback()
+        except Exception as e:
+            logger.exception(f"Leadership callback for {self.name} failed: {e}")
@@ -0,0 +1,68 @@
+"""
+Выравнивание нагрузки от отчетов по расписанию
+
+Большинство расписаний срабатывает в одну минуту ("0 9 * * 1-5"). Для
+каждого такого расписания добавляется задача предзагрузки, которая
+выполняется раньше номинального времени на постоянное смещение из окна
+[PREFETCH_LEAD, PREFETCH_LEAD + LEVELLING_WINDOW). Предзагрузка строит отчет
+и сохраняет результат (ReportResult для закрытого периода), а основная
+задача в номинальную минуту находит его по ключу содержимого и только
+отправляет, без запросов к API.
+
+Шаблоны с незакрытым периодом (сегодня, текущая неделя или месяц) не
+предзагружаются: их данные к номинальному времени устареют.
+"""
+import os
+import zlib
+from datetime import timedelta
+
+from apscheduler.triggers.base import BaseTrigger
+
+# Ширина окна, по которому распределяются предзагрузки; 0 отключает режим
+LEVELLING_WINDOW = int(os.environ.get('SCHEDULER_LEVELLING_WINDOW', 900))
+
+# Минимальный запас до номинального времени
+PREFETCH_LEAD = int(os.environ.get('SCHEDULER_PREFETCH_LEAD', 120))
+
+# Периоды, которые еще не закрыты в момент отправки
+OPEN_DATE_RANGES = {'TODAY', 'THIS_WEEK_MON_TODAY', 'THIS_MONTH'}
+
+
+def is_levelled(template):
+    """Check whether reports of a template can be prefetched ahead of time"""
+    return LEVELLING_WINDOW > 0 and template.date_range not in OPEN_DATE_RANGES
+
+
+def prefetch_offset(schedule_id):
+    """
+    Get how many seconds before the nominal time a schedule is prefetched
+
+    The offset is derived from the schedule ID, so it is stable across
+    restarts and spreads schedules evenly over the window.
+    """
+    return PREFETCH_LEAD + zlib.crc32(str(schedule_id).encode('utf-8')) % LEVELLING_WINDOW
+
+
+class OffsetCronTrigger(BaseTrigger):
+    """
+    Fire a fixed number of seconds before each fire time of a cron trigger
+
+    Args:
+        cron: CronTrigger with the nominal times
+        offset: Seconds before each nominal time
+    """
+
+    def __init__(self, cron, offset):
+        self.cron = cron
+        self.offset = timedelta(seconds=offset)
+
+    def get_next_fire_time(self, previous_fire_time, now):
+        previous_nominal = previous_fire_time + self.offset if previous_fire_time else None
+        nominal = self.cron.get_next_fire_time(previous_nominal, now + self.offset)
+        return nominal - self.offset if nominal else None
+
+    def __str__(self):
+        return f"{self.cron} - {int(self.offset.total_seconds())}s"
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} ({self.cron!r}, offset={int(self.offset.total_seconds())})>"
@@ -7,7 +7,7 @@ sys.path.insert(0, str(Path(__file__).parent))
 
 from app import app
 # Импортируем из переименованной папки app_routes
-from app_routes import main, auth, reports, admin, diagnostics, account_manager, optimization
+from app_routes import main, auth, reports, admin, diagnostics, account_manager, optimization, telegram_webhook
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG)
@@ -21,10 +21,17 @@ app.register_blueprint(admin.admin_bp)
 app.register_blueprint(diagnostics.diagnostics_bp, url_prefix='/diagnostics')
 app.register_blueprint(account_manager.account_manager)
 app.register_blueprint(optimization.optimization_bp)
+app.register_blueprint(telegram_webhook.telegram_bp)
 
 logger.info("Application initialized and ready")
 
-# Note: Scheduler and Telegram bot are disabled for initial startup
+# Scheduler and Telegram bot run in the background worker (python -m worker),
+# so web and background capacity scale independently; the web process only
+# queues requested reports in report_jobs. init_scheduler is still safe to
+# enable here for a single-process setup: jobs are split into partitions run
+# by one process each (see sharding.py), and the bot runs only in the process
+# elected leader (see leader.py). In webhook mode (TELEGRAM_MODE=webhook) bot
+# updates are handled by the web processes through the telegram_webhook blueprint.
 # from scheduler import init_scheduler
 # init_scheduler()
 
@@ -0,0 +1,84 @@
+"""Store report data in compressed columnar format
+
+Revision ID: 3b9d6c1f2a47
+Revises: 81f22004e647
+Create Date: 2025-06-02 10:12:31.418205
+
+"""
+import json
+
+from alembic import op
+import sqlalchemy as sa
+
+from report_codec import encode_report_data, LazyReportData
+
+
+# revision identifiers, used by Alembic.
+revision = '3b9d6c1f2a47'
+down_revision = '81f22004e647'
+branch_labels = None
+depends_on = None
+
+# Отчеты конвертируются пачками, чтобы не держать всю таблицу в памяти
+BATCH_SIZE = 200
+
+reports = sa.table(
+    'reports',
+    sa.column('id', sa.Integer),
+    sa.column('data_json', sa.Text),
+    sa.column('data_blob', sa.LargeBinary),
+)
+
+
+def upgrade():
+    with op.batch_alter_table('reports', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('data_blob', sa.LargeBinary(), nullable=True))
+        batch_op.alter_column('data_json', existing_type=sa.Text(), nullable=True)
+
+    # Переносим существующие отчеты в новый формат
+    bind = op.get_bind()
+    last_id = 0
+    while True:
+        rows = bind.execute(
+            sa.select(reports.c.id, reports.c.data_json)
+            .where(reports.c.id > last_id, reports.c.data_blob.is_(None), reports.c.data_json.isnot(None))
+            .order_by(reports.c.id)
+            .limit(BATCH_SIZE)
+        ).fetchall()
+        if not rows:
+            break
+
+        for report_id, data_json in rows:
+            bind.execute(
+                reports.update()
+                .where(reports.c.id == report_id)
+                .values(data_blob=encode_report_data(json.loads(data_json)), data_json=None)
+            )
+        last_id = rows[-1][0]
+
+
+def downgrade():
+    bind = op.get_bind()
+    last_id = 0
+    while True:
+        rows = bind.execute(
+            sa.select(reports.c.id, reports.c.data_blob)
+            .where(reports.c.id > last_id, reports.c.data_blob.isnot(None))
+            .order_by(reports.c.id)
+            .limit(BATCH_SIZE)
+        ).fetchall()
+        if not rows:
+            break
+
+        for report_id, data_blob in rows:
+            report_data = LazyReportData.from_blob(data_blob).to_report_data()
+            bind.execute(
+                reports.update()
+                .where(reports.c.id == report_id)
+                .values(data_json=json.dumps(report_data))
+            )
+        last_id = rows[-1][0]
+
+    with op.batch_alter_table('reports', schema=None) as batch_op:
+        batch_op.alter_column('data_json', existing_type=sa.Text(), nullable=False)
+        batch_op.drop_column('data_blob')
@@ -0,0 +1,30 @@
+"""Add scheduler leader lease table
+
+Revision ID: 4f7b2c9e1a63
+Revises: d8f3a2b61e94
+Create Date: 2025-06-16 09:12:44.108327
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4f7b2c9e1a63'
+down_revision = 'd8f3a2b61e94'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('scheduler_leases',
+    sa.Column('name', sa.String(length=64), nullable=False),
+    sa.Column('holder', sa.String(length=128), nullable=False),
+    sa.Column('acquired_at', sa.DateTime(), nullable=False),
+    sa.Column('expires_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+
+
+def downgrade():
+    op.drop_table('scheduler_leases')
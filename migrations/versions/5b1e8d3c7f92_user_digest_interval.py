@@ -0,0 +1,32 @@
+"""Add notification digest interval to users
+
+Revision ID: 5b1e8d3c7f92
+Revises: 3e8d5b2a9c47
+Create Date: 2025-07-04 14:12:09.583160
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b1e8d3c7f92'
+down_revision = '3e8d5b2a9c47'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('digest_interval', sa.Integer(), nullable=True))
+
+    with op.batch_alter_table('notification_outbox', schema=None) as batch_op:
+        batch_op.create_index('ix_notification_outbox_user_status', ['user_id', 'status'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('notification_outbox', schema=None) as batch_op:
+        batch_op.drop_index('ix_notification_outbox_user_status')
+
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.drop_column('digest_interval')
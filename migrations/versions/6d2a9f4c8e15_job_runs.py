@@ -0,0 +1,50 @@
+"""Add scheduler job run journal
+
+Revision ID: 6d2a9f4c8e15
+Revises: b1c7e5d93f08
+Create Date: 2025-06-23 11:05:38.274615
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6d2a9f4c8e15'
+down_revision = 'b1c7e5d93f08'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('job_runs',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('job_type', sa.String(length=32), nullable=False),
+    sa.Column('job_key', sa.String(length=64), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=True),
+    sa.Column('schedule_id', sa.Integer(), nullable=True),
+    sa.Column('accounts', sa.Text(), nullable=True),
+    sa.Column('started_at', sa.DateTime(), nullable=False),
+    sa.Column('finished_at', sa.DateTime(), nullable=False),
+    sa.Column('queue_lag', sa.Float(), nullable=True),
+    sa.Column('duration', sa.Float(), nullable=False),
+    sa.Column('api_calls', sa.Integer(), nullable=True),
+    sa.Column('bytes_downloaded', sa.BigInteger(), nullable=True),
+    sa.Column('units_spent', sa.Integer(), nullable=True),
+    sa.Column('db_time', sa.Float(), nullable=True),
+    sa.Column('db_queries', sa.Integer(), nullable=True),
+    sa.Column('outcome', sa.String(length=16), nullable=False),
+    sa.Column('error', sa.Text(), nullable=True),
+    sa.Column('details', sa.Text(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_job_runs_job_key'), 'job_runs', ['job_key'], unique=False)
+    op.create_index(op.f('ix_job_runs_schedule_id'), 'job_runs', ['schedule_id'], unique=False)
+    op.create_index(op.f('ix_job_runs_started_at'), 'job_runs', ['started_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_job_runs_started_at'), table_name='job_runs')
+    op.drop_index(op.f('ix_job_runs_schedule_id'), table_name='job_runs')
+    op.drop_index(op.f('ix_job_runs_job_key'), table_name='job_runs')
+    op.drop_table('job_runs')
@@ -0,0 +1,48 @@
+"""Add edge-triggered condition alerts
+
+Revision ID: 7a3f19c5d2e6
+Revises: e2b86d0c4a71
+Create Date: 2025-06-30 14:27:03.118549
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7a3f19c5d2e6'
+down_revision = 'e2b86d0c4a71'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('conditions', sa.Column('hysteresis', sa.Float(), nullable=True))
+    op.add_column('conditions', sa.Column('cooldown', sa.Integer(), nullable=True))
+    op.add_column('condition_states', sa.Column('is_firing', sa.Boolean(), nullable=False, server_default=sa.false()))
+    op.add_column('condition_states', sa.Column('last_triggered_at', sa.DateTime(), nullable=True))
+    op.add_column('condition_states', sa.Column('last_resolved_at', sa.DateTime(), nullable=True))
+    op.create_table('condition_events',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('condition_id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('kind', sa.String(length=16), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('details', sa.Text(), nullable=True),
+    sa.Column('report_id', sa.Integer(), nullable=True),
+    sa.ForeignKeyConstraint(['condition_id'], ['conditions.id'], ),
+    sa.ForeignKeyConstraint(['report_id'], ['reports.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_condition_events_condition_id'), 'condition_events', ['condition_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_condition_events_condition_id'), table_name='condition_events')
+    op.drop_table('condition_events')
+    op.drop_column('condition_states', 'last_resolved_at')
+    op.drop_column('condition_states', 'last_triggered_at')
+    op.drop_column('condition_states', 'is_firing')
+    op.drop_column('conditions', 'cooldown')
+    op.drop_column('conditions', 'hysteresis')
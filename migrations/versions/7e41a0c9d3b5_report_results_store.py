@@ -0,0 +1,46 @@
+"""Add content-addressed report results
+
+Revision ID: 7e41a0c9d3b5
+Revises: 3b9d6c1f2a47
+Create Date: 2025-06-04 14:37:02.551904
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7e41a0c9d3b5'
+down_revision = '3b9d6c1f2a47'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('report_results',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('content_key', sa.String(length=64), nullable=False),
+    sa.Column('token_id', sa.Integer(), nullable=False),
+    sa.Column('metrics_key', sa.String(length=512), nullable=False),
+    sa.Column('date_from', sa.Date(), nullable=False),
+    sa.Column('date_to', sa.Date(), nullable=False),
+    sa.Column('data_version', sa.Integer(), nullable=False),
+    sa.Column('summary', sa.Text(), nullable=True),
+    sa.Column('data_blob', sa.LargeBinary(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['token_id'], ['yandex_tokens.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('content_key')
+    )
+
+    with op.batch_alter_table('reports', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('result_id', sa.Integer(), nullable=True))
+        batch_op.create_foreign_key('fk_reports_result_id', 'report_results', ['result_id'], ['id'])
+
+
+def downgrade():
+    with op.batch_alter_table('reports', schema=None) as batch_op:
+        batch_op.drop_constraint('fk_reports_result_id', type_='foreignkey')
+        batch_op.drop_column('result_id')
+
+    op.drop_table('report_results')
@@ -0,0 +1,38 @@
+"""Index updated_at of schedules, conditions and report templates
+
+Revision ID: 8d1f4b6e2c39
+Revises: 5b1e8d3c7f92
+Create Date: 2025-07-08 10:41:27.306514
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8d1f4b6e2c39'
+down_revision = '5b1e8d3c7f92'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('report_templates', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_report_templates_updated_at'), ['updated_at'], unique=False)
+
+    with op.batch_alter_table('schedules', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_schedules_updated_at'), ['updated_at'], unique=False)
+
+    with op.batch_alter_table('conditions', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_conditions_updated_at'), ['updated_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('conditions', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_conditions_updated_at'))
+
+    with op.batch_alter_table('schedules', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_schedules_updated_at'))
+
+    with op.batch_alter_table('report_templates', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_report_templates_updated_at'))
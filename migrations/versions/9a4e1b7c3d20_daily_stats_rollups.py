@@ -0,0 +1,91 @@
+"""Add daily statistics and week/month rollup tables
+
+Revision ID: 9a4e1b7c3d20
+Revises: c52f8e07a6d1
+Create Date: 2025-06-09 15:22:31.407815
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9a4e1b7c3d20'
+down_revision = 'c52f8e07a6d1'
+branch_labels = None
+depends_on = None
+
+
+def _metric_columns():
+    return [
+        sa.Column('impressions', sa.BigInteger(), nullable=True),
+        sa.Column('clicks', sa.BigInteger(), nullable=True),
+        sa.Column('cost', sa.Float(), nullable=True),
+        sa.Column('conversions', sa.Float(), nullable=True),
+    ]
+
+
+def upgrade():
+    op.create_table('campaign_daily_stats',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('token_id', sa.Integer(), nullable=False),
+    sa.Column('campaign_id', sa.String(length=64), nullable=False),
+    sa.Column('campaign_name', sa.String(length=256), nullable=True),
+    sa.Column('date', sa.Date(), nullable=False),
+    *_metric_columns(),
+    sa.ForeignKeyConstraint(['token_id'], ['yandex_tokens.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('token_id', 'campaign_id', 'date', name='uq_campaign_daily_stats')
+    )
+    op.create_index(op.f('ix_campaign_daily_stats_token_id'), 'campaign_daily_stats', ['token_id'], unique=False)
+
+    op.create_table('account_daily_stats',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('token_id', sa.Integer(), nullable=False),
+    sa.Column('date', sa.Date(), nullable=False),
+    *_metric_columns(),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['token_id'], ['yandex_tokens.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('token_id', 'date', name='uq_account_daily_stats')
+    )
+    op.create_index(op.f('ix_account_daily_stats_token_id'), 'account_daily_stats', ['token_id'], unique=False)
+
+    op.create_table('campaign_rollups',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('token_id', sa.Integer(), nullable=False),
+    sa.Column('campaign_id', sa.String(length=64), nullable=False),
+    sa.Column('campaign_name', sa.String(length=256), nullable=True),
+    sa.Column('period', sa.String(length=8), nullable=False),
+    sa.Column('period_start', sa.Date(), nullable=False),
+    *_metric_columns(),
+    sa.ForeignKeyConstraint(['token_id'], ['yandex_tokens.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('token_id', 'campaign_id', 'period', 'period_start', name='uq_campaign_rollups')
+    )
+    op.create_index(op.f('ix_campaign_rollups_token_id'), 'campaign_rollups', ['token_id'], unique=False)
+
+    op.create_table('account_rollups',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('token_id', sa.Integer(), nullable=False),
+    sa.Column('period', sa.String(length=8), nullable=False),
+    sa.Column('period_start', sa.Date(), nullable=False),
+    sa.Column('days_covered', sa.Integer(), nullable=True),
+    *_metric_columns(),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['token_id'], ['yandex_tokens.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('token_id', 'period', 'period_start', name='uq_account_rollups')
+    )
+    op.create_index(op.f('ix_account_rollups_token_id'), 'account_rollups', ['token_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_account_rollups_token_id'), table_name='account_rollups')
+    op.drop_table('account_rollups')
+    op.drop_index(op.f('ix_campaign_rollups_token_id'), table_name='campaign_rollups')
+    op.drop_table('campaign_rollups')
+    op.drop_index(op.f('ix_account_daily_stats_token_id'), table_name='account_daily_stats')
+    op.drop_table('account_daily_stats')
+    op.drop_index(op.f('ix_campaign_daily_stats_token_id'), table_name='campaign_daily_stats')
+    op.drop_table('campaign_daily_stats')
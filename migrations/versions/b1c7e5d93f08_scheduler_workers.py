@@ -0,0 +1,31 @@
+"""Add scheduler worker membership table
+
+Revision ID: b1c7e5d93f08
+Revises: 4f7b2c9e1a63
+Create Date: 2025-06-18 15:27:03.640192
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b1c7e5d93f08'
+down_revision = '4f7b2c9e1a63'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('scheduler_workers',
+    sa.Column('id', sa.String(length=128), nullable=False),
+    sa.Column('started_at', sa.DateTime(), nullable=False),
+    sa.Column('heartbeat_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_scheduler_workers_heartbeat_at'), 'scheduler_workers', ['heartbeat_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_scheduler_workers_heartbeat_at'), table_name='scheduler_workers')
+    op.drop_table('scheduler_workers')
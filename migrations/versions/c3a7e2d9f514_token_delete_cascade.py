@@ -0,0 +1,41 @@
+"""Delete local statistics and detach stored results with their Yandex token
+
+Revision ID: c3a7e2d9f514
+Revises: 8d1f4b6e2c39
+Create Date: 2025-07-09 11:03:52.418266
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c3a7e2d9f514'
+down_revision = '8d1f4b6e2c39'
+branch_labels = None
+depends_on = None
+
+# Таблицы со ссылкой token_id на yandex_tokens и действие при удалении токена.
+# Ограничения созданы без имени, поэтому у них имена PostgreSQL по умолчанию.
+TOKEN_FOREIGN_KEYS = [
+    ('campaign_daily_stats', 'CASCADE'),
+    ('account_daily_stats', 'CASCADE'),
+    ('campaign_rollups', 'CASCADE'),
+    ('account_rollups', 'CASCADE'),
+    ('report_results', 'SET NULL')
+]
+
+
+def upgrade():
+    for table, ondelete in TOKEN_FOREIGN_KEYS:
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.drop_constraint(f'{table}_token_id_fkey', type_='foreignkey')
+            batch_op.create_foreign_key(f'{table}_token_id_fkey', 'yandex_tokens', ['token_id'], ['id'],
+                                        ondelete=ondelete)
+
+
+def downgrade():
+    for table, _ in reversed(TOKEN_FOREIGN_KEYS):
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.drop_constraint(f'{table}_token_id_fkey', type_='foreignkey')
+            batch_op.create_foreign_key(f'{table}_token_id_fkey', 'yandex_tokens', ['token_id'], ['id'])
@@ -0,0 +1,30 @@
+"""Add comparison period to report templates
+
+Revision ID: c52f8e07a6d1
+Revises: 7e41a0c9d3b5
+Create Date: 2025-06-06 11:05:48.120377
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c52f8e07a6d1'
+down_revision = '7e41a0c9d3b5'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('report_templates', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('comparison', sa.String(length=32), nullable=True, server_default='NONE'))
+        batch_op.add_column(sa.Column('comparison_date_from', sa.Date(), nullable=True))
+        batch_op.add_column(sa.Column('comparison_date_to', sa.Date(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('report_templates', schema=None) as batch_op:
+        batch_op.drop_column('comparison_date_to')
+        batch_op.drop_column('comparison_date_from')
+        batch_op.drop_column('comparison')
@@ -0,0 +1,46 @@
+"""Add account selection to templates and schedules
+
+Revision ID: d8f3a2b61e94
+Revises: 9a4e1b7c3d20
+Create Date: 2025-06-12 10:41:07.552913
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd8f3a2b61e94'
+down_revision = '9a4e1b7c3d20'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('report_templates', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('accounts', sa.Text(), nullable=True))
+
+    with op.batch_alter_table('schedules', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('accounts', sa.Text(), nullable=True))
+
+    with op.batch_alter_table('report_results', schema=None) as batch_op:
+        batch_op.alter_column('token_id', existing_type=sa.Integer(), nullable=True)
+
+
+def downgrade():
+    # Сводные результаты не привязаны к одному аккаунту: переносим данные в отчеты и удаляем
+    op.execute(
+        "UPDATE reports SET data_blob = (SELECT r.data_blob FROM report_results r WHERE r.id = reports.result_id), "
+        "result_id = NULL "
+        "WHERE result_id IN (SELECT id FROM report_results WHERE token_id IS NULL)"
+    )
+    op.execute("DELETE FROM report_results WHERE token_id IS NULL")
+
+    with op.batch_alter_table('report_results', schema=None) as batch_op:
+        batch_op.alter_column('token_id', existing_type=sa.Integer(), nullable=False)
+
+    with op.batch_alter_table('schedules', schema=None) as batch_op:
+        batch_op.drop_column('accounts')
+
+    with op.batch_alter_table('report_templates', schema=None) as batch_op:
+        batch_op.drop_column('accounts')
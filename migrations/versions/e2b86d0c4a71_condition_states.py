@@ -0,0 +1,34 @@
+"""Add adaptive condition check intervals
+
+Revision ID: e2b86d0c4a71
+Revises: 9c4e7a1f2b58
+Create Date: 2025-06-27 10:18:44.516032
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2b86d0c4a71'
+down_revision = '9c4e7a1f2b58'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('conditions', sa.Column('max_check_interval', sa.Integer(), nullable=True))
+    op.create_table('condition_states',
+    sa.Column('condition_id', sa.Integer(), nullable=False),
+    sa.Column('totals', sa.Text(), nullable=True),
+    sa.Column('interval', sa.Integer(), nullable=False),
+    sa.Column('checked_at', sa.DateTime(), nullable=False),
+    sa.Column('next_check_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['condition_id'], ['conditions.id'], ),
+    sa.PrimaryKeyConstraint('condition_id')
+    )
+
+
+def downgrade():
+    op.drop_table('condition_states')
+    op.drop_column('conditions', 'max_check_interval')
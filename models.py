@@ -1,6 +1,8 @@
+import json
 from app import db
 from flask_login import UserMixin
 from datetime import datetime
+from report_codec import encode_report_data, LazyReportData
 from werkzeug.security import generate_password_hash, check_password_hash
 
 # User model for authentication
@@ -15,12 +17,15 @@ class User(UserMixin, db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     is_admin = db.Column(db.Boolean, default=False)
     timezone = db.Column(db.String(32), default='UTC')
+    digest_interval = db.Column(db.Integer, nullable=True)  # Секунды; пусто - уведомления отправляются сразу
     
     # Relationships
     yandex_tokens = db.relationship('YandexToken', backref='user', lazy='dynamic', cascade='all, delete-orphan')
     report_templates = db.relationship('ReportTemplate', backref='user', lazy='dynamic', cascade='all, delete-orphan')
     schedules = db.relationship('Schedule', backref='user', lazy='dynamic', cascade='all, delete-orphan')
     conditions = db.relationship('Condition', backref='user', lazy='dynamic', cascade='all, delete-orphan')
+    report_jobs = db.relationship('ReportJob', backref='user', lazy='dynamic', cascade='all, delete-orphan')
+    notifications = db.relationship('NotificationOutbox', backref='user', lazy='dynamic', cascade='all, delete-orphan')
     
     def set_password(self, password):
         self.password_hash = generate_password_hash(password)
@@ -53,9 +58,19 @@ class YandexToken(db.Model):
     # Связь с кампаниями
     campaigns = db.relationship('YandexCampaign', backref='token', lazy='dynamic', cascade='all, delete-orphan')
     
+    # Локальная статистика аккаунта удаляется вместе с ним средствами базы (ondelete='CASCADE')
+    daily_stats = db.relationship('CampaignDailyStat', lazy='dynamic', cascade='all, delete-orphan', passive_deletes=True)
+    account_daily_stats = db.relationship('AccountDailyStat', lazy='dynamic', cascade='all, delete-orphan', passive_deletes=True)
+    campaign_rollups = db.relationship('CampaignRollup', lazy='dynamic', cascade='all, delete-orphan', passive_deletes=True)
+    account_rollups = db.relationship('AccountRollup', lazy='dynamic', cascade='all, delete-orphan', passive_deletes=True)
+    
     def __repr__(self):
-        display_name = self.account_name or self.client_login or f"ID: {self.id}"
-        return f'<YandexToken {display_name}>'
+        return f'<YandexToken {self.display_name}>'
+    
+    @property
+    def display_name(self):
+        """Название аккаунта для отображения пользователю"""
+        return self.account_name or self.client_login or f"ID: {self.id}"
     
     def is_expired(self):
         return datetime.utcnow() > self.expires_at
@@ -78,11 +93,19 @@ class ReportTemplate(db.Model):
     description = db.Column(db.Text, nullable=True)
     metrics = db.Column(db.Text, nullable=False)  # JSON string of metrics to include
     date_range = db.Column(db.String(32), default='LAST_7_DAYS')  # TODAY, YESTERDAY, LAST_7_DAYS, etc.
+    comparison = db.Column(db.String(32), default='NONE')  # NONE, PREVIOUS_PERIOD, SAME_PERIOD_LAST_YEAR, CUSTOM
+    comparison_date_from = db.Column(db.Date, nullable=True)  # Для CUSTOM
+    comparison_date_to = db.Column(db.Date, nullable=True)  # Для CUSTOM
+    accounts = db.Column(db.Text, nullable=True)  # JSON: "ALL" или список ID токенов; пусто - аккаунт по умолчанию
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
     
     def __repr__(self):
         return f'<ReportTemplate {self.name}>'
+    
+    def get_accounts(self):
+        """Возвращает "ALL", список ID токенов или None (аккаунт по умолчанию)"""
+        return json.loads(self.accounts) if self.accounts else None
 
 # Schedule model for timed reports
 class Schedule(db.Model):
@@ -93,15 +116,22 @@ class Schedule(db.Model):
     template_id = db.Column(db.Integer, db.ForeignKey('report_templates.id'), nullable=False)
     name = db.Column(db.String(120), nullable=False)
     cron_expression = db.Column(db.String(120), nullable=False)  # Cron-style schedule expression
+    accounts = db.Column(db.Text, nullable=True)  # JSON: "ALL" или список ID токенов; пусто - аккаунты шаблона
     is_active = db.Column(db.Boolean, default=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
     
     # Relationship
     template = db.relationship('ReportTemplate')
     
     def __repr__(self):
         return f'<Schedule {self.name}>'
+    
+    def get_accounts(self):
+        """Возвращает аккаунты расписания, а если они не заданы - аккаунты шаблона"""
+        if self.accounts:
+            return json.loads(self.accounts)
+        return self.template.get_accounts()
 
 # Condition model for conditional reports
 class Condition(db.Model):
@@ -112,16 +142,67 @@ class Condition(db.Model):
     template_id = db.Column(db.Integer, db.ForeignKey('report_templates.id'), nullable=False)
     name = db.Column(db.String(120), nullable=False)
     condition_json = db.Column(db.Text, nullable=False)  # JSON string of conditions
-    check_interval = db.Column(db.Integer, default=3600)  # Seconds between checks
+    check_interval = db.Column(db.Integer, default=3600)  # Seconds between checks (minimum)
+    max_check_interval = db.Column(db.Integer, nullable=True)  # Верхняя граница адаптивного интервала
+    hysteresis = db.Column(db.Float, nullable=True)  # Доля порога для возврата в норму (см. condition_alerts.py)
+    cooldown = db.Column(db.Integer, nullable=True)  # Секунды между срабатываниями
     is_active = db.Column(db.Boolean, default=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
     
     # Relationship
     template = db.relationship('ReportTemplate')
+    state = db.relationship('ConditionState', uselist=False, cascade='all, delete-orphan')
+    events = db.relationship('ConditionEvent', backref='condition', lazy='dynamic', cascade='all, delete-orphan')
     
     def __repr__(self):
         return f'<Condition {self.name}>'
+    
+    def recent_events(self, limit=5):
+        """Get the latest fired and resolved events"""
+        return self.events.order_by(ConditionEvent.created_at.desc()).limit(limit).all()
+
+# Итоги последней проверки условия и адаптивный интервал (см. condition_polling.py)
+class ConditionState(db.Model):
+    __tablename__ = 'condition_states'
+    
+    condition_id = db.Column(db.Integer, db.ForeignKey('conditions.id'), primary_key=True)
+    totals = db.Column(db.Text, nullable=True)  # JSON: метрика правила -> итог отчета
+    interval = db.Column(db.Integer, nullable=False)  # Текущий интервал в секундах
+    checked_at = db.Column(db.DateTime, nullable=False)
+    next_check_at = db.Column(db.DateTime, nullable=False)
+    is_firing = db.Column(db.Boolean, nullable=False, default=False)
+    last_triggered_at = db.Column(db.DateTime, nullable=True)
+    last_resolved_at = db.Column(db.DateTime, nullable=True)
+    
+    def get_totals(self):
+        """Get the metric totals of the last check"""
+        return json.loads(self.totals) if self.totals else None
+    
+    def __repr__(self):
+        return f'<ConditionState {self.condition_id} {self.interval}s>'
+
+# Срабатывания условий и возвраты в норму
+class ConditionEvent(db.Model):
+    __tablename__ = 'condition_events'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    condition_id = db.Column(db.Integer, db.ForeignKey('conditions.id'), nullable=False, index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    kind = db.Column(db.String(16), nullable=False)  # fired, resolved
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    details = db.Column(db.Text, nullable=True)  # JSON: итоги метрик правил или число аномалий
+    report_id = db.Column(db.Integer, db.ForeignKey('reports.id'), nullable=True)
+    
+    # Relationships
+    report = db.relationship('Report')
+    
+    def get_details(self):
+        """Get event details"""
+        return json.loads(self.details) if self.details else {}
+    
+    def __repr__(self):
+        return f'<ConditionEvent {self.condition_id} {self.kind}>'
 
 # Модель для хранения информации о рекламных кампаниях Яндекс Директа
 class YandexCampaign(db.Model):
@@ -165,9 +246,11 @@ class Report(db.Model):
     token_id = db.Column(db.Integer, db.ForeignKey('yandex_tokens.id'), nullable=True)  # Добавляем связь с конкретным аккаунтом
     schedule_id = db.Column(db.Integer, db.ForeignKey('schedules.id'), nullable=True)
     condition_id = db.Column(db.Integer, db.ForeignKey('conditions.id'), nullable=True)
+    result_id = db.Column(db.Integer, db.ForeignKey('report_results.id'), nullable=True)  # Общие данные для закрытого периода
     title = db.Column(db.String(256), nullable=False)
     summary = db.Column(db.Text, nullable=True)
-    data_json = db.Column(db.Text, nullable=False)  # JSON string of report data
+    data_json = db.deferred(db.Column(db.Text, nullable=True))  # Устаревший формат: JSON string of report data
+    data_blob = db.deferred(db.Column(db.LargeBinary, nullable=True))  # Сжатые колоночные данные (report_codec)
     date_from = db.Column(db.Date, nullable=False)
     date_to = db.Column(db.Date, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -179,9 +262,50 @@ class Report(db.Model):
     token = db.relationship('YandexToken', foreign_keys=[token_id])
     schedule = db.relationship('Schedule', foreign_keys=[schedule_id])
     condition = db.relationship('Condition', foreign_keys=[condition_id])
+    result = db.relationship('ReportResult', foreign_keys=[result_id])
     
     def __repr__(self):
         return f'<Report {self.title}>'
+    
+    def set_data(self, report_data):
+        """Сохраняет данные отчета в сжатом колоночном формате"""
+        self.data_blob = encode_report_data(report_data)
+        self.data_json = None
+    
+    def get_data(self):
+        """
+        Возвращает данные отчета с ленивой распаковкой колонок
+        
+        Returns:
+            LazyReportData: Данные отчета (поддерживаются и старые отчеты в data_json)
+        """
+        if self.data_blob is not None:
+            return LazyReportData.from_blob(self.data_blob)
+        if self.result is not None:
+            return self.result.get_data()
+        return LazyReportData.from_dict(json.loads(self.data_json or '{}'))
+
+# Данные отчета за закрытый период, общие для всех отчетов с тем же ключом
+class ReportResult(db.Model):
+    __tablename__ = 'report_results'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    content_key = db.Column(db.String(64), unique=True, nullable=False)  # sha256 от (токен, метрики, период, версия данных)
+    token_id = db.Column(db.Integer, db.ForeignKey('yandex_tokens.id', ondelete='SET NULL'), nullable=True)  # Пусто для сводных отчетов по нескольким аккаунтам
+    metrics_key = db.Column(db.String(512), nullable=False)  # Отсортированный список метрик шаблона
+    date_from = db.Column(db.Date, nullable=False)
+    date_to = db.Column(db.Date, nullable=False)
+    data_version = db.Column(db.Integer, nullable=False)
+    summary = db.Column(db.Text, nullable=True)
+    data_blob = db.deferred(db.Column(db.LargeBinary, nullable=False))  # Сжатые колоночные данные (report_codec)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<ReportResult {self.token_id} {self.date_from}..{self.date_to}>'
+    
+    def get_data(self):
+        """Возвращает данные отчета с ленивой распаковкой колонок"""
+        return LazyReportData.from_blob(self.data_blob)
 
 # Таблица для хранения результатов оптимизации кампаний
 class CampaignOptimization(db.Model):
@@ -201,3 +325,202 @@ class CampaignOptimization(db.Model):
     
     def __repr__(self):
         return f'<CampaignOptimization id={self.id} user_id={self.user_id}>'
+
+# Дневная статистика кампаний, сохраненная локально для агрегатов
+class CampaignDailyStat(db.Model):
+    __tablename__ = 'campaign_daily_stats'
+    __table_args__ = (
+        db.UniqueConstraint('token_id', 'campaign_id', 'date', name='uq_campaign_daily_stats'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    token_id = db.Column(db.Integer, db.ForeignKey('yandex_tokens.id', ondelete='CASCADE'), nullable=False, index=True)
+    campaign_id = db.Column(db.String(64), nullable=False)
+    campaign_name = db.Column(db.String(256), nullable=True)
+    date = db.Column(db.Date, nullable=False)
+    impressions = db.Column(db.BigInteger, default=0)
+    clicks = db.Column(db.BigInteger, default=0)
+    cost = db.Column(db.Float, default=0.0)
+    conversions = db.Column(db.Float, default=0.0)
+    
+    def __repr__(self):
+        return f'<CampaignDailyStat {self.campaign_id} {self.date}>'
+
+# Дневные итоги аккаунта; наличие строки означает, что день загружен полностью
+class AccountDailyStat(db.Model):
+    __tablename__ = 'account_daily_stats'
+    __table_args__ = (
+        db.UniqueConstraint('token_id', 'date', name='uq_account_daily_stats'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    token_id = db.Column(db.Integer, db.ForeignKey('yandex_tokens.id', ondelete='CASCADE'), nullable=False, index=True)
+    date = db.Column(db.Date, nullable=False)
+    impressions = db.Column(db.BigInteger, default=0)
+    clicks = db.Column(db.BigInteger, default=0)
+    cost = db.Column(db.Float, default=0.0)
+    conversions = db.Column(db.Float, default=0.0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<AccountDailyStat {self.token_id} {self.date}>'
+
+# Итоги кампаний по ISO-неделям и календарным месяцам
+class CampaignRollup(db.Model):
+    __tablename__ = 'campaign_rollups'
+    __table_args__ = (
+        db.UniqueConstraint('token_id', 'campaign_id', 'period', 'period_start', name='uq_campaign_rollups'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    token_id = db.Column(db.Integer, db.ForeignKey('yandex_tokens.id', ondelete='CASCADE'), nullable=False, index=True)
+    campaign_id = db.Column(db.String(64), nullable=False)
+    campaign_name = db.Column(db.String(256), nullable=True)
+    period = db.Column(db.String(8), nullable=False)  # WEEK, MONTH
+    period_start = db.Column(db.Date, nullable=False)  # Понедельник недели или 1-е число месяца
+    impressions = db.Column(db.BigInteger, default=0)
+    clicks = db.Column(db.BigInteger, default=0)
+    cost = db.Column(db.Float, default=0.0)
+    conversions = db.Column(db.Float, default=0.0)
+    
+    def __repr__(self):
+        return f'<CampaignRollup {self.campaign_id} {self.period} {self.period_start}>'
+
+# Итоги аккаунта по ISO-неделям и календарным месяцам
+class AccountRollup(db.Model):
+    __tablename__ = 'account_rollups'
+    __table_args__ = (
+        db.UniqueConstraint('token_id', 'period', 'period_start', name='uq_account_rollups'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    token_id = db.Column(db.Integer, db.ForeignKey('yandex_tokens.id', ondelete='CASCADE'), nullable=False, index=True)
+    period = db.Column(db.String(8), nullable=False)  # WEEK, MONTH
+    period_start = db.Column(db.Date, nullable=False)
+    days_covered = db.Column(db.Integer, default=0)  # Сколько дней периода уже загружено
+    impressions = db.Column(db.BigInteger, default=0)
+    clicks = db.Column(db.BigInteger, default=0)
+    cost = db.Column(db.Float, default=0.0)
+    conversions = db.Column(db.Float, default=0.0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<AccountRollup {self.token_id} {self.period} {self.period_start}>'
+
+# Аренда роли лидера: планировщик работает только в процессе, который держит аренду
+class SchedulerLease(db.Model):
+    __tablename__ = 'scheduler_leases'
+    
+    name = db.Column(db.String(64), primary_key=True)
+    holder = db.Column(db.String(128), nullable=False)  # host:pid:random суффикс процесса
+    acquired_at = db.Column(db.DateTime, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False)
+    
+    def __repr__(self):
+        return f'<SchedulerLease {self.name} {self.holder}>'
+
+# Живые процессы планировщика; разделы задач распределяются между ними
+class SchedulerWorker(db.Model):
+    __tablename__ = 'scheduler_workers'
+    
+    id = db.Column(db.String(128), primary_key=True)  # ID держателя аренды процесса
+    started_at = db.Column(db.DateTime, nullable=False)
+    heartbeat_at = db.Column(db.DateTime, nullable=False, index=True)
+    
+    def __repr__(self):
+        return f'<SchedulerWorker {self.id}>'
+
+# Журнал выполнения задач планировщика (см. telemetry.py)
+class JobRun(db.Model):
+    __tablename__ = 'job_runs'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    job_type = db.Column(db.String(32), nullable=False)  # report, prefetch, conditions, daily_stats, manual_report
+    job_key = db.Column(db.String(64), nullable=False, index=True)
+    user_id = db.Column(db.Integer, nullable=True)  # Без внешних ключей: журнал переживает удаление
+    schedule_id = db.Column(db.Integer, nullable=True, index=True)
+    accounts = db.Column(db.Text, nullable=True)  # JSON список ID токенов
+    started_at = db.Column(db.DateTime, nullable=False, index=True)
+    finished_at = db.Column(db.DateTime, nullable=False)
+    queue_lag = db.Column(db.Float, nullable=True)  # Секунды в очереди пула
+    duration = db.Column(db.Float, nullable=False)
+    api_calls = db.Column(db.Integer, default=0)
+    bytes_downloaded = db.Column(db.BigInteger, default=0)
+    units_spent = db.Column(db.Integer, default=0)
+    db_time = db.Column(db.Float, default=0.0)
+    db_queries = db.Column(db.Integer, default=0)
+    outcome = db.Column(db.String(16), nullable=False)  # success, skipped, error
+    error = db.Column(db.Text, nullable=True)
+    details = db.Column(db.Text, nullable=True)  # JSON, например время проверки каждого условия
+    
+    def get_accounts(self):
+        """Get token IDs used by the run"""
+        return json.loads(self.accounts) if self.accounts else []
+    
+    def get_details(self):
+        """Get run details"""
+        return json.loads(self.details) if self.details else {}
+    
+    def __repr__(self):
+        return f'<JobRun {self.job_key} {self.outcome}>'
+
+# Отчеты, запрошенные из веб-интерфейса; строит их планировщик владельца раздела
+class ReportJob(db.Model):
+    __tablename__ = 'report_jobs'
+    
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    template_id = db.Column(db.Integer, db.ForeignKey('report_templates.id'), nullable=False)
+    report_id = db.Column(db.Integer, db.ForeignKey('reports.id'), nullable=True)
+    status = db.Column(db.String(16), nullable=False, default=QUEUED, index=True)
+    error = db.Column(db.Text, nullable=True)  # Сообщение для пользователя
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    
+    # Relationships
+    template = db.relationship('ReportTemplate')
+    report = db.relationship('Report')
+    
+    @property
+    def is_finished(self):
+        return self.status in (self.DONE, self.FAILED)
+    
+    def __repr__(self):
+        return f'<ReportJob {self.id} {self.status}>'
+
+# Исходящие уведомления: пишутся в одной транзакции с отчетом (см. notifications.py)
+class NotificationOutbox(db.Model):
+    __tablename__ = 'notification_outbox'
+    
+    PENDING = 'pending'
+    SENDING = 'sending'
+    SENT = 'sent'
+    FAILED = 'failed'
+    SKIPPED = 'skipped'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    idempotency_key = db.Column(db.String(128), nullable=False, unique=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    report_id = db.Column(db.Integer, db.ForeignKey('reports.id'), nullable=True)
+    summary = db.Column(db.Text, nullable=True)
+    status = db.Column(db.String(16), nullable=False, default=PENDING)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    claimed_until = db.Column(db.DateTime, nullable=True)  # Отправка другим процессом истекает
+    error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime, nullable=True)
+    
+    __table_args__ = (
+        db.Index('ix_notification_outbox_status_next', 'status', 'next_attempt_at'),
+        db.Index('ix_notification_outbox_user_status', 'user_id', 'status'),
+    )
+    
+    def __repr__(self):
+        return f'<NotificationOutbox {self.idempotency_key} {self.status}>'
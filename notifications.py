@@ -0,0 +1,249 @@
+"""
+Очередь исходящих уведомлений (transactional outbox)
+
+Задача, создавшая отчет, добавляет строку в notification_outbox в той же
+транзакции, что и сам отчет: если процесс завершится после commit,
+уведомление не потеряется, а задача не ждет Telegram.
+
+Диспетчер работает в процессе-лидере (служебная задача планировщика):
+каждые OUTBOX_POLL_INTERVAL секунд он берет пачку ожидающих строк, помечает
+их отправляемыми до claimed_until и передает TelegramSender. Результаты
+возвращаются пачками: доставленные помечаются sent (и отчет -
+sent_to_telegram), временные ошибки повторяются с нарастающей паузой до
+OUTBOX_MAX_ATTEMPTS попыток. Ключ идемпотентности (report:<id>) не дает
+поставить одно уведомление дважды. Если процесс завершится между
+отправкой и отметкой, сообщение уйдет повторно после claimed_until:
+доставка не реже одного раза.
+
+Сводки: если у пользователя задан digest_interval, уведомление получает
+next_attempt_at конца открытого окна (первое уведомление открывает окно на
+digest_interval секунд). Строки одного чата, которые диспетчер взял вместе,
+отправляются одним сообщением со ссылкой на каждый отчет - не больше
+DIGEST_MAX_ITEMS отчетов и TELEGRAM_MESSAGE_LIMIT символов в сообщении.
+"""
+import os
+import logging
+from datetime import datetime, timedelta
+
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+
+from app import app, db
+from models import NotificationOutbox, User, Report
+from telegram import constants
+
+from telegram_bot import TelegramSender, bot, format_report_message, format_digest_message, TELEGRAM_MESSAGE_LIMIT
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_POLL_INTERVAL = int(os.environ.get('OUTBOX_POLL_INTERVAL', 2))
+OUTBOX_BATCH_SIZE = int(os.environ.get('OUTBOX_BATCH_SIZE', 500))
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get('OUTBOX_MAX_ATTEMPTS', 8))
+
+# Сколько строка принадлежит отправителю, прежде чем ее возьмут снова
+OUTBOX_CLAIM_TIMEOUT = int(os.environ.get('OUTBOX_CLAIM_TIMEOUT', 300))
+
+# Сколько дней хранить отправленные строки
+OUTBOX_RETENTION_DAYS = 7
+
+# Сколько отчетов объединять в одно сообщение сводки
+DIGEST_MAX_ITEMS = 10
+
+
+def queue_report_notification(user_id, report, summary):
+    """
+    Add a report notification to the outbox in the current transaction
+
+    The caller commits it together with the report. A notification with the
+    same key is added only once. In digest mode it is due at the end of the
+    user's digest window.
+
+    Args:
+        user_id: User ID
+        report: Report model instance added to the session
+        summary: Report summary text
+    """
+    db.session.flush()
+    key = f"report:{report.id}"
+    due_at = digest_due_at(user_id, datetime.utcnow())
+    try:
+        with db.session.begin_nested():
+            db.session.add(NotificationOutbox(idempotency_key=key, user_id=user_id, report_id=report.id,
+                                              summary=summary, next_attempt_at=due_at))
+    except IntegrityError:
+        logger.info(f"Notification {key} is already queued")
+
+
+def digest_due_at(user_id, now):
+    """
+    Get when a new notification of a user is due
+
+    Returns:
+        datetime: now without a digest, otherwise the end of the open digest
+            window (a new window ends digest_interval seconds from now)
+    """
+    interval = db.session.query(User.digest_interval).filter(User.id == user_id).scalar()
+    if not interval:
+        return now
+
+    # Повторы после ошибок могут ждать дольше окна, они окно не открывают
+    window_end = now + timedelta(seconds=interval)
+    opened = db.session.query(func.min(NotificationOutbox.next_attempt_at)).filter(
+        NotificationOutbox.user_id == user_id,
+        NotificationOutbox.status == NotificationOutbox.PENDING,
+        NotificationOutbox.next_attempt_at > now,
+        NotificationOutbox.next_attempt_at <= window_end
+    ).scalar()
+    return opened or window_end
+
+
+def build_messages(items):
+    """
+    Combine notifications of one chat into messages
+
+    Args:
+        items: Outbox rows with report_id, title, summary, date_from and date_to
+
+    Returns:
+        list: (rows, text, reply_markup) for each message
+    """
+    if len(items) == 1:
+        item = items[0]
+        text, reply_markup = format_report_message(item.report_id, item.title, item.summary,
+                                                   item.date_from, item.date_to)
+        return [(items, text, reply_markup)]
+
+    if len(items) > DIGEST_MAX_ITEMS:
+        return build_messages(items[:DIGEST_MAX_ITEMS]) + build_messages(items[DIGEST_MAX_ITEMS:])
+
+    text, reply_markup = format_digest_message(items)
+    if len(text) > TELEGRAM_MESSAGE_LIMIT:
+        middle = len(items) // 2
+        return build_messages(items[:middle]) + build_messages(items[middle:])
+
+    return [(items, text, reply_markup)]
+
+
+def finish_notifications(results):
+    """
+    Record the results of sent outbox messages (called by the sender)
+
+    Args:
+        results: List of (outbox IDs, error, retryable) from TelegramSender
+    """
+    now = datetime.utcnow()
+    with app.app_context():
+        sent = [outbox_id for tag, error, _ in results if error is None for outbox_id in tag]
+        if sent:
+            NotificationOutbox.query.filter(NotificationOutbox.id.in_(sent)).update(
+                {'status': NotificationOutbox.SENT, 'sent_at': now, 'error': None}, synchronize_session=False
+            )
+            report_ids = db.session.query(NotificationOutbox.report_id).filter(
+                NotificationOutbox.id.in_(sent), NotificationOutbox.report_id.isnot(None)
+            )
+            Report.query.filter(Report.id.in_(report_ids)).update(
+                {'sent_to_telegram': True}, synchronize_session=False
+            )
+
+        failed = {
+            outbox_id: (error, retryable)
+            for tag, error, retryable in results if error is not None
+            for outbox_id in tag
+        }
+        if failed:
+            for notification in NotificationOutbox.query.filter(NotificationOutbox.id.in_(failed)):
+                error, retryable = failed[notification.id]
+                notification.attempts += 1
+                notification.error = error[:1000]
+                notification.claimed_until = None
+                if retryable and notification.attempts < OUTBOX_MAX_ATTEMPTS:
+                    notification.status = NotificationOutbox.PENDING
+                    notification.next_attempt_at = now + timedelta(seconds=min(30 * 2 ** notification.attempts, 3600))
+                else:
+                    notification.status = NotificationOutbox.FAILED
+
+        db.session.commit()
+
+    if failed:
+        logger.warning(f"{len(failed)} notification(s) failed, {len(sent)} sent")
+
+
+# Отправитель уведомлений из очереди
+sender = TelegramSender(bot, on_results=finish_notifications)
+
+
+def dispatch_notifications():
+    """Claim a batch of due outbox rows and hand them to the sender"""
+    # Не брать новые строки, пока отправитель не разобрал прошлую пачку
+    limit = OUTBOX_BATCH_SIZE - sender.queued
+    if limit <= 0:
+        return
+
+    now = datetime.utcnow()
+    with app.app_context():
+        # Строки процесса, который не успел отправить их до claimed_until
+        NotificationOutbox.query.filter(
+            NotificationOutbox.status == NotificationOutbox.SENDING,
+            NotificationOutbox.claimed_until < now
+        ).update({'status': NotificationOutbox.PENDING}, synchronize_session=False)
+
+        ids = [outbox_id for (outbox_id,) in db.session.query(NotificationOutbox.id).filter(
+            NotificationOutbox.status == NotificationOutbox.PENDING,
+            NotificationOutbox.next_attempt_at <= now
+        ).order_by(NotificationOutbox.id).limit(limit)]
+        if not ids:
+            db.session.commit()
+            return
+
+        NotificationOutbox.query.filter(
+            NotificationOutbox.id.in_(ids),
+            NotificationOutbox.status == NotificationOutbox.PENDING
+        ).update({
+            'status': NotificationOutbox.SENDING,
+            'claimed_until': now + timedelta(seconds=OUTBOX_CLAIM_TIMEOUT)
+        }, synchronize_session=False)
+        db.session.commit()
+
+        rows = db.session.query(
+            NotificationOutbox.id, NotificationOutbox.summary, NotificationOutbox.report_id, User.telegram_chat_id,
+            Report.title, Report.date_from, Report.date_to
+        ).join(User, User.id == NotificationOutbox.user_id) \
+            .outerjoin(Report, Report.id == NotificationOutbox.report_id) \
+            .filter(NotificationOutbox.id.in_(ids), NotificationOutbox.status == NotificationOutbox.SENDING) \
+            .all()
+
+        # Пользователь не привязал чат или отчет удален: отправлять некуда
+        skipped = {row.id for row in rows if not row.telegram_chat_id or row.title is None}
+        if skipped:
+            NotificationOutbox.query.filter(NotificationOutbox.id.in_(skipped)).update(
+                {'status': NotificationOutbox.SKIPPED, 'claimed_until': None}, synchronize_session=False
+            )
+            db.session.commit()
+
+    chats = {}
+    for row in sorted(rows, key=lambda row: row.id):
+        if row.id not in skipped:
+            chats.setdefault(row.telegram_chat_id, []).append(row)
+
+    messages = 0
+    for chat_id, items in chats.items():
+        for chunk, text, reply_markup in build_messages(items):
+            sender.send(chat_id, text, parse_mode=constants.ParseMode.MARKDOWN,
+                        reply_markup=reply_markup, tag=tuple(row.id for row in chunk))
+            messages += 1
+
+    logger.info(f"Dispatched {len(rows) - len(skipped)} notification(s) in {messages} message(s), "
+                f"{len(skipped)} skipped")
+
+
+def prune_notifications():
+    """Delete sent and skipped outbox rows older than OUTBOX_RETENTION_DAYS"""
+    with app.app_context():
+        cutoff = datetime.utcnow() - timedelta(days=OUTBOX_RETENTION_DAYS)
+        deleted = NotificationOutbox.query.filter(
+            NotificationOutbox.status.in_([NotificationOutbox.SENT, NotificationOutbox.SKIPPED]),
+            NotificationOutbox.created_at < cutoff
+        ).delete(synchronize_session=False)
+        db.session.commit()
+
+    logger.info(f"Pruned {deleted} sent notifications older than {OUTBOX_RETENTION_DAYS} days")
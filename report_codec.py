@@ -0,0 +1,221 @@
+"""
+Кодек для хранения данных отчетов (Report.data_blob)
+
+Данные отчета хранятся в колоночном виде: каждая колонка таблицы кампаний
+сжимается отдельно, а totals, top_campaigns и прочие поля лежат в общем
+заголовке. Благодаря этому при просмотре отчета распаковываются только
+нужные колонки, а не весь JSON целиком.
+
+Формат blob:
+    MAGIC (4 байта) | длина заголовка (4 байта, big-endian) | заголовок | колонки
+
+Заголовок - сжатый zlib JSON вида:
+    {"codec_version": 1, "meta": {...}, "rows": N,
+     "columns": [[name, offset, length], ...]}
+где offset отсчитывается от конца заголовка.
+"""
+import json
+import struct
+import zlib
+
+import numpy as np
+import pandas as pd
+
+# Сигнатура и версия формата
+MAGIC = b'DPR\x01'
+CODEC_VERSION = 1
+
+# Уровень сжатия zlib: 6 - разумный баланс скорости и размера
+COMPRESSION_LEVEL = 6
+
+_HEADER_LENGTH = struct.Struct('>I')
+
+
+def _json_default(value):
+    """Convert numpy scalars and dates that json cannot serialize natively"""
+    if isinstance(value, np.generic):
+        return value.item()
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _dumps(value):
+    return json.dumps(value, default=_json_default, separators=(',', ':')).encode('utf-8')
+
+
+def _column_names(campaigns):
+    """Collect campaign column names preserving the order of first appearance"""
+    names = {}
+    for row in campaigns:
+        names.update(dict.fromkeys(row))
+    return list(names)
+
+
+def encode_report_data(report_data):
+    """
+    Encode report data into the compressed columnar format
+
+    Args:
+        report_data: Dictionary produced by report_generator.process_report_data
+
+    Returns:
+        bytes: Encoded payload for Report.data_blob
+    """
+    campaigns = report_data.get('campaigns') or []
+    meta = {key: value for key, value in report_data.items() if key != 'campaigns'}
+
+    chunks = []
+    columns = []
+    offset = 0
+    for name in _column_names(campaigns):
+        chunk = zlib.compress(_dumps([row.get(name) for row in campaigns]), COMPRESSION_LEVEL)
+        columns.append([name, offset, len(chunk)])
+        chunks.append(chunk)
+        offset += len(chunk)
+
+    header = zlib.compress(_dumps({
+        'codec_version': CODEC_VERSION,
+        'meta': meta,
+        'rows': len(campaigns),
+        'columns': columns
+    }), COMPRESSION_LEVEL)
+
+    return b''.join([MAGIC, _HEADER_LENGTH.pack(len(header)), header] + chunks)
+
+
+def is_encoded(blob):
+    """Check whether a value looks like a payload produced by encode_report_data"""
+    return isinstance(blob, (bytes, bytearray, memoryview)) and bytes(blob[:len(MAGIC)]) == MAGIC
+
+
+class LazyReportData:
+    """
+    Report data with lazily decoded campaign columns
+
+    Only the header (totals, top lists, dates) is decoded on construction;
+    each campaign column is decompressed on first access.
+    """
+
+    def __init__(self, meta, rows, column_names, loader):
+        """
+        Args:
+            meta: Report data without the campaigns table
+            rows: Number of campaign rows
+            column_names: List of campaign column names
+            loader: Callable returning the list of values for a column name
+        """
+        self.meta = meta
+        self.rows = rows
+        self.column_names = column_names
+        self._loader = loader
+        self._columns = {}
+
+    @classmethod
+    def from_blob(cls, blob):
+        """
+        Read the header of an encoded payload
+
+        Args:
+            blob: bytes produced by encode_report_data
+
+        Returns:
+            LazyReportData: Lazy view over the payload
+        """
+        blob = memoryview(blob)
+        if bytes(blob[:len(MAGIC)]) != MAGIC:
+            raise ValueError("Unknown report payload format")
+
+        start = len(MAGIC) + _HEADER_LENGTH.size
+        (header_length,) = _HEADER_LENGTH.unpack(blob[len(MAGIC):start])
+        header = json.loads(zlib.decompress(blob[start:start + header_length]))
+
+        if header.get('codec_version', 0) > CODEC_VERSION:
+            raise ValueError(f"Unsupported report codec version: {header.get('codec_version')}")
+
+        data_start = start + header_length
+        locations = {name: (offset, length) for name, offset, length in header['columns']}
+
+        def load_column(name):
+            offset, length = locations[name]
+            chunk = blob[data_start + offset:data_start + offset + length]
+            return json.loads(zlib.decompress(chunk))
+
+        return cls(header['meta'], header['rows'], [c[0] for c in header['columns']], load_column)
+
+    @classmethod
+    def from_dict(cls, report_data):
+        """
+        Wrap an already decoded report dictionary (legacy data_json rows)
+
+        Args:
+            report_data: Report data dictionary
+
+        Returns:
+            LazyReportData: View with the same interface as from_blob
+        """
+        campaigns = report_data.get('campaigns') or []
+        meta = {key: value for key, value in report_data.items() if key != 'campaigns'}
+
+        def load_column(name):
+            return [row.get(name) for row in campaigns]
+
+        return cls(meta, len(campaigns), _column_names(campaigns), load_column)
+
+    def column(self, name):
+        """
+        Get the values of a campaign column
+
+        Args:
+            name: Column name
+
+        Returns:
+            list: Column values, one per campaign
+        """
+        if name not in self._columns:
+            self._columns[name] = self._loader(name)
+        return self._columns[name]
+
+    def _select(self, columns):
+        if columns is None:
+            return list(self.column_names)
+        return [name for name in columns if name in self.column_names]
+
+    def campaigns(self, columns=None):
+        """
+        Build campaign rows from the selected columns
+
+        Args:
+            columns: Column names to decode (all columns if None)
+
+        Returns:
+            list: Campaign rows as dictionaries
+        """
+        names = self._select(columns)
+        values = [self.column(name) for name in names]
+        return [dict(zip(names, row)) for row in zip(*values)] if names else [{} for _ in range(self.rows)]
+
+    def to_report_data(self, columns=None):
+        """
+        Rebuild the report data dictionary
+
+        Args:
+            columns: Campaign columns to decode (all columns if None)
+
+        Returns:
+            dict: Report data in the layout produced by process_report_data
+        """
+        return dict(self.meta, campaigns=self.campaigns(columns))
+
+    def to_dataframe(self, columns=None):
+        """
+        Build a DataFrame of campaigns directly from the columns
+
+        Args:
+            columns: Column names to decode (all columns if None)
+
+        Returns:
+            pandas.DataFrame: Campaign table
+        """
+        names = self._select(columns)
+        return pd.DataFrame({name: self.column(name) for name in names}, columns=names)
@@ -1,18 +1,49 @@
 import json
 import logging
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 from datetime import datetime, timedelta
 import numpy as np
+from anomalies import is_anomaly_condition, describe_anomaly_condition
 
 logger = logging.getLogger(__name__)
 
-def generate_report(yandex_client, template):
+# Version of the report payload layout stored in Report.data_json.
+# 1 - top_campaigns hold full campaign rows
+# 2 - top_campaigns hold row positions into campaigns
+REPORT_SCHEMA_VERSION = 2
+
+# Number of campaigns in each top list
+TOP_CAMPAIGNS_LIMIT = 5
+
+# Metrics coerced to numbers before aggregation
+NUMERIC_METRICS = ['Impressions', 'Clicks', 'Cost', 'Ctr', 'AvgCpc',
+                   'Conversions', 'ConversionRate', 'CostPerConversion']
+
+# Additive metrics that can be summed over days; rates are recomputed from them
+ADDITIVE_METRICS = ['Impressions', 'Clicks', 'Cost', 'Conversions']
+
+# Comparison period types for ReportTemplate.comparison
+COMPARISON_TYPES = ['NONE', 'PREVIOUS_PERIOD', 'SAME_PERIOD_LAST_YEAR', 'CUSTOM']
+
+# Metrics compared between periods
+COMPARISON_METRICS = ['Impressions', 'Clicks', 'Cost', 'Ctr',
+                      'Conversions', 'ConversionRate', 'CostPerConversion']
+
+# Per-campaign comparison columns are kept only for the main metrics
+CAMPAIGN_COMPARISON_METRICS = ['Impressions', 'Clicks', 'Cost', 'Conversions']
+
+def generate_report(yandex_client, template, local_stats=None):
     """
     Generate a report based on a template
     
     Args:
         yandex_client: YandexDirectAPI instance
         template: ReportTemplate model instance
+        local_stats: rollups.LocalStats for the account (optional). Closed
+            periods stored locally are read from it instead of the API, and
+            daily statistics fetched from the API are stored into it.
         
     Returns:
         tuple: (report_data_dict, summary_text)
@@ -23,53 +54,141 @@ def generate_report(yandex_client, template):
         
         # Determine date range
         date_from, date_to = get_date_range(template.date_range)
+        comparison_range = get_comparison_range(template, date_from, date_to)
         
         # Get the campaign statistics
         logger.info(f"Requesting data from {date_from} to {date_to}")
         try:
-            # Проверим, есть ли активные кампании в аккаунте
-            campaigns = yandex_client.get_campaigns()
-            if not campaigns or len(campaigns.get('Campaigns', [])) == 0:
-                logger.warning("No active campaigns found in Yandex Direct account")
-                return None, "Нет данных за выбранный период. В аккаунте не найдены активные кампании."
-                
-            logger.info(f"Found {len(campaigns.get('Campaigns', []))} campaigns")
+            df, previous_df = fetch_campaign_stats(yandex_client, date_from, date_to, comparison_range, local_stats)
             
-            # Получаем статистику по кампаниям
-            df = yandex_client.get_campaign_stats_dataframe(
-                date_from=date_from.strftime('%Y-%m-%d'),
-                date_to=date_to.strftime('%Y-%m-%d')
-            )
-            logger.info(f"Received dataframe with shape: {df.shape}")
+            if df is None:
+                return None, "Нет данных за выбранный период. В аккаунте не найдены активные кампании."
             
             if df.empty:
                 logger.warning("Received empty dataframe from Yandex Direct API")
                 return None, "Нет данных за выбранный период. Возможные причины: \n1. В аккаунте нет статистики за указанный период\n2. Выбран некорректный диапазон дат\n3. В API Яндекс Директа временно недоступны данные"
             
-            # Process and aggregate data
-            report_data = process_report_data(df, metrics)
+            # Process and aggregate data; the summary is built from the normalized frame
+            df = prepare_stats_dataframe(df)
+            report_data = process_report_data(df, metrics, previous_df)
         except Exception as e:
             logger.error(f"Error getting campaign stats: {e}")
             return None, f"Ошибка при получении данных: {str(e)}"
         
-        # Generate summary text
-        summary = generate_summary(df)
-        
-        # Add date range to report data
-        report_data['date_from'] = date_from.strftime('%Y-%m-%d')
-        report_data['date_to'] = date_to.strftime('%Y-%m-%d')
-        
-        return report_data, summary
+        return finish_report(df, report_data, template, date_from, date_to, comparison_range)
     except Exception as e:
         logger.exception(f"Error generating report: {e}")
         return None, f"Error generating report: {str(e)}"
 
+def fetch_campaign_stats(yandex_client, date_from, date_to, comparison_range=None, local_stats=None):
+    """
+    Get per-campaign statistics of a period and its comparison period
+    
+    Each period is taken from local daily statistics on its own; only the
+    periods missing there are requested from the API.
+    
+    Args:
+        yandex_client: YandexDirectAPI instance
+        date_from: Start date (datetime)
+        date_to: End date (datetime)
+        comparison_range: Comparison period as (date_from, date_to) or None
+        local_stats: rollups.LocalStats for the account (optional)
+        
+    Returns:
+        tuple: (df, previous_df). previous_df is None without a comparison
+            period; df is None if the account has no active campaigns.
+    """
+    periods = [(date_from, date_to)] + ([comparison_range] if comparison_range else [])
+    
+    # Сначала пробуем локальные агрегаты, каждый период отдельно
+    frames = [local_stats.campaign_totals(*period) if local_stats else None for period in periods]
+    missing = [i for i, frame in enumerate(frames) if frame is None]
+    if not missing:
+        logger.info("Using locally stored statistics")
+        return frames[0], frames[1] if comparison_range else None
+    
+    # Проверим, есть ли активные кампании в аккаунте
+    campaigns = yandex_client.get_campaigns()
+    if not campaigns or len(campaigns.get('Campaigns', [])) == 0:
+        logger.warning("No active campaigns found in Yandex Direct account")
+        return None, None
+        
+    logger.info(f"Found {len(campaigns.get('Campaigns', []))} campaigns")
+    
+    if len(missing) == 2 and ranges_adjacent(*periods):
+        # Смежные периоды получаем одним отчетом с разбивкой по дням
+        span_from, span_to = min(p[0] for p in periods), max(p[1] for p in periods)
+        daily_df = yandex_client.get_campaign_daily_stats_dataframe(
+            date_from=span_from.strftime('%Y-%m-%d'),
+            date_to=span_to.strftime('%Y-%m-%d')
+        )
+        logger.info(f"Received daily dataframe with shape: {daily_df.shape}")
+        if local_stats:
+            local_stats.store_daily(daily_df, span_from, span_to)
+        frames = [aggregate_daily_stats(daily_df, *period) for period in periods]
+    else:
+        # Недостающие периоды без разбивки по дням: между периодами разрыв (год назад,
+        # произвольный период) или один из них уже есть локально. Два запроса идут
+        # параллельно (токен уже обновлен запросом кампаний выше, потокам сессия БД
+        # не нужна); контекст копируется, чтобы запросы попали в журнал задачи
+        with ThreadPoolExecutor(max_workers=len(missing)) as executor:
+            futures = [
+                (i, executor.submit(contextvars.copy_context().run, yandex_client.get_campaign_stats_dataframe,
+                                    date_from=periods[i][0].strftime('%Y-%m-%d'),
+                                    date_to=periods[i][1].strftime('%Y-%m-%d')))
+                for i in missing
+            ]
+        for i, future in futures:
+            frames[i] = future.result()
+            logger.info(f"Received dataframe with shape: {frames[i].shape}")
+    
+    return frames[0], frames[1] if comparison_range else None
+
+def ranges_adjacent(first, second):
+    """Check whether two date ranges overlap or follow each other without a gap"""
+    return second[0] <= first[1] + timedelta(days=1) and first[0] <= second[1] + timedelta(days=1)
+
+def finish_report(df, report_data, template, date_from, date_to, comparison_range=None, accounts=None):
+    """
+    Add period information and build the summary of processed report data
+    
+    Args:
+        df: pandas.DataFrame normalized by prepare_stats_dataframe
+        report_data: Dictionary returned by process_report_data
+        template: ReportTemplate model instance
+        date_from: Start date (datetime)
+        date_to: End date (datetime)
+        comparison_range: Comparison period as (date_from, date_to) or None
+        accounts: Per-account breakdown for multi-account reports (optional)
+        
+    Returns:
+        tuple: (report_data_dict, summary_text)
+    """
+    if comparison_range:
+        report_data['comparison'].update({
+            'type': template.comparison,
+            'date_from': comparison_range[0].strftime('%Y-%m-%d'),
+            'date_to': comparison_range[1].strftime('%Y-%m-%d')
+        })
+    
+    if accounts is not None:
+        report_data['accounts'] = accounts
+    
+    # Generate summary text
+    summary = generate_summary(df, report_data.get('comparison'), accounts)
+    
+    # Add date range to report data
+    report_data['date_from'] = date_from.strftime('%Y-%m-%d')
+    report_data['date_to'] = date_to.strftime('%Y-%m-%d')
+    
+    return report_data, summary
+
 def get_date_range(date_range_str):
     """
     Convert date range string to actual dates
     
     Args:
-        date_range_str: String like 'TODAY', 'YESTERDAY', 'LAST_7_DAYS', etc.
+        date_range_str: String like 'TODAY', 'YESTERDAY', 'LAST_7_DAYS', 'LAST_MONTH', etc.
         
     Returns:
         tuple: (date_from, date_to) as datetime objects
@@ -85,6 +204,14 @@ def get_date_range(date_range_str):
         return today - timedelta(days=7), today - timedelta(days=1)
     elif date_range_str == 'LAST_30_DAYS':
         return today - timedelta(days=30), today - timedelta(days=1)
+    elif date_range_str == 'LAST_WEEK':
+        # Прошлая ISO-неделя целиком (понедельник - воскресенье)
+        monday = today - timedelta(days=today.weekday() + 7)
+        return monday, monday + timedelta(days=6)
+    elif date_range_str == 'LAST_MONTH':
+        # Прошлый календарный месяц целиком
+        last_day = today.replace(day=1) - timedelta(days=1)
+        return last_day.replace(day=1), last_day
     elif date_range_str == 'THIS_WEEK_MON_TODAY':
         days_since_monday = today.weekday()
         return today - timedelta(days=days_since_monday), today
@@ -97,85 +224,302 @@ def get_date_range(date_range_str):
         # Default to last 7 days
         return today - timedelta(days=7), today - timedelta(days=1)
 
-def process_report_data(df, metrics):
+def get_comparison_range(template, date_from, date_to):
+    """
+    Determine the comparison period of a template
+    
+    Args:
+        template: ReportTemplate model instance
+        date_from: Start of the reported period (datetime)
+        date_to: End of the reported period (datetime)
+        
+    Returns:
+        tuple: (compare_from, compare_to) as datetime objects, or None
+    """
+    comparison = template.comparison or 'NONE'
+    
+    if comparison == 'PREVIOUS_PERIOD':
+        compare_to = date_from - timedelta(days=1)
+        return compare_to - (date_to - date_from), compare_to
+    elif comparison == 'SAME_PERIOD_LAST_YEAR':
+        return shift_year(date_from, -1), shift_year(date_to, -1)
+    elif comparison == 'CUSTOM' and template.comparison_date_from and template.comparison_date_to:
+        return (datetime.combine(template.comparison_date_from, datetime.min.time()),
+                datetime.combine(template.comparison_date_to, datetime.min.time()))
+    
+    return None
+
+def shift_year(value, years):
+    """Shift a date by whole years, mapping Feb 29 to Feb 28"""
+    try:
+        return value.replace(year=value.year + years)
+    except ValueError:
+        return value.replace(year=value.year + years, day=28)
+
+def aggregate_daily_stats(daily_df, date_from, date_to):
+    """
+    Sum daily campaign statistics over a date range
+    
+    Rate metrics (Ctr, ConversionRate, ...) are dropped and later
+    recomputed from the summed values by prepare_stats_dataframe.
+    
+    Args:
+        daily_df: pandas.DataFrame with a Date column (YYYY-MM-DD)
+        date_from: Start date (datetime)
+        date_to: End date (datetime)
+        
+    Returns:
+        pandas.DataFrame: One row per campaign
+    """
+    if daily_df.empty:
+        return daily_df
+    
+    # ISO dates compare correctly as strings
+    dates = daily_df['Date'].astype(str)
+    mask = (dates >= date_from.strftime('%Y-%m-%d')) & (dates <= date_to.strftime('%Y-%m-%d'))
+    period_df = daily_df.loc[mask]
+    
+    keys = [col for col in ['CampaignId', 'CampaignName'] if col in period_df.columns]
+    values = [col for col in ADDITIVE_METRICS if col in period_df.columns]
+    
+    numeric = period_df[values].apply(pd.to_numeric, errors='coerce')
+    return numeric.groupby([period_df[key] for key in keys], sort=False).sum().reset_index()
+
+def process_report_data(df, metrics, previous_df=None):
     """
     Process the DataFrame to create the report data
     
+    The frame is not normalized again: callers pass the result of
+    prepare_stats_dataframe, which they also use for the summary.
+    
     Args:
-        df: pandas.DataFrame with campaign data
+        df: pandas.DataFrame normalized by prepare_stats_dataframe; comparison
+            columns are added to it in place
         metrics: List of metrics to include
+        previous_df: pandas.DataFrame of the comparison period (optional, raw)
+        
+    Returns:
+        dict: Processed report data with aggregations and campaign details.
+            Top campaign lists hold row positions into ``campaigns``
+            (see REPORT_SCHEMA_VERSION).
+    """
+    totals = calculate_totals(df)
+    
+    # Comparison columns must be added before campaigns are serialized
+    comparison = compare_periods(df, previous_df, totals) if previous_df is not None else None
+    
+    # Find top campaigns by different metrics (positions into the campaigns list)
+    top_campaigns = {
+        'by_cost': top_positions(df, 'Cost'),
+        'by_clicks': top_positions(df, 'Clicks'),
+        'by_conversions': top_positions(df, 'Conversions') if 'Conversions' in df.columns else []
+    }
+    
+    # Create the report data structure
+    report_data = {
+        'schema_version': REPORT_SCHEMA_VERSION,
+        'campaigns': df.to_dict('records'),
+        'totals': totals,
+        'top_campaigns': top_campaigns
+    }
+    
+    if comparison is not None:
+        report_data['comparison'] = comparison
+    
+    return report_data
+
+def prepare_stats_dataframe(df):
+    """
+    Normalize campaign statistics
+    
+    Maps API column names, coerces metrics to numbers, replaces NaN with 0
+    and computes missing rate metrics. The caller's frame is not modified.
+    
+    Args:
+        df: pandas.DataFrame with campaign data
         
     Returns:
-        dict: Processed report data with aggregations and campaign details
+        pandas.DataFrame: Normalized copy with a default RangeIndex
     """
-    # Make a copy of the DataFrame to avoid modifying the original
-    df_copy = df.copy()
+    # Отчет API отдает CampaignId/CampaignName, шаблоны работают с Id/Name
+    if 'Id' not in df.columns and 'Name' not in df.columns:
+        df = df.rename(columns={'CampaignId': 'Id', 'CampaignName': 'Name'})
+    else:
+        df = df.copy()
+    
+    # Numeric metrics may arrive as strings ("--" for empty values)
+    for col in NUMERIC_METRICS:
+        if col in df.columns and not pd.api.types.is_numeric_dtype(df[col]):
+            df[col] = pd.to_numeric(df[col], errors='coerce')
     
     # Replace NaN values with 0
-    df_copy.fillna(0, inplace=True)
+    df.fillna(0, inplace=True)
+    
+    # Row positions are used as references into the campaigns list
+    if not isinstance(df.index, pd.RangeIndex) or df.index.start != 0 or df.index.step != 1:
+        df.reset_index(drop=True, inplace=True)
     
     # Ensure all required columns exist
     required_columns = ['Id', 'Name', 'Impressions', 'Clicks', 'Cost']
     for col in required_columns:
-        if col not in df_copy.columns:
-            df_copy[col] = 0
+        if col not in df.columns:
+            df[col] = 0
     
     # Calculate additional metrics if not present
-    if 'Ctr' not in df_copy.columns and 'Clicks' in df_copy.columns and 'Impressions' in df_copy.columns:
-        df_copy['Ctr'] = (df_copy['Clicks'] / df_copy['Impressions'] * 100).fillna(0)
+    if 'Ctr' not in df.columns:
+        df['Ctr'] = (df['Clicks'] / df['Impressions'] * 100).replace([np.inf, -np.inf], 0).fillna(0)
     
-    if 'ConversionRate' not in df_copy.columns and 'Conversions' in df_copy.columns and 'Clicks' in df_copy.columns:
-        df_copy['ConversionRate'] = (df_copy['Conversions'] / df_copy['Clicks'] * 100).fillna(0)
+    if 'ConversionRate' not in df.columns and 'Conversions' in df.columns:
+        df['ConversionRate'] = (df['Conversions'] / df['Clicks'] * 100).replace([np.inf, -np.inf], 0).fillna(0)
     
-    if 'CostPerConversion' not in df_copy.columns and 'Cost' in df_copy.columns and 'Conversions' in df_copy.columns:
-        df_copy['CostPerConversion'] = (df_copy['Cost'] / df_copy['Conversions']).fillna(0)
+    if 'CostPerConversion' not in df.columns and 'Conversions' in df.columns:
+        df['CostPerConversion'] = (df['Cost'] / df['Conversions']).replace([np.inf, -np.inf], 0).fillna(0)
     
+    return df
+
+def calculate_totals(df):
+    """
+    Calculate report totals for prepared campaign statistics
+    
+    Args:
+        df: pandas.DataFrame normalized by prepare_stats_dataframe
+        
+    Returns:
+        dict: Totals with recomputed rate metrics
+    """
     # Calculate totals
     totals = {
         'Id': 'Total',
         'Name': 'All Campaigns',
-        'Impressions': df_copy['Impressions'].sum(),
-        'Clicks': df_copy['Clicks'].sum(),
-        'Cost': df_copy['Cost'].sum(),
+        'Impressions': df['Impressions'].sum().item(),
+        'Clicks': df['Clicks'].sum().item(),
+        'Cost': df['Cost'].sum().item(),
     }
     
     # Calculate averages for rate metrics
-    if 'Ctr' in df_copy.columns:
-        totals['Ctr'] = (totals['Clicks'] / totals['Impressions'] * 100) if totals['Impressions'] > 0 else 0
+    totals['Ctr'] = (totals['Clicks'] / totals['Impressions'] * 100) if totals['Impressions'] > 0 else 0
+    
+    if 'Conversions' in df.columns:
+        totals['Conversions'] = df['Conversions'].sum().item()
+        totals['ConversionRate'] = (totals['Conversions'] / totals['Clicks'] * 100) if totals['Clicks'] > 0 else 0
+        totals['CostPerConversion'] = (totals['Cost'] / totals['Conversions']) if totals['Conversions'] > 0 else 0
+    
+    return totals
+
+def compare_periods(df, previous_df, totals):
+    """
+    Compare campaign statistics with a previous period
+    
+    Deltas are computed for all campaigns at once on aligned arrays.
+    Per-campaign columns <Metric>Prev, <Metric>Delta and <Metric>DeltaPct
+    are added to df in place.
     
-    if 'Conversions' in df_copy.columns:
-        totals['Conversions'] = df_copy['Conversions'].sum()
+    Args:
+        df: pandas.DataFrame of the reported period (prepared)
+        previous_df: pandas.DataFrame of the comparison period
+        totals: Totals of the reported period
+        
+    Returns:
+        dict: Previous totals with absolute and percentage changes
+    """
+    previous_df = prepare_stats_dataframe(previous_df)
+    previous_totals = calculate_totals(previous_df)
+    
+    # Align previous values to the current campaigns by Id
+    metrics = [m for m in CAMPAIGN_COMPARISON_METRICS if m in df.columns]
+    previous = previous_df.drop_duplicates('Id').set_index('Id')
+    previous = previous.reindex(columns=metrics).reindex(df['Id']).fillna(0)
+    
+    current_values = df[metrics].to_numpy(dtype=float)
+    previous_values = previous.to_numpy(dtype=float)
+    delta = current_values - previous_values
+    with np.errstate(divide='ignore', invalid='ignore'):
+        delta_pct = np.where(previous_values != 0, delta / previous_values * 100, np.nan)
+    
+    for i, metric in enumerate(metrics):
+        df[f'{metric}Prev'] = previous_values[:, i]
+        df[f'{metric}Delta'] = delta[:, i]
+        # Рост "с нуля" не имеет процента, сохраняем None
+        df[f'{metric}DeltaPct'] = pd.Series(np.round(delta_pct[:, i], 2), index=df.index).astype(object).where(
+            np.isfinite(delta_pct[:, i]), None)
+    
+    delta_totals = {}
+    delta_pct_totals = {}
+    for metric in COMPARISON_METRICS:
+        if metric not in totals or metric not in previous_totals:
+            continue
+        delta_totals[metric] = totals[metric] - previous_totals[metric]
+        delta_pct_totals[metric] = (delta_totals[metric] / previous_totals[metric] * 100) if previous_totals[metric] else None
+    
+    return {
+        'totals': previous_totals,
+        'delta': delta_totals,
+        'delta_pct': delta_pct_totals
+    }
+
+def account_breakdown(df, accounts):
+    """
+    Add per-account totals to the accounts of a multi-account report
+    
+    Args:
+        df: pandas.DataFrame normalized by prepare_stats_dataframe with an AccountId column
+        accounts: List of dicts with token_id, name and error
         
-        if 'ConversionRate' in df_copy.columns:
-            totals['ConversionRate'] = (totals['Conversions'] / totals['Clicks'] * 100) if totals['Clicks'] > 0 else 0
+    Returns:
+        list: The accounts with 'totals' set for accounts that have data
+    """
+    groups = df.groupby('AccountId', sort=False).indices
+    for account in accounts:
+        positions = groups.get(account['token_id'])
+        account['totals'] = calculate_totals(df.iloc[positions]) if positions is not None else None
+    return accounts
+
+def top_positions(df, column, limit=TOP_CAMPAIGNS_LIMIT):
+    """
+    Get row positions of the top campaigns by a metric
+    
+    Args:
+        df: pandas.DataFrame with a default RangeIndex
+        column: Metric column to rank by
+        limit: Number of campaigns to return
         
-        if 'CostPerConversion' in df_copy.columns:
-            totals['CostPerConversion'] = (totals['Cost'] / totals['Conversions']) if totals['Conversions'] > 0 else 0
+    Returns:
+        list: Row positions ordered by the metric, descending
+    """
+    return df[column].nlargest(limit).index.tolist()
+
+def expand_report_data(report_data):
+    """
+    Resolve top campaign references into campaign rows for rendering
     
-    # Find top campaigns by different metrics
-    top_by_cost = df_copy.sort_values('Cost', ascending=False).head(5)
-    top_by_clicks = df_copy.sort_values('Clicks', ascending=False).head(5)
-    top_by_conversions = df_copy.sort_values('Conversions', ascending=False).head(5) if 'Conversions' in df_copy.columns else pd.DataFrame()
+    Reports stored before REPORT_SCHEMA_VERSION 2 already contain full rows
+    in ``top_campaigns`` and are returned unchanged.
     
-    # Create the report data structure
-    report_data = {
-        'campaigns': df_copy.to_dict('records'),
-        'totals': totals,
-        'top_campaigns': {
-            'by_cost': top_by_cost.to_dict('records'),
-            'by_clicks': top_by_clicks.to_dict('records'),
-            'by_conversions': top_by_conversions.to_dict('records') if not top_by_conversions.empty else []
-        }
+    Args:
+        report_data: Dictionary containing stored report data
+        
+    Returns:
+        dict: Report data with top campaign lists as row dicts
+    """
+    if report_data.get('schema_version', 1) < 2:
+        return report_data
+    
+    campaigns = report_data.get('campaigns', [])
+    top_campaigns = {
+        key: [campaigns[pos] for pos in positions if pos < len(campaigns)]
+        for key, positions in report_data.get('top_campaigns', {}).items()
     }
     
-    return report_data
+    return dict(report_data, top_campaigns=top_campaigns)
 
-def generate_summary(df):
+def generate_summary(df, comparison=None, accounts=None):
     """
     Generate a summary text for the report
     
     Args:
         df: pandas.DataFrame with campaign data
+        comparison: Comparison data from compare_periods (optional)
+        accounts: Per-account breakdown from account_breakdown (optional)
         
     Returns:
         str: Summary text
@@ -219,9 +563,31 @@ def generate_summary(df):
             f"💲 *Cost per Conversion*: {cost_per_conversion:,.2f} ₽"
         ])
     
+    # Add changes against the comparison period
+    if comparison:
+        labels = [('Cost', 'Cost'), ('Clicks', 'Clicks'), ('Conversions', 'Conversions')]
+        changes = []
+        for metric, label in labels:
+            pct = comparison.get('delta_pct', {}).get(metric)
+            if pct is not None:
+                changes.append(f"   {label}: {pct:+.1f}%")
+        if changes:
+            summary.extend([f"", f"🔁 *Change vs {comparison.get('date_from')} – {comparison.get('date_to')}*:"] + changes)
+    
+    # Add per-account totals for multi-account reports
+    if accounts:
+        summary.extend([f"", f"🏢 *Accounts*:"])
+        for account in accounts:
+            if account.get('error'):
+                summary.append(f"   {account['name']}: ⚠️ {account['error']}")
+            elif account.get('totals'):
+                summary.append(f"   {account['name']}: {account['totals']['Cost']:,.2f} ₽, {account['totals']['Clicks']:,} clicks")
+            else:
+                summary.append(f"   {account['name']}: no data")
+    
     # Add top campaigns by cost if available
     if len(df) > 0:
-        top_campaign = df.sort_values('Cost', ascending=False).iloc[0]
+        top_campaign = df.loc[df['Cost'].idxmax()]
         summary.extend([
             f"",
             f"🔝 *Top Campaign by Cost*:",
@@ -324,6 +690,9 @@ def format_condition_message(condition_data):
     Returns:
         str: Formatted condition message
     """
+    if is_anomaly_condition(condition_data):
+        return describe_anomaly_condition(condition_data)
+    
     rules = condition_data.get('rules', [])
     logic = condition_data.get('logic', 'AND')
     
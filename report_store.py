@@ -0,0 +1,310 @@
+import os
+import json
+import hashlib
+import logging
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import pandas as pd
+from sqlalchemy.exc import IntegrityError
+from app import app, db
+from models import Report, ReportResult, YandexToken, ReportJob
+from report_codec import encode_report_data
+from report_generator import (generate_report, get_date_range, get_comparison_range, fetch_campaign_stats,
+                              process_report_data, prepare_stats_dataframe, finish_report, account_breakdown,
+                              REPORT_SCHEMA_VERSION)
+from rollups import LocalStats
+from yandex_direct import YandexDirectAPI
+
+logger = logging.getLogger(__name__)
+
+# Версия данных отчета. Увеличивается, когда меняется способ получения
+# или обработки статистики, чтобы старые результаты не переиспользовались.
+DATA_VERSION = 1
+
+# Сколько аккаунтов сводного отчета запрашивать одновременно
+MULTI_ACCOUNT_MAX_WORKERS = 8
+
+# Запрошенный отчет, который за это время не взял ни один фоновый процесс
+# (python -m worker не запущен или остановился), считается потерянным
+REPORT_JOB_QUEUE_TIMEOUT = int(os.environ.get('REPORT_JOB_QUEUE_TIMEOUT', 900))
+
+def build_content_key(token_key, metrics, date_from, date_to, comparison=None, data_version=DATA_VERSION):
+    """
+    Build the content address of a report result
+
+    Args:
+        token_key: YandexToken ID or sorted list of IDs for multi-account reports
+        metrics: List of template metrics
+        date_from: Start date (date)
+        date_to: End date (date)
+        comparison: Comparison period as (date_from, date_to), if any
+        data_version: Version of the report data
+
+    Returns:
+        str: sha256 hex digest
+    """
+    key = json.dumps([
+        token_key,
+        sorted(metrics),
+        date_from.isoformat(),
+        date_to.isoformat(),
+        [d.isoformat() for d in comparison] if comparison else None,
+        data_version,
+        REPORT_SCHEMA_VERSION
+    ])
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+def is_closed_period(date_to):
+    """
+    Check whether statistics for the period will not change any more
+
+    Args:
+        date_to: End date of the period (date)
+
+    Returns:
+        bool: True if the period ended before today
+    """
+    return date_to < datetime.now().date()
+
+def load_report(yandex_client, template):
+    """
+    Get report data for a template, reusing a stored result for closed periods
+    
+    Args:
+        yandex_client: YandexDirectAPI instance
+        template: ReportTemplate model instance
+        
+    Returns:
+        tuple: (report_data, summary, result). When result is a ReportResult
+            the payload is already stored and report_data holds everything
+            except the campaigns table; otherwise report_data is the full
+            dictionary from generate_report (or None on error, with summary
+            containing the error message).
+    """
+    token = getattr(yandex_client, 'token', None)
+    local_stats = LocalStats(token.id) if token is not None else None
+    
+    return _load_result(
+        token.id if token is not None else None,
+        template,
+        lambda: generate_report(yandex_client, template, local_stats)
+    )
+
+def load_accounts_report(tokens, template):
+    """
+    Get report data for a template over one or several accounts
+    
+    Args:
+        tokens: List of YandexToken instances (see yandex_direct.get_user_tokens)
+        template: ReportTemplate model instance
+        
+    Returns:
+        tuple: (report_data, summary, result) as returned by load_report
+    """
+    if len(tokens) == 1:
+        return load_report(YandexDirectAPI(tokens[0]), template)
+    
+    return _load_result(
+        sorted(token.id for token in tokens),
+        template,
+        lambda: generate_multi_account_report(tokens, template)
+    )
+
+def _load_result(token_key, template, generate):
+    """
+    Reuse a stored result for closed periods or generate and store a new one
+    
+    Args:
+        token_key: Token ID, sorted list of token IDs, or None
+        template: ReportTemplate model instance
+        generate: Callable returning (report_data, summary)
+        
+    Returns:
+        tuple: (report_data, summary, result)
+    """
+    period_from, period_to = get_date_range(template.date_range)
+    comparison = get_comparison_range(template, period_from, period_to)
+    date_from, date_to = period_from.date(), period_to.date()
+    if comparison:
+        comparison = tuple(d.date() for d in comparison)
+    
+    content_key = None
+    if token_key is not None and is_closed_period(max((date_to,) + (comparison or ()))):
+        metrics = json.loads(template.metrics)
+        content_key = build_content_key(token_key, metrics, date_from, date_to, comparison)
+        
+        result = ReportResult.query.filter_by(content_key=content_key).first()
+        if result:
+            logger.info(f"Reusing report result {result.id} for template {template.id}")
+            return result.get_data().meta, result.summary, result
+    
+    report_data, summary = generate()
+    
+    if not report_data or not content_key:
+        return report_data, summary, None
+    
+    # Отчет с ошибкой по одному из аккаунтов неполный, его не переиспользуем
+    if any(account.get('error') for account in report_data.get('accounts', [])):
+        return report_data, summary, None
+    
+    result = ReportResult(
+        content_key=content_key,
+        token_id=token_key if isinstance(token_key, int) else None,
+        metrics_key=json.dumps(sorted(json.loads(template.metrics))),
+        date_from=date_from,
+        date_to=date_to,
+        data_version=DATA_VERSION,
+        summary=summary,
+        data_blob=encode_report_data(report_data)
+    )
+    
+    try:
+        with db.session.begin_nested():
+            db.session.add(result)
+    except IntegrityError:
+        # Параллельная задача уже сохранила результат с тем же ключом
+        result = ReportResult.query.filter_by(content_key=content_key).first()
+    
+    return report_data, summary, result
+
+def generate_multi_account_report(tokens, template):
+    """
+    Generate one report over several accounts
+    
+    Statistics of all accounts are fetched in parallel, so the wall time
+    is close to that of the slowest account. Campaigns of all accounts are
+    processed together for grand totals, and per-account totals are added
+    to report_data['accounts'].
+    
+    Args:
+        tokens: List of YandexToken instances
+        template: ReportTemplate model instance
+        
+    Returns:
+        tuple: (report_data_dict, summary_text)
+    """
+    metrics = json.loads(template.metrics)
+    date_from, date_to = get_date_range(template.date_range)
+    comparison_range = get_comparison_range(template, date_from, date_to)
+    
+    # Контекст копируется в каждый поток, чтобы запросы к API попали в журнал задачи (telemetry)
+    with ThreadPoolExecutor(max_workers=min(len(tokens), MULTI_ACCOUNT_MAX_WORKERS)) as executor:
+        futures = [
+            (token, executor.submit(contextvars.copy_context().run, _fetch_account_stats,
+                                    token.id, date_from, date_to, comparison_range))
+            for token in tokens
+        ]
+    
+    frames, previous_frames, accounts = [], [], []
+    for token, future in futures:
+        account = {'token_id': token.id, 'name': token.display_name, 'error': None}
+        accounts.append(account)
+        try:
+            df, previous_df = future.result()
+        except Exception as e:
+            logger.exception(f"Error getting campaign stats for token {token.id}: {e}")
+            account['error'] = str(e)
+            continue
+        
+        if df is None or df.empty:
+            continue
+        
+        for frame in (df, previous_df):
+            if frame is not None:
+                frame['AccountId'] = token.id
+                frame['Account'] = token.display_name
+        frames.append(df)
+        if previous_df is not None:
+            previous_frames.append(previous_df)
+    
+    if not frames:
+        errors = [f"{a['name']}: {a['error']}" for a in accounts if a['error']]
+        return None, "Нет данных за выбранный период ни в одном из аккаунтов." + ("\n" + "\n".join(errors) if errors else "")
+    
+    # Сводка и разбивка по аккаунтам строятся по нормализованной таблице
+    df = prepare_stats_dataframe(pd.concat(frames, ignore_index=True))
+    previous_df = None
+    if comparison_range:
+        previous_df = pd.concat(previous_frames, ignore_index=True) if previous_frames else df.iloc[0:0].copy()
+    
+    report_data = process_report_data(df, metrics, previous_df)
+    return finish_report(df, report_data, template, date_from, date_to, comparison_range,
+                         account_breakdown(df, accounts))
+
+def _fetch_account_stats(token_id, date_from, date_to, comparison_range):
+    """
+    Fetch statistics of one account in a worker thread
+    
+    Runs in its own application context and session; daily statistics and
+    token refreshes made on the way are committed here.
+    """
+    with app.app_context():
+        try:
+            token = db.session.get(YandexToken, token_id)
+            frames = fetch_campaign_stats(
+                YandexDirectAPI(token), date_from, date_to, comparison_range, LocalStats(token_id)
+            )
+            db.session.commit()
+            return frames
+        except Exception:
+            db.session.rollback()
+            raise
+
+def expire_queued_jobs(*criteria):
+    """
+    Fail report jobs that have waited in the queue longer than REPORT_JOB_QUEUE_TIMEOUT
+    
+    The status is changed with a conditional update, so a job claimed by a
+    worker at the same time is not touched. Commits the session.
+    
+    Args:
+        *criteria: Extra filters (e.g. a job ID or partitions)
+        
+    Returns:
+        int: Number of expired jobs
+    """
+    now = datetime.utcnow()
+    expired = ReportJob.query.filter(
+        ReportJob.status == ReportJob.QUEUED,
+        ReportJob.created_at < now - timedelta(seconds=REPORT_JOB_QUEUE_TIMEOUT),
+        *criteria
+    ).update({
+        'status': ReportJob.FAILED,
+        'error': 'Отчет не был взят в работу: фоновый обработчик отчетов недоступен. Попробуйте еще раз позже.',
+        'finished_at': now
+    }, synchronize_session=False)
+    db.session.commit()
+    return expired
+
+def create_report(user_id, template, report_data, summary, result=None, **fields):
+    """
+    Create a Report row for loaded report data (not committed)
+
+    Args:
+        user_id: User ID
+        template: ReportTemplate model instance
+        report_data: Report data returned by load_report
+        summary: Summary text
+        result: ReportResult holding the payload, if any
+        **fields: Extra Report columns (title, schedule_id, condition_id, token_id)
+
+    Returns:
+        Report: The new report added to the session
+    """
+    report = Report(
+        user_id=user_id,
+        template_id=template.id,
+        summary=summary,
+        date_from=datetime.strptime(report_data['date_from'], '%Y-%m-%d').date(),
+        date_to=datetime.strptime(report_data['date_to'], '%Y-%m-%d').date(),
+        **fields
+    )
+
+    if result is not None:
+        report.result = result
+    else:
+        report.set_data(report_data)
+
+    db.session.add(report)
+    return report
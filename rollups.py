@@ -0,0 +1,392 @@
+import logging
+from datetime import datetime, timedelta
+import pandas as pd
+from sqlalchemy import and_, or_, func, insert, literal, select
+from app import db
+from models import CampaignDailyStat, AccountDailyStat, CampaignRollup, AccountRollup
+
+logger = logging.getLogger(__name__)
+
+# Типы агрегатов
+PERIOD_WEEK = 'WEEK'
+PERIOD_MONTH = 'MONTH'
+
+# Колонки метрик в таблицах статистики и соответствующие колонки отчета
+METRIC_COLUMNS = {
+    'impressions': 'Impressions',
+    'clicks': 'Clicks',
+    'cost': 'Cost',
+    'conversions': 'Conversions'
+}
+
+def period_start(period, day):
+    """Get the first day of the ISO week or calendar month containing a date"""
+    if period == PERIOD_WEEK:
+        return day - timedelta(days=day.weekday())
+    return day.replace(day=1)
+
+def period_end(period, start):
+    """Get the last day of a week or month starting at start"""
+    if period == PERIOD_WEEK:
+        return start + timedelta(days=6)
+    next_month = (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return next_month - timedelta(days=1)
+
+def plan_range(date_from, date_to):
+    """
+    Split a date range into whole months, whole ISO weeks and leftover days
+
+    Args:
+        date_from: Start date (date)
+        date_to: End date (date)
+
+    Returns:
+        list: Segments as (period, start, end) where period is MONTH, WEEK or DAY;
+            consecutive leftover days are merged into one DAY segment
+    """
+    segments = []
+    cursor = date_from
+    while cursor <= date_to:
+        for period in (PERIOD_MONTH, PERIOD_WEEK):
+            end = period_end(period, cursor)
+            if period_start(period, cursor) == cursor and end <= date_to:
+                segments.append((period, cursor, end))
+                cursor = end + timedelta(days=1)
+                break
+        else:
+            if segments and segments[-1][0] == 'DAY':
+                segments[-1] = ('DAY', segments[-1][1], cursor)
+            else:
+                segments.append(('DAY', cursor, cursor))
+            cursor += timedelta(days=1)
+    return segments
+
+def ingest_daily_stats(token_id, daily_df, date_from, date_to):
+    """
+    Store daily campaign statistics and refresh the affected rollups
+
+    Only closed days (before today) are stored. Days in the range replace
+    previously stored data, so re-ingesting a day never double counts it.
+    The session is flushed but not committed.
+
+    Args:
+        token_id: YandexToken ID
+        daily_df: pandas.DataFrame with Date, CampaignId, CampaignName and metric columns
+        date_from: Start date of the fetched range (date)
+        date_to: End date of the fetched range (date)
+
+    Returns:
+        int: Number of days stored
+    """
+    date_to = min(date_to, datetime.now().date() - timedelta(days=1))
+    if date_from > date_to or 'Date' not in daily_df.columns:
+        return 0
+
+    dates = pd.to_datetime(daily_df['Date'], errors='coerce').dt.date
+    mask = (dates >= date_from) & (dates <= date_to)
+    rows = pd.DataFrame({
+        'date': dates[mask],
+        'campaign_id': daily_df.loc[mask, 'CampaignId'].astype(str),
+        'campaign_name': daily_df.loc[mask, 'CampaignName'] if 'CampaignName' in daily_df.columns else None
+    })
+    for column, source in METRIC_COLUMNS.items():
+        values = daily_df.loc[mask, source] if source in daily_df.columns else 0
+        rows[column] = pd.to_numeric(values, errors='coerce')
+    rows.fillna({column: 0 for column in METRIC_COLUMNS}, inplace=True)
+
+    # Заменяем ранее загруженные дни целиком
+    for model in (CampaignDailyStat, AccountDailyStat):
+        db.session.execute(
+            model.__table__.delete().where(
+                model.token_id == token_id,
+                model.date >= date_from,
+                model.date <= date_to
+            )
+        )
+
+    if not rows.empty:
+        db.session.execute(
+            insert(CampaignDailyStat),
+            [dict(record, token_id=token_id) for record in rows.to_dict('records')]
+        )
+
+    # Итоги по дням, включая дни без статистики - они тоже считаются загруженными
+    days = pd.date_range(date_from, date_to).date
+    daily_totals = rows.groupby('date')[list(METRIC_COLUMNS)].sum().reindex(days, fill_value=0)
+    db.session.execute(
+        insert(AccountDailyStat),
+        [
+            dict(token_id=token_id, date=day, updated_at=datetime.utcnow(),
+                 **{column: values[column].item() for column in METRIC_COLUMNS})
+            for day, values in daily_totals.iterrows()
+        ]
+    )
+
+    buckets = {(period, period_start(period, day)) for day in days for period in (PERIOD_WEEK, PERIOD_MONTH)}
+    refresh_rollups(token_id, buckets)
+
+    db.session.flush()
+    logger.info(f"Stored daily stats for token {token_id}: {date_from} - {date_to}, {len(rows)} rows")
+    return len(days)
+
+def refresh_rollups(token_id, buckets):
+    """
+    Recompute week/month rollups from daily statistics
+
+    Args:
+        token_id: YandexToken ID
+        buckets: Iterable of (period, period_start) to recompute
+    """
+    for period, start in buckets:
+        end = period_end(period, start)
+
+        db.session.execute(
+            CampaignRollup.__table__.delete().where(
+                CampaignRollup.token_id == token_id,
+                CampaignRollup.period == period,
+                CampaignRollup.period_start == start
+            )
+        )
+        db.session.execute(
+            AccountRollup.__table__.delete().where(
+                AccountRollup.token_id == token_id,
+                AccountRollup.period == period,
+                AccountRollup.period_start == start
+            )
+        )
+
+        campaign_totals = select(
+            CampaignDailyStat.token_id,
+            CampaignDailyStat.campaign_id,
+            func.max(CampaignDailyStat.campaign_name),
+            literal(period),
+            literal(start, db.Date),
+            *[func.sum(getattr(CampaignDailyStat, column)) for column in METRIC_COLUMNS]
+        ).where(
+            CampaignDailyStat.token_id == token_id,
+            CampaignDailyStat.date >= start,
+            CampaignDailyStat.date <= end
+        ).group_by(CampaignDailyStat.token_id, CampaignDailyStat.campaign_id)
+
+        db.session.execute(
+            insert(CampaignRollup).from_select(
+                ['token_id', 'campaign_id', 'campaign_name', 'period', 'period_start'] + list(METRIC_COLUMNS),
+                campaign_totals
+            )
+        )
+
+        account_totals = select(
+            AccountDailyStat.token_id,
+            literal(period),
+            literal(start, db.Date),
+            func.count(AccountDailyStat.id),
+            *[func.sum(getattr(AccountDailyStat, column)) for column in METRIC_COLUMNS],
+            literal(datetime.utcnow(), db.DateTime)
+        ).where(
+            AccountDailyStat.token_id == token_id,
+            AccountDailyStat.date >= start,
+            AccountDailyStat.date <= end
+        ).group_by(AccountDailyStat.token_id)
+
+        db.session.execute(
+            insert(AccountRollup).from_select(
+                ['token_id', 'period', 'period_start', 'days_covered'] + list(METRIC_COLUMNS) + ['updated_at'],
+                account_totals
+            )
+        )
+
+def is_range_covered(token_id, segments):
+    """
+    Check that every day of the planned segments is stored locally
+
+    Args:
+        token_id: YandexToken ID
+        segments: Segments from plan_range
+
+    Returns:
+        bool: True if all rollups are complete and all leftover days are loaded
+    """
+    rollup_segments = [(period, start, end) for period, start, end in segments if period != 'DAY']
+    if rollup_segments:
+        covered = {
+            (period, start): days for period, start, days in
+            db.session.query(AccountRollup.period, AccountRollup.period_start, AccountRollup.days_covered).filter(
+                AccountRollup.token_id == token_id,
+                or_(*[and_(AccountRollup.period == period, AccountRollup.period_start == start)
+                      for period, start, _ in rollup_segments])
+            ).all()
+        }
+        for period, start, end in rollup_segments:
+            if covered.get((period, start)) != (end - start).days + 1:
+                return False
+
+    for period, start, end in segments:
+        if period != 'DAY':
+            continue
+        days = AccountDailyStat.query.filter(
+            AccountDailyStat.token_id == token_id,
+            AccountDailyStat.date >= start,
+            AccountDailyStat.date <= end
+        ).count()
+        if days != (end - start).days + 1:
+            return False
+
+    return True
+
+def missing_days(token_id, date_from, date_to):
+    """
+    Get the days of a range without stored daily statistics
+
+    Args:
+        token_id: YandexToken ID
+        date_from: Start date (date)
+        date_to: End date (date)
+
+    Returns:
+        list: Missing dates in ascending order
+    """
+    stored = {day for (day,) in db.session.query(AccountDailyStat.date).filter(
+        AccountDailyStat.token_id == token_id,
+        AccountDailyStat.date >= date_from,
+        AccountDailyStat.date <= date_to
+    )}
+    return [day for day in pd.date_range(date_from, date_to).date if day not in stored]
+
+def load_campaign_totals(token_id, date_from, date_to):
+    """
+    Get per-campaign totals for a range from rollups and daily statistics
+
+    Args:
+        token_id: YandexToken ID
+        date_from: Start date (date)
+        date_to: End date (date)
+
+    Returns:
+        pandas.DataFrame: Columns CampaignId, CampaignName and metrics,
+            or None if the range is not fully stored locally
+    """
+    segments = plan_range(date_from, date_to)
+    if not segments or not is_range_covered(token_id, segments):
+        return None
+
+    metric_columns = list(METRIC_COLUMNS)
+    frames = []
+
+    rollup_filters = [and_(CampaignRollup.period == period, CampaignRollup.period_start == start)
+                      for period, start, _ in segments if period != 'DAY']
+    if rollup_filters:
+        query = db.session.query(
+            CampaignRollup.campaign_id, CampaignRollup.campaign_name,
+            *[getattr(CampaignRollup, column) for column in metric_columns]
+        ).filter(CampaignRollup.token_id == token_id, or_(*rollup_filters))
+        frames.append(pd.DataFrame(query.all(), columns=['campaign_id', 'campaign_name'] + metric_columns))
+
+    day_filters = [and_(CampaignDailyStat.date >= start, CampaignDailyStat.date <= end)
+                   for period, start, end in segments if period == 'DAY']
+    if day_filters:
+        query = db.session.query(
+            CampaignDailyStat.campaign_id, func.max(CampaignDailyStat.campaign_name),
+            *[func.sum(getattr(CampaignDailyStat, column)) for column in metric_columns]
+        ).filter(
+            CampaignDailyStat.token_id == token_id, or_(*day_filters)
+        ).group_by(CampaignDailyStat.campaign_id)
+        frames.append(pd.DataFrame(query.all(), columns=['campaign_id', 'campaign_name'] + metric_columns))
+
+    df = pd.concat(frames, ignore_index=True)
+    df = df.groupby('campaign_id', sort=False).agg(
+        {'campaign_name': 'last', **{column: 'sum' for column in metric_columns}}
+    ).reset_index()
+
+    return df.rename(columns={'campaign_id': 'CampaignId', 'campaign_name': 'CampaignName', **METRIC_COLUMNS})
+
+def load_daily_stats(token_id, date_from, date_to):
+    """
+    Get stored daily campaign statistics for a range
+
+    Args:
+        token_id: YandexToken ID
+        date_from: Start date (date)
+        date_to: End date (date)
+
+    Returns:
+        pandas.DataFrame: Columns Date, CampaignId, CampaignName and metrics
+            in the layout of get_campaign_daily_stats_dataframe, or None if
+            some day of the range is not stored locally
+    """
+    days = AccountDailyStat.query.filter(
+        AccountDailyStat.token_id == token_id,
+        AccountDailyStat.date >= date_from,
+        AccountDailyStat.date <= date_to
+    ).count()
+    if days != (date_to - date_from).days + 1:
+        return None
+
+    metric_columns = list(METRIC_COLUMNS)
+    query = db.session.query(
+        CampaignDailyStat.date, CampaignDailyStat.campaign_id, CampaignDailyStat.campaign_name,
+        *[getattr(CampaignDailyStat, column) for column in metric_columns]
+    ).filter(
+        CampaignDailyStat.token_id == token_id,
+        CampaignDailyStat.date >= date_from,
+        CampaignDailyStat.date <= date_to
+    )
+    df = pd.DataFrame(query.all(), columns=['date', 'campaign_id', 'campaign_name'] + metric_columns)
+    df['date'] = df['date'].astype(str)
+
+    return df.rename(columns={'date': 'Date', 'campaign_id': 'CampaignId', 'campaign_name': 'CampaignName',
+                              **METRIC_COLUMNS})
+
+class LocalStats:
+    """Локальная статистика аккаунта для generate_report"""
+
+    def __init__(self, token_id):
+        """
+        Args:
+            token_id: YandexToken ID
+        """
+        self.token_id = token_id
+
+    def campaign_totals(self, date_from, date_to):
+        """
+        Get per-campaign totals from local data
+
+        Args:
+            date_from: Start date (datetime)
+            date_to: End date (datetime)
+
+        Returns:
+            pandas.DataFrame: Campaign totals or None if not stored locally
+        """
+        if date_to.date() >= datetime.now().date():
+            return None
+        return load_campaign_totals(self.token_id, date_from.date(), date_to.date())
+
+    def daily_stats(self, date_from, date_to):
+        """
+        Get daily campaign statistics from local data
+
+        Args:
+            date_from: Start date (datetime)
+            date_to: End date (datetime)
+
+        Returns:
+            pandas.DataFrame: Daily statistics or None if not stored locally
+        """
+        if date_to.date() >= datetime.now().date():
+            return None
+        return load_daily_stats(self.token_id, date_from.date(), date_to.date())
+
+    def store_daily(self, daily_df, date_from, date_to):
+        """
+        Store daily statistics fetched from the API
+
+        Args:
+            daily_df: pandas.DataFrame with a Date column
+            date_from: Start date (datetime)
+            date_to: End date (datetime)
+        """
+        try:
+            with db.session.begin_nested():
+                ingest_daily_stats(self.token_id, daily_df, date_from.date(), date_to.date())
+        except Exception as e:
+            logger.exception(f"Error storing daily stats for token {self.token_id}: {e}")
@@ -1,15 +1,36 @@
+import os
+import time
+import zlib
+import atexit
 import logging
+import threading
 import json
 from datetime import datetime, timedelta
 import pytz
 from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
+from apscheduler.executors.pool import ThreadPoolExecutor
 from apscheduler.triggers.cron import CronTrigger
 from apscheduler.triggers.interval import IntervalTrigger
-from app import app
-from models import Schedule, Condition, User, Report
-from yandex_direct import get_user_client
-from report_generator import generate_report, evaluate_condition
-from telegram_bot import send_report_notification, start_bot
+from sqlalchemy import func
+from sqlalchemy.orm import joinedload
+from app import app, db
+from models import Schedule, Condition, ConditionState, User, Report, YandexToken, ReportJob, ReportTemplate
+from yandex_direct import YandexDirectAPI, get_user_tokens, get_client_for_token
+from rollups import ingest_daily_stats, missing_days, LocalStats
+from anomalies import is_anomaly_condition, evaluate_anomaly_condition, format_anomaly_message
+from report_generator import check_condition_rules, format_condition_message
+from report_store import load_accounts_report, create_report, expire_queued_jobs
+from telegram_bot import start_bot, stop_bot
+from notifications import queue_report_notification, dispatch_notifications, prune_notifications, OUTBOX_POLL_INTERVAL
+from events import schedule_changed, condition_changed, user_changed, report_requested
+from job_pools import report_pool, condition_pool, POOLS
+from leader import LeaderElector
+from sharding import ShardCoordinator, user_partition, SCHEDULER_PARTITIONS
+from load_levelling import OffsetCronTrigger, is_levelled, prefetch_offset
+from condition_polling import interval_bounds, rule_totals, is_near_threshold, next_interval
+from condition_alerts import alert_settings, relax_rules, in_cooldown, record_event, EVENT_FIRED, EVENT_RESOLVED
+from telemetry import track_job_run, prune_job_runs
 
 # Set up logging
 logging.basicConfig(level=logging.DEBUG)
@@ -18,62 +39,592 @@ logger = logging.getLogger(__name__)
 # Global scheduler instance
 scheduler = None
 
+# Leader election (service jobs, Telegram bot) and partition ownership
+elector = None
+coordinator = None
+bot_started = False
+
+# Подключение и отключение хранилищ задач не должно пересекаться со сверкой
+stores_lock = threading.RLock()
+
+# Наибольший updated_at расписаний, условий и шаблонов на момент прошлой
+# проверки изменений (None - изменения еще не проверялись)
+refresh_mark = None
+
+# Имя аренды лидера в таблице scheduler_leases
+SCHEDULER_LEASE_NAME = 'scheduler'
+
+# Служебные задачи лидера в хранилище 'system'
+SYSTEM_JOB_IDS = {'sync_daily_stats', 'prune_job_runs', 'dispatch_notifications', 'prune_notifications'}
+SYSTEM_JOBSTORE = 'system'
+
+# Сколько последних закрытых дней перезагружать (конверсии досчитываются с задержкой)
+DAILY_STATS_SYNC_DAYS = 3
+
+# Сколько закрытых дней держать в локальной статистике: пропущенные дни окна
+# дозагружаются (после развертывания - сразу при избрании лидера), чтобы
+# отчеты за 30 дней и прошлый месяц со сравнением строились без API
+DAILY_STATS_BACKFILL_DAYS = int(os.environ.get('SCHEDULER_DAILY_STATS_BACKFILL_DAYS', 100))
+
+# Задачи хранятся в базе и переживают перезапуск процесса: служебные в
+# SCHEDULER_JOBS_TABLE, задачи раздела n - в SCHEDULER_JOBS_TABLE_p<n>
+SCHEDULER_JOBS_TABLE = 'apscheduler_jobs'
+SCHEDULER_MAX_WORKERS = int(os.environ.get('SCHEDULER_MAX_WORKERS', 10))
+
+# Сколько секунд после пропущенного запуска его еще можно выполнить.
+# Отчеты, пропущенные во время простоя, отправляются один раз после старта;
+# проверки условий не догоняются, чтобы не было всплеска запросов к API.
+REPORT_MISFIRE_GRACE_TIME = int(os.environ.get('SCHEDULER_REPORT_MISFIRE_GRACE_TIME', 6 * 3600))
+CONDITION_MISFIRE_GRACE_TIME = int(os.environ.get('SCHEDULER_CONDITION_MISFIRE_GRACE_TIME', 60))
+
+# Изменения из веб-интерфейса других процессов доходят до владельца раздела
+# через базу: каждые REFRESH_INTERVAL секунд читаются только расписания,
+# условия и шаблоны с updated_at новее прошлой отметки. Удаления и смену
+# часового пояса пользователя (у них нет updated_at) подхватывает полная
+# сверка раз в FULL_REFRESH_INTERVAL секунд.
+REFRESH_INTERVAL = int(os.environ.get('SCHEDULER_REFRESH_INTERVAL', 60))
+FULL_REFRESH_INTERVAL = int(os.environ.get('SCHEDULER_FULL_REFRESH_INTERVAL', 900))
+
+# Изменения перечитываются с запасом до отметки: строка может быть
+# закоммичена позже, чем записано ее updated_at, а часы процессов расходятся
+REFRESH_OVERLAP = 300
+
+# Отчеты, запрошенные из веб-интерфейса, берутся из report_jobs. Процесс
+# веб-интерфейса с планировщиком берет свои отчеты сразу, остальные
+# находит опрос. Отчет, который строится дольше REPORT_JOB_TIMEOUT,
+# считается прерванным (процесс завершился), а отчет, который никто не взял
+# за REPORT_JOB_QUEUE_TIMEOUT (report_store), - потерянным.
+REPORT_JOB_POLL_INTERVAL = int(os.environ.get('SCHEDULER_REPORT_JOB_POLL_INTERVAL', 5))
+REPORT_JOB_TIMEOUT = int(os.environ.get('SCHEDULER_REPORT_JOB_TIMEOUT', 900))
+
+# Проверки условий пользователя с одинаковым интервалом выполняются одним
+# тиком на общих границах интервала. Тики разных пользователей сдвинуты на
+# постоянное смещение до CONDITION_TICK_JITTER секунд, чтобы не создавать
+# всплеск запросов к API в начале каждого часа.
+CONDITION_TICK_EPOCH = datetime(2000, 1, 1, tzinfo=pytz.UTC)
+CONDITION_TICK_JITTER = int(os.environ.get('SCHEDULER_CONDITION_TICK_JITTER', 120))
+
 def init_scheduler():
-    """Initialize the scheduler and register all jobs"""
-    global scheduler
+    """
+    Start the scheduler of this process and join the scheduler workers
     
-    # Start the Telegram bot
-    start_bot()
+    Safe to call in every web worker and replica. Schedule and condition
+    jobs are split into partitions by user, and each partition is run by
+    exactly one live process (see sharding.py); service jobs and the
+    Telegram bot run only in the elected leader.
+    """
+    global scheduler, elector, coordinator
     
-    # Create a scheduler
-    scheduler = BackgroundScheduler(timezone=pytz.UTC)
+    if scheduler is not None:
+        return
     
-    # Add jobs
-    with app.app_context():
-        # Schedule timed reports
-        schedules = Schedule.query.filter_by(is_active=True).all()
-        for schedule in schedules:
-            add_scheduled_report(schedule)
-        
-        # Schedule condition checks
-        conditions = Condition.query.filter_by(is_active=True).all()
-        for condition in conditions:
-            add_condition_check(condition)
-    
-    # Add a job to refresh all schedules every hour
-    scheduler.add_job(
-        refresh_schedules,
-        'interval',
-        hours=1,
-        id='refresh_schedules'
+    # A backlog of missed runs of one job is coalesced into a single run
+    scheduler = BackgroundScheduler(
+        executors={'default': ThreadPoolExecutor(SCHEDULER_MAX_WORKERS)},
+        job_defaults={
+            'coalesce': True,
+            'max_instances': 1,
+            'misfire_grace_time': REPORT_MISFIRE_GRACE_TIME
+        },
+        timezone=pytz.UTC
     )
-    
-    # Start the scheduler
     scheduler.start()
-    logger.info("Scheduler started with all jobs")
+    
+    # Apply changes made in other processes to jobs of owned partitions
+    scheduler.add_job(refresh_changes, 'interval', seconds=REFRESH_INTERVAL, id='refresh_changes')
+    scheduler.add_job(refresh_schedules, 'interval', seconds=FULL_REFRESH_INTERVAL, id='refresh_schedules')
+    
+    # Pick up reports requested from the web interface of other processes
+    scheduler.add_job(dispatch_report_jobs, 'interval', seconds=REPORT_JOB_POLL_INTERVAL,
+                      id='dispatch_report_jobs', misfire_grace_time=REPORT_JOB_POLL_INTERVAL)
+    
+    coordinator = ShardCoordinator(on_acquired=attach_partition, on_released=detach_partition,
+                                   is_drained=partition_drained)
+    elector = LeaderElector(SCHEDULER_LEASE_NAME, on_elected=start_system_jobs, on_lost=stop_system_jobs)
+    
+    # Apply changes from the web interface right away (for owned partitions)
+    schedule_changed.connect(on_schedule_changed)
+    condition_changed.connect(on_condition_changed)
+    user_changed.connect(on_user_changed)
+    report_requested.connect(on_report_requested)
+    
+    coordinator.start()
+    elector.start()
+    
+    # Release leases on shutdown so that other processes take over at once
+    atexit.register(stop_scheduler)
+    logger.info("Scheduler started, waiting for partitions")
 
-def refresh_schedules():
-    """Refresh all schedule and condition jobs"""
-    logger.info("Refreshing all scheduled jobs")
+def stop_scheduler():
+    """Release all partitions and the leader lease and stop the scheduler"""
     global scheduler
     
+    if scheduler is None:
+        return
+    
+    coordinator.stop()
+    elector.stop()
+    
+    current, scheduler = scheduler, None
+    current.shutdown(wait=False)
+    logger.info("Scheduler stopped")
+
+def partition_jobstore(partition):
+    """Job store alias of a partition"""
+    return f"partition-{partition}"
+
+def add_persistent_jobstore(alias, tablename):
+    """Attach a job store kept in a database table"""
     with app.app_context():
-        # Clear existing jobs
-        for job in scheduler.get_jobs():
-            if job.id != 'refresh_schedules':
-                scheduler.remove_job(job.id)
+        engine = db.engine
+    
+    scheduler.add_jobstore(SQLAlchemyJobStore(engine=engine, tablename=tablename), alias)
+
+def attach_partition(partition):
+    """
+    Start running the jobs of a partition taken over by this process
+    
+    The scheduler is paused while persisted jobs are reconciled, so that
+    jobs of removed schedules do not run; unchanged jobs keep their next
+    run time and missed runs are handled by the misfire settings.
+    """
+    with stores_lock:
+        scheduler.pause()
+        try:
+            add_persistent_jobstore(partition_jobstore(partition), f"{SCHEDULER_JOBS_TABLE}_p{partition}")
+            refresh_schedules([partition])
+        finally:
+            scheduler.resume()
+    
+    logger.info(f"Partition {partition} attached")
+
+def detach_partition(partition):
+    """Stop running the jobs of a partition given up by this process"""
+    with stores_lock:
+        # Хранилище не закрывается: движок общий с приложением
+        scheduler.remove_jobstore(partition_jobstore(partition), shutdown=False)
+    
+    # Задачи раздела, уже стоящие в очередях пулов, выполняются здесь: время их
+    # следующего запуска уже сдвинуто, и новый владелец их не повторит.
+    # Аренда раздела держится, пока они не закончатся (partition_drained)
+    pending = partition_pending(partition)
+    logger.info(f"Partition {partition} detached, {pending} queued or running tasks left to finish")
+
+def partition_pending(partition):
+    """Count queued and running pool tasks of a partition"""
+    return sum(pool.pending(lambda user_id: user_partition(user_id) == partition) for pool in POOLS)
+
+def partition_drained(partition):
+    """Check whether no pool tasks of a released partition are left"""
+    return partition_pending(partition) == 0
+
+def start_system_jobs():
+    """Start service jobs and the Telegram bot after being elected leader"""
+    global bot_started
+    
+    # Start the Telegram bot (polling must also run in a single process; in webhook
+    # mode this only registers the webhook)
+    if not bot_started:
+        start_bot()
+        bot_started = True
+    
+    with stores_lock:
+        scheduler.pause()
+        try:
+            add_persistent_jobstore(SYSTEM_JOBSTORE, SCHEDULER_JOBS_TABLE)
+            
+            # Задачи расписаний из этой таблицы переехали в хранилища разделов
+            for job in scheduler.get_jobs(jobstore=SYSTEM_JOBSTORE):
+                if job.id not in SYSTEM_JOB_IDS:
+                    scheduler.remove_job(job.id, jobstore=SYSTEM_JOBSTORE)
+            
+            # Add a nightly job to load daily statistics into rollup tables
+            add_system_job(sync_daily_stats, 'cron', 'sync_daily_stats', hour=4, minute=0)
+            
+            # Remove old entries of the job run journal
+            add_system_job(prune_job_runs, 'cron', 'prune_job_runs', hour=4, minute=30)
+            
+            # Load the missing days of the local statistics window at once, not at night
+            scheduler.add_job(sync_daily_stats, kwargs={'backfill_only': True}, id='backfill_daily_stats',
+                              replace_existing=True)
+            
+            # Send queued notifications (one sender keeps the bot within Telegram limits)
+            add_system_job(dispatch_notifications, 'interval', 'dispatch_notifications', seconds=OUTBOX_POLL_INTERVAL)
+            add_system_job(prune_notifications, 'cron', 'prune_notifications', hour=4, minute=45)
+        finally:
+            scheduler.resume()
+    
+    logger.info("Service jobs started")
+
+def stop_system_jobs():
+    """Stop service jobs and the Telegram bot after losing leadership"""
+    global bot_started
+    
+    # Новый лидер запустит бота сам; второй процесс с getUpdates получил бы 409 Conflict
+    if bot_started:
+        stop_bot()
+        bot_started = False
+    
+    with stores_lock:
+        try:
+            scheduler.remove_jobstore(SYSTEM_JOBSTORE, shutdown=False)
+        except KeyError:
+            # Хранилище не было подключено (ошибка при запуске служебных задач)
+            pass
+    
+    logger.info("Service jobs stopped")
+
+def add_system_job(func, trigger, job_id, **trigger_args):
+    """
+    Add a service job unless the same job is already persisted
+    
+    Args:
+        func: Job function
+        trigger: Trigger alias ('interval' or 'cron')
+        job_id: Job ID from SYSTEM_JOB_IDS
+        **trigger_args: Trigger parameters
+    """
+    name = job_name(job_id, f"{trigger}|{sorted(trigger_args.items())}")
+    job = scheduler.get_job(job_id, jobstore=SYSTEM_JOBSTORE)
+    if job and job.name == name:
+        return
+    
+    scheduler.add_job(func, trigger, id=job_id, name=name, jobstore=SYSTEM_JOBSTORE,
+                      replace_existing=True, **trigger_args)
+
+def refresh_schedules(partitions=None):
+    """
+    Reconcile schedule and condition jobs of owned partitions with the database
+    
+    Runs when a partition is attached and every FULL_REFRESH_INTERVAL; in
+    between, refresh_changes applies only changed rows. Each job carries the
+    version of its schedule or condition in its name, so only jobs that were
+    added, changed or removed are touched.
+    
+    Args:
+        partitions: Partitions to reconcile (all owned partitions by default)
+    """
+    with stores_lock:
+        if partitions is None:
+            partitions = set(coordinator.partitions)
+        if not partitions:
+            return
         
-        # Re-add schedule jobs
-        schedules = Schedule.query.filter_by(is_active=True).all()
-        for schedule in schedules:
-            add_scheduled_report(schedule)
+        with app.app_context():
+            desired = {}
+            
+            schedules = Schedule.query.options(joinedload(Schedule.user), joinedload(Schedule.template)).filter(
+                Schedule.is_active == True,
+                (Schedule.user_id % SCHEDULER_PARTITIONS).in_(partitions)
+            ).all()
+            for schedule in schedules:
+                desired[f"schedule_{schedule.id}"] = (schedule_job_version(schedule), add_scheduled_report, schedule)
+                if is_levelled(schedule.template):
+                    desired[f"prefetch_{schedule.id}"] = (prefetch_job_version(schedule), add_prefetch_job, schedule)
+            
+            ticks = db.session.query(Condition.user_id, Condition.check_interval).filter(
+                Condition.is_active == True,
+                (Condition.user_id % SCHEDULER_PARTITIONS).in_(partitions)
+            ).distinct().all()
+            for user_id, interval in ticks:
+                desired[tick_job_id(user_id, interval)] = (tick_job_version(user_id, interval), add_condition_tick,
+                                                          (user_id, interval))
+            
+            existing = {
+                job.id: job.name
+                for partition in partitions
+                for job in scheduler.get_jobs(jobstore=partition_jobstore(partition))
+            }
+            
+            removed = existing.keys() - desired.keys()
+            for job_id in removed:
+                remove_job(job_id)
+            
+            changed = 0
+            for job_id, (version, add_job, item) in desired.items():
+                if existing.get(job_id) != job_name(job_id, version):
+                    add_job(item)
+                    changed += 1
+    
+    log = logger.info if changed or removed else logger.debug
+    log(f"Scheduler reconciled {len(partitions)} partition(s): {changed} added or updated, "
+        f"{len(removed)} removed, {len(desired)} active")
+
+def refresh_changes():
+    """
+    Update jobs of owned partitions whose schedules, conditions or templates changed
+    
+    Only rows with updated_at after the previous mark (minus REFRESH_OVERLAP)
+    are read, so the check costs little however many schedules there are.
+    The first call runs a full reconcile and sets the mark.
+    """
+    global refresh_mark
+    
+    with stores_lock:
+        partitions = set(coordinator.partitions)
+        if not partitions:
+            return
         
-        # Re-add condition jobs
-        conditions = Condition.query.filter_by(is_active=True).all()
-        for condition in conditions:
-            add_condition_check(condition)
+        with app.app_context():
+            # Отметка берется до чтения изменений, чтобы не пропустить строки между запросами
+            mark = latest_update()
+            if refresh_mark is None:
+                refresh_schedules(partitions)
+                refresh_mark = mark
+                return
+            
+            since = refresh_mark - timedelta(seconds=REFRESH_OVERLAP)
+            schedule_ids = {schedule_id for (schedule_id,) in db.session.query(Schedule.id).filter(
+                Schedule.updated_at > since,
+                (Schedule.user_id % SCHEDULER_PARTITIONS).in_(partitions)
+            )}
+            # Период шаблона входит в версию задачи предзагрузки
+            schedule_ids.update(schedule_id for (schedule_id,) in db.session.query(Schedule.id).join(
+                ReportTemplate, Schedule.template_id == ReportTemplate.id
+            ).filter(
+                ReportTemplate.updated_at > since,
+                (Schedule.user_id % SCHEDULER_PARTITIONS).in_(partitions)
+            ))
+            user_ids = {user_id for (user_id,) in db.session.query(Condition.user_id).filter(
+                Condition.updated_at > since,
+                (Condition.user_id % SCHEDULER_PARTITIONS).in_(partitions)
+            ).distinct()}
+            
+            for schedule_id in sorted(schedule_ids):
+                sync_schedule_job(schedule_id)
+            for user_id in sorted(user_ids):
+                sync_condition_ticks(user_id)
+            
+            refresh_mark = mark
+    
+    # Измененные задачи пишутся в лог при добавлении и удалении
+    if schedule_ids or user_ids:
+        logger.debug(f"Scheduler checked changes: {len(schedule_ids)} schedule(s), "
+                    f"conditions of {len(user_ids)} user(s)")
+
+def latest_update():
+    """Get the latest updated_at of schedules, conditions and templates"""
+    marks = [db.session.query(func.max(model.updated_at)).scalar() for model in (Schedule, Condition, ReportTemplate)]
+    return max(filter(None, marks), default=datetime(1970, 1, 1))
+
+def job_name(job_id, version):
+    """Build a job name carrying the version of its schedule or condition"""
+    return f"{job_id}@{version}"
+
+def schedule_job_version(schedule):
+    """Version of a schedule job; changes whenever its trigger has to be rebuilt"""
+    updated_at = schedule.updated_at.isoformat() if schedule.updated_at else ''
+    return f"{updated_at}|{schedule.user.timezone or 'UTC'}"
+
+def prefetch_job_version(schedule):
+    """Version of a prefetch job; also changes with the template period and the offset"""
+    return f"{schedule_job_version(schedule)}|{schedule.template.date_range}|{prefetch_offset(schedule.id)}"
+
+def tick_job_id(user_id, interval):
+    """Job ID of the condition tick of a user and check interval"""
+    return f"conditions_{user_id}_{interval}"
+
+def tick_offset(user_id, interval):
+    """Constant offset of a user's ticks from the shared interval boundaries"""
+    jitter = min(CONDITION_TICK_JITTER, interval)
+    return zlib.crc32(str(user_id).encode('utf-8')) % jitter if jitter > 0 else 0
+
+def tick_job_version(user_id, interval):
+    """Version of a condition tick job; changes whenever its trigger has to be rebuilt"""
+    return str(tick_offset(user_id, interval))
+
+def remove_job(job_id):
+    """Remove a job if it exists"""
+    if scheduler.get_job(job_id):
+        scheduler.remove_job(job_id)
+        logger.info(f"Removed job {job_id}")
+
+def sync_schedule_job(schedule_id):
+    """
+    Add, update or remove the job of a single schedule
+    
+    Args:
+        schedule_id: Schedule ID
+    """
+    job_id = f"schedule_{schedule_id}"
+    prefetch_id = f"prefetch_{schedule_id}"
+    schedule = Schedule.query.options(joinedload(Schedule.user)).get(schedule_id)
+    
+    if not schedule or not schedule.is_active:
+        remove_job(job_id)
+        remove_job(prefetch_id)
+        return
+    
+    if not coordinator.owns_user(schedule.user_id):
+        # Задачу добавит процесс, которому принадлежит раздел пользователя
+        return
+    
+    job = scheduler.get_job(job_id)
+    if not job or job.name != job_name(job_id, schedule_job_version(schedule)):
+        add_scheduled_report(schedule)
+    
+    if not is_levelled(schedule.template):
+        remove_job(prefetch_id)
+        return
+    
+    job = scheduler.get_job(prefetch_id)
+    if not job or job.name != job_name(prefetch_id, prefetch_job_version(schedule)):
+        add_prefetch_job(schedule)
+
+def sync_condition_ticks(user_id):
+    """
+    Add, update or remove the condition tick jobs of a user
+    
+    Args:
+        user_id: User ID
+    """
+    if not coordinator.owns_user(user_id):
+        # Задачи добавит процесс, которому принадлежит раздел пользователя
+        return
+    
+    intervals = db.session.query(Condition.check_interval).filter_by(user_id=user_id, is_active=True).distinct()
+    desired = {tick_job_id(user_id, interval): interval for (interval,) in intervals}
+    
+    prefix = tick_job_id(user_id, '')
+    existing = {
+        job.id: job.name
+        for job in scheduler.get_jobs(jobstore=partition_jobstore(user_partition(user_id)))
+        if job.id.startswith(prefix)
+    }
+    
+    for job_id in existing.keys() - desired.keys():
+        remove_job(job_id)
+    
+    for job_id, interval in desired.items():
+        if existing.get(job_id) != job_name(job_id, tick_job_version(user_id, interval)):
+            add_condition_tick((user_id, interval))
+
+def on_schedule_changed(sender, schedule_id, **kwargs):
+    """Apply a schedule change sent by the web interface"""
+    if scheduler is None:
+        return
+    
+    with app.app_context():
+        try:
+            sync_schedule_job(schedule_id)
+        except Exception as e:
+            logger.exception(f"Error syncing job for schedule {schedule_id}: {e}")
+
+def on_condition_changed(sender, condition_id, user_id, **kwargs):
+    """
+    Apply a condition change sent by the web interface
+    
+    Ticks are shared by all conditions of a user with the same interval, so
+    the ticks of the user are reconciled. The user comes with the signal:
+    a deleted condition can no longer be loaded.
+    """
+    if scheduler is None:
+        return
+    
+    with app.app_context():
+        try:
+            sync_condition_ticks(user_id)
+        except Exception as e:
+            logger.exception(f"Error syncing jobs for condition {condition_id}: {e}")
+
+def on_user_changed(sender, user_id, **kwargs):
+    """Rebuild jobs affected by a user change (timezone, deletion)"""
+    if scheduler is None:
+        return
+    
+    try:
+        refresh_schedules()
+    except Exception as e:
+        logger.exception(f"Error reconciling jobs for user {user_id}: {e}")
+
+def on_report_requested(sender, job_id, user_id, **kwargs):
+    """Start a report requested from the web interface if its partition is owned"""
+    if scheduler is None or not coordinator.owns_user(user_id):
+        return
     
-    logger.info(f"Scheduler refreshed: {len(scheduler.get_jobs())} jobs active")
+    try:
+        dispatch_report_jobs([user_partition(user_id)])
+    except Exception as e:
+        logger.exception(f"Error dispatching report job {job_id}: {e}")
+
+def sync_daily_stats(backfill_only=False):
+    """
+    Load daily statistics of all active accounts into rollup tables
+    
+    The last DAILY_STATS_SYNC_DAYS days are reloaded, and days missing in
+    the last DAILY_STATS_BACKFILL_DAYS are loaded in the same report.
+    
+    Args:
+        backfill_only: Only load accounts with missing days (run after election)
+    """
+    job_key = 'backfill_daily_stats' if backfill_only else 'sync_daily_stats'
+    logger.info(f"Syncing daily statistics ({job_key})")
+    
+    with app.app_context(), track_job_run('daily_stats', job_key) as run:
+        date_to = datetime.now().date() - timedelta(days=1)
+        recent_from = date_to - timedelta(days=DAILY_STATS_SYNC_DAYS - 1)
+        window_from = date_to - timedelta(days=DAILY_STATS_BACKFILL_DAYS - 1)
+        
+        tokens = YandexToken.query.filter_by(is_active=True).all()
+        run.accounts = [token.id for token in tokens]
+        durations, errors = {}, 0
+        for token in tokens:
+            gaps = missing_days(token.id, window_from, date_to)
+            if backfill_only and not gaps:
+                continue
+            date_from = min([recent_from] + gaps[:1])
+            
+            started = time.perf_counter()
+            try:
+                client = get_client_for_token(token.id)
+                if not client:
+                    continue
+                
+                daily_df = client.get_campaign_daily_stats_dataframe(
+                    date_from=date_from.strftime('%Y-%m-%d'),
+                    date_to=date_to.strftime('%Y-%m-%d')
+                )
+                ingest_daily_stats(token.id, daily_df, date_from, date_to)
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                errors += 1
+                logger.exception(f"Error syncing daily stats for token {token.id}: {e}")
+            finally:
+                durations[token.id] = round(time.perf_counter() - started, 3)
+        
+        run.details = {'accounts': durations, 'errors': errors}
+    
+    logger.info("Daily statistics sync completed")
+
+def build_cron_trigger(schedule):
+    """
+    Build the cron trigger of a schedule in its user's timezone
+    
+    Args:
+        schedule: Schedule model instance
+        
+    Returns:
+        CronTrigger: Trigger, or None if the cron expression is invalid
+    """
+    # Parse the cron expression
+    cron_parts = schedule.cron_expression.split()
+    
+    if len(cron_parts) != 5:
+        logger.error(f"Invalid cron expression for schedule {schedule.id}: {schedule.cron_expression}")
+        return None
+    
+    # Get user's timezone
+    timezone = pytz.timezone(schedule.user.timezone) if schedule.user.timezone else pytz.UTC
+    
+    return CronTrigger(
+        minute=cron_parts[0],
+        hour=cron_parts[1],
+        day=cron_parts[2],
+        month=cron_parts[3],
+        day_of_week=cron_parts[4],
+        timezone=timezone
+    )
 
 def add_scheduled_report(schedule):
     """
@@ -85,32 +636,20 @@ def add_scheduled_report(schedule):
     job_id = f"schedule_{schedule.id}"
     
     try:
-        # Parse the cron expression
-        cron_parts = schedule.cron_expression.split()
+        trigger = build_cron_trigger(schedule)
         
-        if len(cron_parts) != 5:
-            logger.error(f"Invalid cron expression for schedule {schedule.id}: {schedule.cron_expression}")
+        if trigger is None:
+            remove_job(job_id)
             return
         
-        # Get user's timezone
-        timezone = pytz.timezone(schedule.user.timezone) if schedule.user.timezone else pytz.UTC
-        
-        # Create a cron trigger
-        trigger = CronTrigger(
-            minute=cron_parts[0],
-            hour=cron_parts[1],
-            day=cron_parts[2],
-            month=cron_parts[3],
-            day_of_week=cron_parts[4],
-            timezone=timezone
-        )
-        
         # Add the job
         scheduler.add_job(
             run_scheduled_report,
             trigger,
             args=[schedule.id],
             id=job_id,
+            name=job_name(job_id, schedule_job_version(schedule)),
+            jobstore=partition_jobstore(user_partition(schedule.user_id)),
             replace_existing=True
         )
         
@@ -118,36 +657,166 @@ def add_scheduled_report(schedule):
     except Exception as e:
         logger.exception(f"Error adding scheduled report {schedule.id}: {e}")
 
-def add_condition_check(condition):
+def add_prefetch_job(schedule):
     """
-    Add a condition check job
+    Add a job preparing a scheduled report ahead of its nominal time
     
     Args:
-        condition: Condition model instance
+        schedule: Schedule model instance
+    """
+    job_id = f"prefetch_{schedule.id}"
+    
+    try:
+        cron = build_cron_trigger(schedule)
+        
+        if cron is None:
+            remove_job(job_id)
+            return
+        
+        offset = prefetch_offset(schedule.id)
+        
+        # A prefetch that could not start before the nominal time is useless
+        scheduler.add_job(
+            prefetch_scheduled_report,
+            OffsetCronTrigger(cron, offset),
+            args=[schedule.id],
+            id=job_id,
+            name=job_name(job_id, prefetch_job_version(schedule)),
+            jobstore=partition_jobstore(user_partition(schedule.user_id)),
+            misfire_grace_time=offset,
+            replace_existing=True
+        )
+        
+        logger.info(f"Added prefetch job {job_id} {offset}s before cron: {schedule.cron_expression}")
+    except Exception as e:
+        logger.exception(f"Error adding prefetch job for schedule {schedule.id}: {e}")
+
+def add_condition_tick(tick):
     """
-    job_id = f"condition_{condition.id}"
+    Add a condition tick job checking all conditions of a user with one interval
+    
+    Args:
+        tick: Tuple (user_id, interval in seconds)
+    """
+    user_id, interval = tick
+    job_id = tick_job_id(user_id, interval)
     
     try:
-        # Create interval trigger
+        # Ticks are aligned to interval boundaries counted from a fixed epoch,
+        # so they keep their phase across restarts
         trigger = IntervalTrigger(
-            seconds=condition.check_interval,
+            seconds=interval,
+            start_date=CONDITION_TICK_EPOCH + timedelta(seconds=tick_offset(user_id, interval)),
             timezone=pytz.UTC
         )
         
         # Add the job
         scheduler.add_job(
-            check_condition,
+            run_condition_tick,
             trigger,
-            args=[condition.id],
+            args=[user_id, interval],
             id=job_id,
+            name=job_name(job_id, tick_job_version(user_id, interval)),
+            jobstore=partition_jobstore(user_partition(user_id)),
+            misfire_grace_time=CONDITION_MISFIRE_GRACE_TIME,
             replace_existing=True
         )
         
-        logger.info(f"Added condition check job {job_id} with interval: {condition.check_interval}s")
+        logger.info(f"Added condition tick job {job_id} with interval: {interval}s")
     except Exception as e:
-        logger.exception(f"Error adding condition check {condition.id}: {e}")
+        logger.exception(f"Error adding condition tick {job_id}: {e}")
 
 def run_scheduled_report(schedule_id):
+    """
+    Queue a scheduled report in the report pool
+    
+    Args:
+        schedule_id: Schedule ID
+    """
+    with app.app_context():
+        schedule = Schedule.query.get(schedule_id)
+        
+        if not schedule or not schedule.is_active:
+            logger.warning(f"Schedule {schedule_id} not found or inactive")
+            return
+        
+        user_id = schedule.user_id
+        if not coordinator.owns_user(user_id):
+            logger.info(f"Schedule {schedule_id} belongs to a partition of another worker, skipped")
+            return
+        
+        accounts = [token.id for token in get_user_tokens(user_id, schedule.get_accounts())]
+    
+    report_pool.submit(f"schedule_{schedule_id}", user_id, accounts, execute_scheduled_report, schedule_id,
+                       cost=max(len(accounts), 1))
+
+def prefetch_scheduled_report(schedule_id):
+    """
+    Queue the prefetch of a scheduled report in the report pool
+    
+    Args:
+        schedule_id: Schedule ID
+    """
+    with app.app_context():
+        schedule = Schedule.query.get(schedule_id)
+        
+        if not schedule or not schedule.is_active or not coordinator.owns_user(schedule.user_id):
+            return
+        
+        user_id = schedule.user_id
+        accounts = [token.id for token in get_user_tokens(user_id, schedule.get_accounts())]
+    
+    report_pool.submit(f"prefetch_{schedule_id}", user_id, accounts, execute_prefetch, schedule_id,
+                       cost=max(len(accounts), 1))
+
+def execute_prefetch(schedule_id):
+    """
+    Build and store a scheduled report before its nominal time
+    
+    The stored result is found by its content key when the report job runs
+    at the nominal time, so the delivery does not call the API.
+    
+    Args:
+        schedule_id: Schedule ID
+    """
+    with app.app_context(), track_job_run('prefetch', f"prefetch_{schedule_id}", schedule_id=schedule_id) as run:
+        try:
+            schedule = Schedule.query.get(schedule_id)
+            
+            if not schedule or not schedule.is_active:
+                run.skip("Schedule not found or inactive")
+                return
+            
+            run.user_id = schedule.user_id
+            
+            # Период отчета считается по дате сервера: после полуночи он сдвинется
+            now = datetime.now()
+            if (now + timedelta(seconds=prefetch_offset(schedule_id))).date() != now.date():
+                logger.info(f"Prefetch for schedule {schedule_id} skipped: the report period changes before delivery")
+                run.skip("Report period changes before delivery")
+                return
+            
+            tokens = get_user_tokens(schedule.user_id, schedule.get_accounts())
+            run.accounts = [token.id for token in tokens]
+            
+            if not tokens:
+                run.skip("No Yandex Direct accounts")
+                return
+            
+            report_data, summary, result = load_accounts_report(tokens, schedule.template)
+            db.session.commit()
+            
+            if result:
+                logger.info(f"Prefetched report for schedule {schedule_id} (result {result.id})")
+            else:
+                logger.warning(f"Prefetched report for schedule {schedule_id} was not stored for reuse")
+                run.details = {'stored': False}
+        except Exception as e:
+            db.session.rollback()
+            run.fail(e)
+            logger.exception(f"Error prefetching report for schedule {schedule_id}: {e}")
+
+def execute_scheduled_report(schedule_id):
     """
     Run a scheduled report
     
@@ -156,106 +825,404 @@ def run_scheduled_report(schedule_id):
     """
     logger.info(f"Running scheduled report {schedule_id}")
     
-    with app.app_context():
+    with app.app_context(), track_job_run('report', f"schedule_{schedule_id}", schedule_id=schedule_id) as run:
         try:
             # Get the schedule
             schedule = Schedule.query.get(schedule_id)
             
             if not schedule or not schedule.is_active:
                 logger.warning(f"Schedule {schedule_id} not found or inactive")
+                run.skip("Schedule not found or inactive")
                 return
             
-            # Get the user's Yandex Direct client
-            client = get_user_client(schedule.user_id)
+            run.user_id = schedule.user_id
+            
+            # Get the Yandex Direct accounts of the schedule
+            tokens = get_user_tokens(schedule.user_id, schedule.get_accounts())
+            run.accounts = [token.id for token in tokens]
             
-            if not client:
-                logger.error(f"No Yandex Direct client available for user {schedule.user_id}")
+            if not tokens:
+                logger.error(f"No Yandex Direct accounts available for user {schedule.user_id}")
+                run.fail("No Yandex Direct accounts")
                 return
             
-            # Generate the report
-            report_data, summary = generate_report(client, schedule.template)
+            # Generate the report (or reuse stored data for a closed period)
+            report_data, summary, result = load_accounts_report(tokens, schedule.template)
             
             if not report_data:
                 logger.error(f"Failed to generate report for schedule {schedule_id}")
+                run.fail(summary or "Failed to generate report")
                 return
             
             # Create a report record
-            report = Report(
-                user_id=schedule.user_id,
-                template_id=schedule.template_id,
+            report = create_report(
+                schedule.user_id,
+                schedule.template,
+                report_data,
+                summary,
+                result,
+                token_id=tokens[0].id if len(tokens) == 1 else None,
                 schedule_id=schedule.id,
-                title=f"{schedule.name} - {datetime.now().strftime('%Y-%m-%d %H:%M')}",
-                summary=summary,
-                data_json=json.dumps(report_data),
-                date_from=report_data.get('date_from'),
-                date_to=report_data.get('date_to')
+                title=f"{schedule.name} - {datetime.now().strftime('%Y-%m-%d %H:%M')}"
             )
             
-            from app import db
-            db.session.add(report)
+            # The notification is sent from the outbox after commit
+            queue_report_notification(schedule.user_id, report, summary)
             db.session.commit()
             
-            # Send Telegram notification
-            send_report_notification(schedule.user_id, report.id, summary)
-            
             logger.info(f"Scheduled report {schedule_id} completed successfully")
         except Exception as e:
+            db.session.rollback()
+            run.fail(e)
             logger.exception(f"Error running scheduled report {schedule_id}: {e}")
 
-def check_condition(condition_id):
+def dispatch_report_jobs(partitions=None):
     """
-    Check a condition and run report if triggered
+    Queue reports requested from the web interface in the report pool
     
     Args:
-        condition_id: Condition ID
+        partitions: Partitions to check (all owned partitions by default)
     """
-    logger.info(f"Checking condition {condition_id}")
+    if partitions is None:
+        partitions = set(coordinator.partitions)
+    if not partitions:
+        return
     
     with app.app_context():
+        in_partitions = (ReportJob.user_id % SCHEDULER_PARTITIONS).in_(partitions)
+        now = datetime.utcnow()
+        
+        interrupted = ReportJob.query.filter(
+            ReportJob.status == ReportJob.RUNNING,
+            ReportJob.started_at < now - timedelta(seconds=REPORT_JOB_TIMEOUT),
+            in_partitions
+        ).update({
+            'status': ReportJob.FAILED,
+            'error': 'Построение отчета прервано. Попробуйте еще раз.',
+            'finished_at': now
+        }, synchronize_session=False)
+        db.session.commit()
+        if interrupted:
+            logger.warning(f"{interrupted} report job(s) interrupted")
+        
+        expired = expire_queued_jobs(in_partitions)
+        if expired:
+            logger.warning(f"{expired} report job(s) expired in the queue")
+        
+        jobs = ReportJob.query.options(joinedload(ReportJob.template)).filter(
+            ReportJob.status == ReportJob.QUEUED,
+            in_partitions
+        ).order_by(ReportJob.id).all()
+        
+        tasks = [
+            (f"report_job_{job.id}", job.id, job.user_id,
+             [token.id for token in get_user_tokens(job.user_id, job.template.get_accounts())])
+            for job in jobs if f"report_job_{job.id}" not in report_pool
+        ]
+    
+    for key, job_id, user_id, accounts in tasks:
+        report_pool.submit(key, user_id, accounts, execute_report_job, job_id, cost=max(len(accounts), 1))
+
+def execute_report_job(job_id):
+    """
+    Build a report requested from the web interface
+    
+    The job is claimed with a conditional update, so it runs once even if
+    its partition moved to another process while it was queued.
+    
+    Args:
+        job_id: ReportJob ID
+    """
+    with app.app_context(), track_job_run('manual_report', f"report_job_{job_id}") as run:
+        claimed = ReportJob.query.filter_by(id=job_id, status=ReportJob.QUEUED).update(
+            {'status': ReportJob.RUNNING, 'started_at': datetime.utcnow()}, synchronize_session=False
+        )
+        db.session.commit()
+        
+        if not claimed:
+            run.skip("Report job already taken")
+            return
+        
+        job = db.session.get(ReportJob, job_id)
+        run.user_id = job.user_id
+        
         try:
-            # Get the condition
-            condition = Condition.query.get(condition_id)
+            template = job.template
+            tokens = get_user_tokens(job.user_id, template.get_accounts())
+            run.accounts = [token.id for token in tokens]
             
-            if not condition or not condition.is_active:
-                logger.warning(f"Condition {condition_id} not found or inactive")
+            if not tokens:
+                finish_report_job(job, error='Подключите аккаунт Яндекс Директ')
+                run.fail("No Yandex Direct accounts")
                 return
             
-            # Get the user's Yandex Direct client
-            client = get_user_client(condition.user_id)
+            # Generate the report (or reuse stored data for a closed period)
+            report_data, summary, result = load_accounts_report(tokens, template)
             
-            if not client:
-                logger.error(f"No Yandex Direct client available for user {condition.user_id}")
-                return
-            
-            # Parse the condition
-            condition_data = json.loads(condition.condition_json)
-            
-            # Evaluate condition
-            triggered, report_data, summary = evaluate_condition(client, condition.template, condition_data)
-            
-            if not triggered:
-                logger.debug(f"Condition {condition_id} not triggered")
+            if not report_data:
+                finish_report_job(job, error='Не удалось сгенерировать отчет - нет данных за выбранный период')
+                run.fail("No data for the period")
                 return
             
-            # Create a report record
-            report = Report(
-                user_id=condition.user_id,
-                template_id=condition.template_id,
-                condition_id=condition.id,
-                title=f"{condition.name} - {datetime.now().strftime('%Y-%m-%d %H:%M')}",
-                summary=summary,
-                data_json=json.dumps(report_data),
-                date_from=report_data.get('date_from'),
-                date_to=report_data.get('date_to')
+            report = create_report(
+                job.user_id,
+                template,
+                report_data,
+                summary,
+                result,
+                token_id=tokens[0].id if len(tokens) == 1 else None,
+                title=f"{template.name} - {datetime.now().strftime('%Y-%m-%d %H:%M')}"
             )
-            
-            from app import db
-            db.session.add(report)
-            db.session.commit()
-            
-            # Send Telegram notification
-            send_report_notification(condition.user_id, report.id, summary)
-            
-            logger.info(f"Condition {condition_id} triggered, report generated")
+            finish_report_job(job, report=report)
+            logger.info(f"Report job {job_id} completed, report {report.id}")
         except Exception as e:
-            logger.exception(f"Error checking condition {condition_id}: {e}")
+            db.session.rollback()
+            run.fail(e)
+            logger.exception(f"Error running report job {job_id}: {e}")
+            
+            job = db.session.get(ReportJob, job_id)
+            finish_report_job(job, error='Ошибка доступа к API Яндекс Директ. Пожалуйста, переподключите аккаунт.')
+
+def finish_report_job(job, report=None, error=None):
+    """Store the outcome of a report job and commit"""
+    job.status = ReportJob.FAILED if error else ReportJob.DONE
+    job.report = report
+    job.error = error
+    job.finished_at = datetime.utcnow()
+    db.session.commit()
+
+def run_condition_tick(user_id, interval):
+    """
+    Queue a batch check of a user's conditions with one interval in the condition pool
+    
+    Args:
+        user_id: User ID
+        interval: Check interval in seconds
+    """
+    if not coordinator.owns_user(user_id):
+        logger.info(f"Condition tick of user {user_id} belongs to a partition of another worker, skipped")
+        return
+    
+    with app.app_context():
+        conditions = Condition.query.filter_by(user_id=user_id, check_interval=interval, is_active=True).all()
+        
+        if not conditions:
+            logger.debug(f"No active conditions with interval {interval}s for user {user_id}")
+            return
+        
+        accounts = set()
+        for template in {condition.template for condition in conditions}:
+            accounts.update(token.id for token in get_user_tokens(user_id, template.get_accounts()))
+    
+    condition_pool.submit(tick_job_id(user_id, interval), user_id, sorted(accounts), execute_condition_tick,
+                          user_id, interval, cost=max(len(accounts), 1))
+
+def execute_condition_tick(user_id, interval):
+    """
+    Check all conditions of a user with one interval as a batch
+    
+    Conditions of the same template share one report load (and anomaly
+    conditions share the daily history stored by the first of them), so
+    API calls per account are made once per tick, not once per condition.
+    Conditions whose adaptive interval has not elapsed are skipped.
+    
+    Args:
+        user_id: User ID
+        interval: Check interval in seconds
+    """
+    job_key = tick_job_id(user_id, interval)
+    with app.app_context(), track_job_run('conditions', job_key, user_id=user_id) as run:
+        conditions = Condition.query.filter_by(user_id=user_id, check_interval=interval, is_active=True) \
+            .order_by(Condition.id).all()
+        states = {
+            state.condition_id: state
+            for state in ConditionState.query.filter(ConditionState.condition_id.in_([c.id for c in conditions]))
+        }
+        
+        now = datetime.utcnow()
+        due = [condition for condition in conditions if is_check_due(condition, states.get(condition.id), now)]
+        logger.info(f"Checking {len(due)} of {len(conditions)} condition(s) of user {user_id} with interval {interval}s")
+        
+        reports = {}
+        durations, triggered, errors = {}, 0, 0
+        for condition in due:
+            started = time.perf_counter()
+            try:
+                state = states.get(condition.id) or new_condition_state(condition)
+                is_triggered = check_condition(condition, state, reports)
+                triggered += is_triggered
+                update_condition_state(condition, state, reports, is_triggered)
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                errors += 1
+                logger.exception(f"Error checking condition {condition.id}: {e}")
+            finally:
+                durations[condition.id] = round(time.perf_counter() - started, 3)
+        
+        run.accounts = sorted({token.id for tokens, _ in reports.values() for token in tokens})
+        run.details = {'conditions': durations, 'triggered': triggered, 'errors': errors,
+                       'skipped': len(conditions) - len(due)}
+        if errors and errors == len(due):
+            run.fail(f"All {errors} condition checks failed")
+
+def is_check_due(condition, state, now):
+    """
+    Check whether the adaptive interval of a condition has elapsed
+    
+    Ticks run every check_interval, so a check is due at the tick nearest
+    to its next check time. An edited condition is checked at once.
+    """
+    if state is None or (condition.updated_at and condition.updated_at > state.checked_at):
+        return True
+    return state.next_check_at <= now + timedelta(seconds=condition.check_interval / 2)
+
+def new_condition_state(condition):
+    """Add the state of a condition checked for the first time"""
+    now = datetime.utcnow()
+    state = ConditionState(condition_id=condition.id, interval=condition.check_interval,
+                           checked_at=now, next_check_at=now, is_firing=False)
+    db.session.add(state)
+    return state
+
+def update_condition_state(condition, state, reports, triggered):
+    """
+    Remember the checked totals of a condition and schedule its next check
+    
+    Args:
+        condition: Condition model instance
+        state: ConditionState of the condition
+        reports: Dictionary shared by the batch: template ID -> (tokens, loaded report)
+        triggered: Whether the check triggered the condition
+    """
+    condition_data = json.loads(condition.condition_json)
+    loaded = reports.get(condition.template_id, (None, None))[1]
+    bounds = interval_bounds(condition)
+    
+    if is_anomaly_condition(condition_data) or not loaded or not loaded[0]:
+        totals, interval = None, bounds[0]
+    else:
+        totals = rule_totals(loaded[0], condition_data)
+        previous = state.get_totals()
+        interval = next_interval(
+            state.interval if previous is not None else None,
+            bounds,
+            changed=totals != previous,
+            near=triggered or is_near_threshold(totals, condition_data)
+        )
+    
+    now = datetime.utcnow()
+    state.totals = json.dumps(totals) if totals is not None else None
+    state.interval = interval
+    state.checked_at = now
+    state.next_check_at = now + timedelta(seconds=interval)
+
+def check_condition(condition, state, reports):
+    """
+    Check a condition and create a report when it starts firing
+    
+    Alerts are edge-triggered (see condition_alerts.py): a report is sent
+    only when the condition turns true outside its cooldown, and a firing
+    condition resolves when it is false with the hysteresis applied.
+    
+    Args:
+        condition: Condition model instance
+        state: ConditionState of the condition
+        reports: Dictionary shared by the batch: template ID -> (tokens, loaded report)
+        
+    Returns:
+        bool: True if the condition fired and a report was sent
+    """
+    template = condition.template
+    
+    if template.id not in reports:
+        # Get the Yandex Direct accounts of the condition's template
+        tokens = get_user_tokens(condition.user_id, template.get_accounts())
+        reports[template.id] = (tokens, None)
+    tokens = reports[template.id][0]
+    
+    if not tokens:
+        logger.error(f"No Yandex Direct accounts available for user {condition.user_id}")
+        return False
+    
+    def load_template_report():
+        # Load the report data once per template (or reuse stored data for a closed period)
+        if reports[template.id][1] is None:
+            reports[template.id] = (tokens, load_accounts_report(tokens, template))
+        return reports[template.id][1]
+    
+    # Parse the condition
+    condition_data = json.loads(condition.condition_json)
+    hysteresis, cooldown = alert_settings(condition)
+    now = datetime.utcnow()
+    
+    if is_anomaly_condition(condition_data):
+        # Аномалии считаются по дневной истории, отчет нужен только при срабатывании
+        anomalies = []
+        for token in tokens:
+            token_anomalies, day = evaluate_anomaly_condition(
+                YandexDirectAPI(token), condition_data, LocalStats(token.id)
+            )
+            anomalies.extend(token_anomalies)
+        
+        is_met = bool(anomalies)
+        details = {'anomalies': len(anomalies)}
+    else:
+        report_data, summary, result = load_template_report()
+        
+        if not report_data:
+            logger.error(f"Failed to load report data for condition {condition.id}")
+            return False
+        
+        # Срабатывающее условие проверяется с порогами, сдвинутыми на гистерезис
+        rules = relax_rules(condition_data, hysteresis) if state.is_firing else condition_data
+        is_met = check_condition_rules(report_data, rules)
+        details = {'totals': rule_totals(report_data, condition_data)}
+    
+    if state.is_firing:
+        if not is_met:
+            record_event(condition, state, EVENT_RESOLVED, now, details)
+            logger.info(f"Condition {condition.id} resolved")
+        return False
+    
+    if not is_met:
+        logger.debug(f"Condition {condition.id} not triggered")
+        return False
+    
+    if in_cooldown(state, cooldown, now):
+        logger.info(f"Condition {condition.id} is met but fired less than {cooldown}s ago, alert postponed")
+        return False
+    
+    if is_anomaly_condition(condition_data):
+        anomalies.sort(key=lambda anomaly: -abs(anomaly['score']))
+        alert = format_anomaly_message(condition_data, anomalies, day)
+        report_data, summary, result = load_template_report()
+        
+        if not report_data:
+            logger.error(f"Failed to load report data for condition {condition.id}")
+            return False
+    else:
+        alert = format_condition_message(condition_data)
+    
+    # Enhance the summary with the triggered condition
+    summary = summary + "\n\n" + "⚠️ *Alert Triggered*: " + alert
+    
+    # Create a report record
+    report = create_report(
+        condition.user_id,
+        template,
+        report_data,
+        summary,
+        result,
+        token_id=tokens[0].id if len(tokens) == 1 else None,
+        condition_id=condition.id,
+        title=f"{condition.name} - {datetime.now().strftime('%Y-%m-%d %H:%M')}"
+    )
+    record_event(condition, state, EVENT_FIRED, now, details, report=report)
+    
+    # The notification is sent from the outbox after commit
+    queue_report_notification(condition.user_id, report, summary)
+    db.session.commit()
+    
+    logger.info(f"Condition {condition.id} triggered, report generated")
+    return True
@@ -0,0 +1,243 @@
+"""
+Разделы задач планировщика между процессами
+
+Задачи расписаний и условий разбиты на SCHEDULER_PARTITIONS разделов по
+пользователю (user_id % SCHEDULER_PARTITIONS). Все аккаунты пользователя
+попадают в один раздел, поэтому лимиты на аккаунт в пулах (job_pools)
+соблюдает один процесс. У каждого раздела своя таблица хранилища задач
+APScheduler.
+
+Каждый процесс планировщика отмечается в таблице scheduler_workers. Раздел
+принадлежит живому процессу, выбранному rendezvous hashing: при появлении
+или уходе процесса переезжает только его доля разделов. Владение
+закрепляется арендой partition-<n> в scheduler_leases (см. leader.py):
+процесс отдает разделы, которые ему больше не положены, и забирает только
+свободные или истекшие, поэтому раздел не выполняется двумя процессами сразу.
+
+Отданный раздел сразу перестает запускать задачи, но его аренда продлевается,
+пока не выполнятся уже поставленные в очереди пулов задачи раздела: новый
+владелец забирает раздел после них, и задачи не теряются и не пересекаются.
+"""
+import os
+import time
+import hashlib
+import logging
+import threading
+from datetime import datetime, timedelta
+
+from app import app, db
+from models import SchedulerWorker
+from leader import acquire_leases, release_leases, make_holder_id, LEASE_TTL, LEASE_RENEW_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+SCHEDULER_PARTITIONS = int(os.environ.get('SCHEDULER_PARTITIONS', 16))
+
+# Через сколько интервалов без отметки строка процесса удаляется
+WORKER_EXPIRY_FACTOR = 10
+
+
+def user_partition(user_id):
+    """Get the partition of a user's jobs"""
+    return user_id % SCHEDULER_PARTITIONS
+
+
+def partition_lease_name(partition):
+    """Lease name of a partition"""
+    return f"partition-{partition}"
+
+
+def partition_owner(partition, workers):
+    """
+    Pick the owner of a partition with rendezvous (highest random weight) hashing
+
+    Args:
+        partition: Partition number
+        workers: IDs of live workers
+
+    Returns:
+        str: Worker ID, or None if there are no workers
+    """
+    return max(
+        workers,
+        key=lambda worker: hashlib.sha1(f"{worker}:{partition}".encode('utf-8')).digest(),
+        default=None
+    )
+
+
+def has_live_workers(ttl=LEASE_TTL):
+    """
+    Check whether any scheduler process has sent a heartbeat within ttl seconds
+
+    Must be called inside an application context.
+    """
+    since = datetime.utcnow() - timedelta(seconds=ttl)
+    return db.session.query(SchedulerWorker.id).filter(SchedulerWorker.heartbeat_at >= since).first() is not None
+
+
+class ShardCoordinator:
+    """
+    Keep the set of partitions owned by this process in line with live workers
+
+    Callbacks run in the coordinator thread with the partition number:
+    on_acquired after the partition lease is taken, on_released before the
+    lease is given up (or after it is lost). A released partition keeps its
+    lease (in draining) until is_drained returns True for it.
+
+    Args:
+        on_acquired: Callable run when this process starts owning a partition
+        on_released: Callable run when this process stops owning a partition
+        is_drained: Callable checking that no work of a released partition is
+            left in this process (the lease is given up at once by default)
+        ttl: Lease and membership duration in seconds
+        renew_interval: Seconds between heartbeats
+    """
+
+    def __init__(self, on_acquired, on_released, is_drained=None, ttl=LEASE_TTL,
+                 renew_interval=LEASE_RENEW_INTERVAL):
+        self.worker_id = make_holder_id()
+        self.on_acquired = on_acquired
+        self.on_released = on_released
+        self.is_drained = is_drained
+        self.ttl = ttl
+        self.renew_interval = renew_interval
+
+        self.partitions = set()
+        self.draining = set()
+        self._valid_until = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def owns_user(self, user_id):
+        """Check whether jobs of a user belong to this process"""
+        return user_partition(user_id) in self.partitions
+
+    def start(self):
+        """Start the coordinator thread"""
+        self._thread = threading.Thread(target=self._run, name='shard-coordinator', daemon=True)
+        self._thread.start()
+        logger.info(f"Shard coordinator started as {self.worker_id}")
+
+    def stop(self):
+        """
+        Stop the coordinator, release all partitions and leave the membership
+
+        Work left in the released partitions may run while the leases are
+        still valid; then the leases are given up anyway.
+        """
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+        owned = self.partitions | self.draining
+        self._release(set(self.partitions))
+
+        # Аренды не продлеваются, поэтому ждать можно только до их истечения
+        while self._valid_until and datetime.utcnow() + timedelta(seconds=self.renew_interval) < self._valid_until:
+            if all(self._drained(p) for p in owned):
+                break
+            time.sleep(1)
+
+        try:
+            with app.app_context():
+                release_leases([partition_lease_name(p) for p in owned], self.worker_id)
+                SchedulerWorker.query.filter_by(id=self.worker_id).delete()
+                db.session.commit()
+        except Exception as e:
+            logger.warning(f"Could not leave scheduler membership: {e}")
+
+    def _run(self):
+        """Coordinator loop"""
+        while not self._stop.is_set():
+            try:
+                with app.app_context():
+                    self._rebalance()
+            except Exception as e:
+                logger.warning(f"Partition rebalance failed: {e}")
+                # Без связи с базой разделы отдаются до того, как их аренду заберут другие
+                if self._valid_until and datetime.utcnow() + timedelta(seconds=self.renew_interval) >= self._valid_until:
+                    self._release(set(self.partitions))
+
+            self._stop.wait(self.renew_interval)
+
+    def _rebalance(self):
+        """Heartbeat, compute the desired partitions and take or give up leases"""
+        workers = self._heartbeat()
+        desired = {p for p in range(SCHEDULER_PARTITIONS) if partition_owner(p, workers) == self.worker_id}
+
+        # Лишние разделы перестают запускать задачи сразу, а аренду отдают,
+        # когда закончатся их задачи, чтобы новый владелец мог их забрать
+        surplus = self.partitions - desired
+        self._release(surplus)
+        self.draining = (self.draining | surplus) - desired
+
+        drained = {p for p in self.draining if self._drained(p)}
+        if drained:
+            release_leases([partition_lease_name(p) for p in drained], self.worker_id)
+            self.draining -= drained
+
+        wanted = desired | self.draining
+        held, expires_at = acquire_leases([partition_lease_name(p) for p in wanted], self.worker_id, self.ttl)
+        held = {p for p in wanted if partition_lease_name(p) in held}
+        self._valid_until = expires_at
+
+        if self.draining - held:
+            logger.warning(f"Leases of draining partitions {sorted(self.draining - held)} were lost")
+            self.draining &= held
+
+        held -= self.draining
+        self._release(self.partitions - held)
+        for partition in sorted(held - self.partitions):
+            self.partitions.add(partition)
+            self._callback(self.on_acquired, partition)
+
+        if surplus or drained or held != desired:
+            logger.info(f"Partitions of {self.worker_id}: {len(self.partitions)} owned, "
+                        f"{len(self.draining)} draining, {len(desired - held)} waiting for release, "
+                        f"{len(workers)} live workers")
+
+    def _heartbeat(self):
+        """
+        Mark this worker alive and get the live workers
+
+        Returns:
+            list: IDs of live workers
+        """
+        now = datetime.utcnow()
+        worker = db.session.get(SchedulerWorker, self.worker_id)
+        if worker:
+            worker.heartbeat_at = now
+        else:
+            db.session.add(SchedulerWorker(id=self.worker_id, started_at=now, heartbeat_at=now))
+
+        SchedulerWorker.query.filter(
+            SchedulerWorker.heartbeat_at < now - timedelta(seconds=self.ttl * WORKER_EXPIRY_FACTOR)
+        ).delete(synchronize_session=False)
+        db.session.commit()
+
+        return [worker_id for (worker_id,) in db.session.query(SchedulerWorker.id).filter(
+            SchedulerWorker.heartbeat_at >= now - timedelta(seconds=self.ttl)
+        )]
+
+    def _release(self, partitions):
+        """Stop owning partitions and run on_released"""
+        for partition in sorted(partitions):
+            self.partitions.discard(partition)
+            self._callback(self.on_released, partition)
+
+    def _drained(self, partition):
+        """Check whether no work of a released partition is left, treating errors as drained"""
+        if self.is_drained is None:
+            return True
+        try:
+            return self.is_drained(partition)
+        except Exception as e:
+            logger.exception(f"Partition {partition} drain check failed: {e}")
+            return True
+
+    def _callback(self, callback, partition):
+        """Run a partition callback, logging errors"""
+        try:
+            callback(partition)
+        except Exception as e:
+            logger.exception(f"Partition {partition} callback failed: {e}")
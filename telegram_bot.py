@@ -2,11 +2,17 @@ import os
 import logging
 from telegram.ext import Application, CommandHandler, CallbackQueryHandler, ContextTypes
 from telegram import Bot, Update, InlineKeyboardButton, InlineKeyboardMarkup, constants
+import time
+import atexit
 import asyncio
+import threading
+from collections import deque
+from datetime import timedelta
 from threading import Thread
+from telegram.error import RetryAfter, TimedOut, NetworkError
 from app import app
 from models import User, Report
-from flask import url_for
+from bot_stats import build_stats_message, build_top_message, build_account_message
 
 # Set up logging
 logging.basicConfig(level=logging.DEBUG,
@@ -16,50 +22,112 @@ logger = logging.getLogger(__name__)
 # Bot token from environment variable
 TELEGRAM_BOT_TOKEN = os.environ.get('TELEGRAM_BOT_TOKEN')
 
+# Адрес веб-интерфейса для ссылок на отчеты: бот и планировщик работают вне запроса
+APP_BASE_URL = os.environ.get('APP_BASE_URL', 'http://localhost:5000').rstrip('/')
+
+# Получение обновлений: polling (для разработки, один процесс) или webhook
+TELEGRAM_MODE = os.environ.get('TELEGRAM_MODE', 'polling')
+
+# Telegram передает секрет в заголовке X-Telegram-Bot-Api-Secret-Token каждого запроса
+TELEGRAM_WEBHOOK_SECRET = os.environ.get('TELEGRAM_WEBHOOK_SECRET')
+TELEGRAM_WEBHOOK_PATH = '/telegram/webhook'
+
+# Лимиты Telegram: около 30 сообщений в секунду от бота и 1 в секунду в один чат
+TELEGRAM_GLOBAL_RATE = float(os.environ.get('TELEGRAM_GLOBAL_RATE', 25))
+TELEGRAM_CHAT_RATE = float(os.environ.get('TELEGRAM_CHAT_RATE', 1))
+TELEGRAM_SEND_CONCURRENCY = int(os.environ.get('TELEGRAM_SEND_CONCURRENCY', 16))
+TELEGRAM_SEND_RETRIES = int(os.environ.get('TELEGRAM_SEND_RETRIES', 5))
+
+# Как часто передавать результаты отправки (on_results)
+TELEGRAM_FLUSH_INTERVAL = 2
+
+# Максимальная длина текста сообщения в Telegram
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+# Самое длинное окно сводки, которое можно задать командой /digest (минуты)
+DIGEST_MAX_MINUTES = 24 * 60
+
 # Initialize the bot
 bot = Bot(token=TELEGRAM_BOT_TOKEN if TELEGRAM_BOT_TOKEN else "placeholder")
 
-# Global application object
-application = None
+def get_report_url(report_id):
+    """Build an absolute link to a report page"""
+    return f"{APP_BASE_URL}/reports/view/{report_id}"
+
+def get_webhook_url():
+    """Build the absolute URL Telegram posts updates to"""
+    return f"{APP_BASE_URL}{TELEGRAM_WEBHOOK_PATH}"
+
+def build_application():
+    """Create the bot Application with all handlers"""
+    bot_application = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
+    
+    # Register command handlers
+    bot_application.add_handler(CommandHandler("start", start_command))
+    bot_application.add_handler(CommandHandler("help", help_command))
+    bot_application.add_handler(CommandHandler("bind", bind_command))
+    bot_application.add_handler(CommandHandler("digest", digest_command))
+    bot_application.add_handler(CommandHandler("stats", stats_command))
+    bot_application.add_handler(CommandHandler("top", top_command))
+    bot_application.add_handler(CommandHandler("account", account_command))
+    
+    # Register callback query handler for button clicks
+    bot_application.add_handler(CallbackQueryHandler(button_callback))
+    return bot_application
+
+async def register_webhook():
+    """Point Telegram at the webhook endpoint of the web interface"""
+    async with Bot(token=TELEGRAM_BOT_TOKEN) as webhook_bot:
+        await webhook_bot.set_webhook(
+            url=get_webhook_url(),
+            secret_token=TELEGRAM_WEBHOOK_SECRET,
+            allowed_updates=[Update.MESSAGE, Update.CALLBACK_QUERY]
+        )
 
 def start_bot():
-    """Start the Telegram bot in a separate thread"""
-    global application
+    """
+    Start receiving Telegram updates (called in the leader process)
     
+    In polling mode the bot polls Telegram in a separate thread until
+    stop_bot. In webhook mode only the webhook is registered: updates are
+    posted to the web processes and handled there (see WebhookRunner).
+    """
     if not TELEGRAM_BOT_TOKEN:
         logger.error("TELEGRAM_BOT_TOKEN environment variable is not set")
         return
     
     try:
-        # Create the Application and add handlers
-        application = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
-        
-        # Register command handlers
-        application.add_handler(CommandHandler("start", start_command))
-        application.add_handler(CommandHandler("help", help_command))
-        application.add_handler(CommandHandler("bind", bind_command))
-        
-        # Register callback query handler for button clicks
-        application.add_handler(CallbackQueryHandler(button_callback))
-        
-        # Start the Bot in a separate thread
-        def run_bot():
-            asyncio.run(application.run_polling())
+        if TELEGRAM_MODE == 'webhook':
+            if not TELEGRAM_WEBHOOK_SECRET:
+                logger.error("TELEGRAM_WEBHOOK_SECRET must be set in webhook mode")
+                return
+            
+            asyncio.run(register_webhook())
+            logger.info(f"Telegram webhook registered at {get_webhook_url()}")
+            return
         
-        thread = Thread(target=run_bot)
-        thread.daemon = True
-        thread.start()
+        # Polling deletes the webhook, so switching back to polling needs no cleanup
+        polling_runner.start()
+        if not polling_runner.running:
+            raise RuntimeError("Telegram application is not running")
         
         logger.info("Telegram bot started successfully")
     except Exception as e:
         logger.exception(f"Failed to start Telegram bot: {e}")
 
 def stop_bot():
-    """Stop the Telegram bot"""
-    global application
-    if application:
-        # This is now handled through the asyncio event loop
-        logger.info("Telegram bot will be stopped on next application shutdown")
+    """
+    Stop receiving Telegram updates (called when the process loses leadership)
+    
+    Polling is stopped before returning, so the next leader does not get
+    409 Conflict from a second getUpdates. The webhook is left registered:
+    web processes keep handling updates, and the next leader registers it again.
+    """
+    if TELEGRAM_MODE == 'webhook':
+        return
+    
+    polling_runner.stop()
+    logger.info("Telegram bot stopped")
 
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle the /start command"""
@@ -82,7 +150,11 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "📋 *DirectPulse Bot Commands:*\n\n"
         "• /start - Start the bot and show the welcome message\n"
         "• /help - Show this help message\n"
-        "• /bind youremail@example.com - Connect this chat to your DirectPulse account\n\n"
+        "• /bind youremail@example.com - Connect this chat to your DirectPulse account\n"
+        "• /digest 15 - Collect notifications for 15 minutes and send them as one message (/digest off to disable)\n"
+        "• /stats [today|yesterday|week|month] - Spend, clicks and conversions of all your accounts\n"
+        "• /top [period] [N] - Campaigns with the highest spend\n"
+        "• /account [number] - Your accounts and their campaigns\n\n"
         "Once connected, you'll automatically receive Yandex Direct report notifications based on your configured schedules and conditions."
     )
     
@@ -130,6 +202,84 @@ async def bind_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             f"You will receive report notifications here based on your configured schedules and triggers."
         )
 
+async def digest_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle the /digest command to show or change the digest window"""
+    chat_id = str(update.effective_chat.id)
+    
+    with app.app_context():
+        user = User.query.filter_by(telegram_chat_id=chat_id).first()
+        if not user:
+            await update.message.reply_text(
+                "⚠️ This chat is not linked to an account yet. Use /bind your.email@example.com first."
+            )
+            return
+        
+        if not context.args:
+            if user.digest_interval:
+                await update.message.reply_text(
+                    f"Notifications are collected for {user.digest_interval // 60} min and sent as one digest.\n"
+                    f"Use /digest off to receive each notification at once."
+                )
+            else:
+                await update.message.reply_text(
+                    "Each notification is sent at once.\n"
+                    "Use /digest 15 to collect notifications for 15 minutes and send them as one message."
+                )
+            return
+        
+        value = context.args[0].lower()
+        if value in ('off', '0'):
+            minutes = 0
+        elif value.isdigit() and 0 < int(value) <= DIGEST_MAX_MINUTES:
+            minutes = int(value)
+        else:
+            await update.message.reply_text(
+                f"Please provide the digest window in minutes (1-{DIGEST_MAX_MINUTES}) or 'off'.\n"
+                f"Example: /digest 15"
+            )
+            return
+        
+        user.digest_interval = minutes * 60 or None
+        from app import db
+        db.session.commit()
+    
+    if minutes:
+        await update.message.reply_text(f"✅ Notifications will be collected for {minutes} min and sent as one digest.")
+    else:
+        await update.message.reply_text("✅ Digest disabled, each notification will be sent at once.")
+
+async def answer_stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE, build_message):
+    """Build a statistics answer in a worker thread so that API calls do not block the bot"""
+    chat_id = str(update.effective_chat.id)
+    args = list(context.args or [])
+    
+    def build():
+        with app.app_context():
+            user = User.query.filter_by(telegram_chat_id=chat_id).first()
+            if not user:
+                return "⚠️ This chat is not linked to an account yet. Use /bind your.email@example.com first."
+            return build_message(user.id, args)
+    
+    try:
+        text = await asyncio.to_thread(build)
+    except Exception as e:
+        logger.exception(f"Error answering {build_message.__name__} for chat {chat_id}: {e}")
+        text = "⚠️ Could not load statistics right now, please try again later."
+    
+    await update.message.reply_text(text, parse_mode="MARKDOWN")
+
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle the /stats command"""
+    await answer_stats_command(update, context, build_stats_message)
+
+async def top_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle the /top command"""
+    await answer_stats_command(update, context, build_top_message)
+
+async def account_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle the /account command"""
+    await answer_stats_command(update, context, build_account_message)
+
 async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle button clicks in messages"""
     query = update.callback_query
@@ -144,7 +294,7 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             report = Report.query.get(int(report_id))
             if report:
                 # Create a URL to view the report
-                report_url = url_for('reports.view_report', report_id=report_id, _external=True)
+                report_url = get_report_url(report_id)
                 await query.edit_message_text(
                     text=f"Opening report: {report.title}...\nClick the link below to view the full report.",
                     reply_markup=InlineKeyboardMarkup([
@@ -154,76 +304,491 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             else:
                 await query.edit_message_text(text="Report not found or expired.")
 
-async def send_report_notification_async(user_id, report_id, summary):
+class TokenBucket:
     """
-    Async function to send a report notification to a user's Telegram chat
+    Token bucket for the sender loop: rate tokens per second, up to burst
+    
+    Used only from the sender event loop, so it needs no locking.
+    """
+    
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+    
+    def try_acquire(self):
+        """
+        Take a token if one is available
+        
+        Returns:
+            float: 0 if a token was taken, otherwise seconds until one is available
+        """
+        now = time.monotonic()
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+    
+    async def acquire(self):
+        """Wait for a token and take it"""
+        while True:
+            delay = self.try_acquire()
+            if not delay:
+                return
+            await asyncio.sleep(delay)
+    
+    def block(self, seconds):
+        """Give no tokens for the next seconds (after a flood control error)"""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+    
+    def is_idle(self):
+        """Check whether the bucket is full again, so it can be forgotten"""
+        return time.monotonic() >= self.blocked_until and \
+            self.tokens + (time.monotonic() - self.updated) * self.rate >= self.burst
+
+class OutboundMessage:
+    """A queued Telegram message"""
+    
+    __slots__ = ('chat_id', 'text', 'parse_mode', 'reply_markup', 'tag', 'attempts')
+    
+    def __init__(self, chat_id, text, parse_mode=None, reply_markup=None, tag=None):
+        self.chat_id = chat_id
+        self.text = text
+        self.parse_mode = parse_mode
+        self.reply_markup = reply_markup
+        self.tag = tag
+        self.attempts = 0
+
+class TelegramSender:
+    """
+    Long-lived sender of outgoing messages with Telegram flood limits
+    
+    Messages are queued from any thread and sent by an event loop in its own
+    thread. Each chat has its own queue and token bucket, so messages to one
+    chat keep their order and a busy chat does not hold back the others; a
+    global bucket keeps the bot under the overall limit. On a flood control
+    error (429) sending pauses for retry_after seconds and the message is
+    retried; network errors are retried with backoff.
+    
+    Results of tagged messages are passed to on_results in batches, in a
+    thread of the loop executor, as a list of (tag, error, retryable):
+    error is None for delivered messages, retryable is True if the message
+    was dropped after exhausting retries of a temporary error.
     
     Args:
-        user_id: User ID
-        report_id: Report ID
-        summary: Report summary text
+        bot: telegram.Bot instance
+        on_results: Callable taking a list of results (optional)
+        global_rate: Messages per second for the whole bot
+        chat_rate: Messages per second to one chat
+        concurrency: Number of messages sent at the same time
+        retries: Attempts per message before it is dropped
     """
-    with app.app_context():
-        user = User.query.get(user_id)
-        report = Report.query.get(report_id)
+    
+    def __init__(self, bot, on_results=None, global_rate=TELEGRAM_GLOBAL_RATE, chat_rate=TELEGRAM_CHAT_RATE,
+                 concurrency=TELEGRAM_SEND_CONCURRENCY, retries=TELEGRAM_SEND_RETRIES):
+        self.bot = bot
+        self.on_results = on_results
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.concurrency = concurrency
+        self.retries = retries
         
-        if not user or not report:
-            logger.error(f"User or report not found: user_id={user_id}, report_id={report_id}")
-            return
+        self._lock = threading.Lock()
+        self._thread = None
+        self._loop = None
+        self._started = threading.Event()
+        
+        # Состояние ниже используется только в потоке отправителя
+        self._ready = None
+        self._stopping = None
+        self._pending = {}
+        self._chat_buckets = {}
+        self._global_bucket = None
+        self._results = []
+        self._queued = 0
+    
+    @property
+    def queued(self):
+        """Number of messages queued or being sent"""
+        return self._queued
+    
+    def send(self, chat_id, text, parse_mode=None, reply_markup=None, tag=None):
+        """
+        Queue a message; returns at once (safe to call from any thread)
+        
+        Args:
+            chat_id: Telegram chat ID
+            text: Message text
+            parse_mode: Telegram parse mode
+            reply_markup: Inline keyboard
+            tag: Value passed to on_results with the outcome of the message
+        """
+        self.start()
+        message = OutboundMessage(chat_id, text, parse_mode, reply_markup, tag)
+        self._loop.call_soon_threadsafe(self._enqueue, message)
+    
+    def start(self):
+        """Start the sender thread on first use"""
+        with self._lock:
+            if self._thread:
+                return
+            
+            self._thread = Thread(target=self._run, name='telegram-sender', daemon=True)
+            self._thread.start()
+            atexit.register(self.stop)
         
-        if not user.telegram_chat_id:
-            logger.warning(f"User {user.username} does not have a Telegram chat ID")
+        self._started.wait()
+        logger.info("Telegram sender started")
+    
+    def stop(self, timeout=30):
+        """Send the queued messages (waiting up to timeout seconds) and stop the sender"""
+        with self._lock:
+            thread = self._thread
+        if not thread or not thread.is_alive():
             return
         
+        self._loop.call_soon_threadsafe(self._stopping.set)
+        thread.join(timeout)
+        if thread.is_alive():
+            logger.warning(f"Telegram sender stopped with {self._queued} message(s) unsent")
+    
+    def _run(self):
+        """Sender thread: run the event loop"""
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._ready = asyncio.Queue()
+        self._stopping = asyncio.Event()
+        self._global_bucket = TokenBucket(self.global_rate, self.global_rate)
+        self._started.set()
+        
         try:
-            # Create a report URL
-            report_url = url_for('reports.view_report', report_id=report_id, _external=True)
+            self._loop.run_until_complete(self._serve())
+        except Exception as e:
+            logger.exception(f"Telegram sender failed: {e}")
+        finally:
+            self._loop.close()
+    
+    async def _serve(self):
+        """Start the workers and run until stopped and drained"""
+        await self.bot.initialize()
+        workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+        
+        while not (self._stopping.is_set() and not self._queued):
+            try:
+                await asyncio.wait_for(self._stopping.wait(), timeout=TELEGRAM_FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            await self._flush_results()
+            if self._stopping.is_set() and self._queued:
+                await asyncio.sleep(0.1)
+        
+        for worker in workers:
+            worker.cancel()
+        await self._flush_results()
+        await self.bot.shutdown()
+    
+    def _enqueue(self, message):
+        """Put a message in its chat queue (in the sender loop)"""
+        queue = self._pending.get(message.chat_id)
+        if queue is None:
+            self._pending[message.chat_id] = deque([message])
+            self._ready.put_nowait(message.chat_id)
+        else:
+            queue.append(message)
+        self._queued += 1
+    
+    def _release_chat(self, chat_id, delay=0.0):
+        """Return a chat to the ready queue if it has messages, after delay seconds"""
+        if not self._pending.get(chat_id):
+            self._pending.pop(chat_id, None)
+            return
+        
+        if delay:
+            self._loop.call_later(delay, self._ready.put_nowait, chat_id)
+        else:
+            self._ready.put_nowait(chat_id)
+    
+    async def _worker(self):
+        """Send messages of ready chats"""
+        while True:
+            chat_id = await self._ready.get()
             
-            # Create the message text
-            message = (
-                f"📊 *New Report: {report.title}*\n\n"
-                f"{summary}\n\n"
-                f"Period: {report.date_from} to {report.date_to}"
-            )
+            bucket = self._chat_buckets.get(chat_id)
+            if bucket is None:
+                bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate, 1)
             
-            # Add a button to view the full report
-            keyboard = [
-                [InlineKeyboardButton("View Full Report", url=report_url)],
-                [InlineKeyboardButton("Show Details", callback_data=f"report_{report_id}")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
+            # Чат возвращается в очередь, когда у него появится токен
+            delay = bucket.try_acquire()
+            if delay:
+                self._release_chat(chat_id, delay)
+                continue
             
-            # Send the message
-            await bot.send_message(
-                chat_id=user.telegram_chat_id,
-                text=message,
-                parse_mode=constants.ParseMode.MARKDOWN,
-                reply_markup=reply_markup
+            await self._global_bucket.acquire()
+            message = self._pending[chat_id].popleft()
+            delay = await self._deliver(message)
+            self._release_chat(chat_id, delay)
+    
+    async def _deliver(self, message):
+        """
+        Send one message, requeueing it at the front of its chat on retryable errors
+        
+        Returns:
+            float: Seconds the chat must wait before its next message
+        """
+        try:
+            await self.bot.send_message(
+                chat_id=message.chat_id,
+                text=message.text,
+                parse_mode=message.parse_mode,
+                reply_markup=message.reply_markup
             )
-            
-            # Update the report as sent
-            report.sent_to_telegram = True
-            from app import db
-            db.session.commit()
-            
-            logger.info(f"Report notification sent to user {user.username}")
+        except RetryAfter as e:
+            retry_after = e.retry_after
+            delay = retry_after.total_seconds() if isinstance(retry_after, timedelta) else float(retry_after)
+            logger.warning(f"Telegram flood control: pausing for {delay}s")
+            # Превышен лимит: пауза для всех чатов, сообщение отправится повторно
+            self._global_bucket.block(delay)
+            return self._retry(message, delay)
+        except (TimedOut, NetworkError) as e:
+            delay = min(2 ** message.attempts, 60)
+            logger.warning(f"Telegram send to chat {message.chat_id} failed, retrying in {delay}s: {e}")
+            return self._retry(message, delay)
         except Exception as e:
-            logger.exception(f"Error sending Telegram notification: {e}")
+            # Бот заблокирован, чат не найден, неверная разметка: повтор не поможет
+            logger.error(f"Telegram message to chat {message.chat_id} dropped: {e}")
+            self._finish(message, str(e), retryable=False)
+            return 0.0
+        
+        self._finish(message)
+        return 0.0
+    
+    def _finish(self, message, error=None, retryable=False):
+        """Count a message as done and keep its result for on_results"""
+        self._queued -= 1
+        if message.tag is not None:
+            self._results.append((message.tag, error, retryable))
+    
+    def _retry(self, message, delay):
+        """Put a failed message back at the front of its chat queue"""
+        message.attempts += 1
+        if message.attempts >= self.retries:
+            logger.error(f"Telegram message to chat {message.chat_id} dropped after {message.attempts} attempts")
+            self._finish(message, f"Dropped after {message.attempts} attempts", retryable=True)
+            return delay
+        
+        self._pending[message.chat_id].appendleft(message)
+        return delay
+    
+    async def _flush_results(self):
+        """Pass message results to on_results and forget idle chat buckets"""
+        for chat_id in [chat_id for chat_id, bucket in self._chat_buckets.items()
+                        if chat_id not in self._pending and bucket.is_idle()]:
+            del self._chat_buckets[chat_id]
+        
+        if not self._results:
+            return
+        
+        results, self._results = self._results, []
+        if self.on_results is None:
+            return
+        
+        try:
+            await self._loop.run_in_executor(None, self.on_results, results)
+        except Exception as e:
+            logger.warning(f"Could not record results of {len(results)} Telegram message(s): {e}")
 
-def send_report_notification(user_id, report_id, summary):
+class ApplicationRunner:
     """
-    Synchronous wrapper for send_report_notification_async
+    Run the bot Application in an event loop in its own thread
+    
+    start() returns once the application has started (or failed to), stop()
+    finishes the queued updates and stops it. A stopped runner can be
+    started again.
     
     Args:
-        user_id: User ID
-        report_id: Report ID
-        summary: Report summary text
+        name: Name of the application thread
     """
-    # Create a new event loop for the async function
-    try:
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        loop.run_until_complete(send_report_notification_async(user_id, report_id, summary))
-        loop.close()
-    except Exception as e:
-        logger.exception(f"Error in send_report_notification: {e}")
+    
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._thread = None
+        self._loop = None
+        self._started = None
+        self._stopping = None
+        self._application = None
+        self._exit_registered = False
+    
+    @property
+    def running(self):
+        """Whether the application is started and handles updates"""
+        return bool(self._application and self._application.running)
+    
+    def start(self):
+        """Start the application thread unless it is running"""
+        with self._lock:
+            if not (self._thread and self._thread.is_alive()):
+                self._started = threading.Event()
+                self._thread = Thread(target=self._run, args=(self._started,), name=self.name, daemon=True)
+                self._thread.start()
+                if not self._exit_registered:
+                    atexit.register(self.stop)
+                    self._exit_registered = True
+            started = self._started
+        
+        started.wait()
+    
+    def stop(self, timeout=30):
+        """Finish the queued updates (waiting up to timeout seconds) and stop the application"""
+        with self._lock:
+            thread = self._thread
+        if not thread or not thread.is_alive():
+            return
+        
+        self._loop.call_soon_threadsafe(self._stopping.set)
+        thread.join(timeout)
+        if thread.is_alive():
+            logger.warning(f"Telegram application ({self.name}) did not stop in {timeout}s")
+    
+    def _run(self, started):
+        """Application thread: run the event loop"""
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._stopping = asyncio.Event()
+        
+        try:
+            self._loop.run_until_complete(self._serve(started))
+        except Exception as e:
+            logger.exception(f"Telegram application ({self.name}) failed: {e}")
+        finally:
+            started.set()
+            self._loop.close()
+    
+    async def _serve(self, started):
+        """Start the application and run it until stopped"""
+        self._application = build_application()
+        try:
+            await self._application.initialize()
+            await self._application.start()
+            await self._start_updates()
+        finally:
+            started.set()
+        logger.info(f"Telegram application ({self.name}) started")
+        
+        await self._stopping.wait()
+        await self._stop_updates()
+        await self._application.stop()
+        await self._application.shutdown()
+    
+    async def _start_updates(self):
+        """Start receiving updates (nothing to do when they are pushed to the runner)"""
+    
+    async def _stop_updates(self):
+        """Stop receiving updates"""
+
+class PollingRunner(ApplicationRunner):
+    """
+    Poll Telegram for updates in the leader process
+    
+    Only one process may call getUpdates, so the leader stops the runner
+    when it loses leadership (see scheduler.stop_system_jobs).
+    """
+    
+    def __init__(self):
+        super().__init__('telegram-polling')
+    
+    async def _start_updates(self):
+        """Start long polling"""
+        await self._application.updater.start_polling()
+    
+    async def _stop_updates(self):
+        """Stop long polling (waits for the current getUpdates request)"""
+        if self._application.updater.running:
+            await self._application.updater.stop()
+
+class WebhookRunner(ApplicationRunner):
+    """
+    Handle Telegram updates posted to the webhook of a web process
+    
+    The application is started by the first update (after the web server
+    forks its workers). The webhook view only puts updates on the
+    Application update queue and returns at once; handlers run in the
+    application loop as in polling mode. Every web process has its own
+    runner, so updates are handled by whichever process receives them.
+    """
+    
+    def __init__(self):
+        super().__init__('telegram-webhook')
+    
+    def process(self, data):
+        """
+        Queue an update received by the webhook (safe to call from any thread)
+        
+        Args:
+            data: Decoded JSON body of the webhook request
+        
+        Raises:
+            RuntimeError: If the bot application could not be started
+        """
+        self.start()
+        if not self.running:
+            raise RuntimeError("Telegram application is not running")
+        
+        update = Update.de_json(data, self._application.bot)
+        self._loop.call_soon_threadsafe(self._application.update_queue.put_nowait, update)
+
+# Получение обновлений в процессе-лидере (режим polling)
+polling_runner = PollingRunner()
+
+# Обработка обновлений, пришедших на webhook этого процесса
+webhook_runner = WebhookRunner()
+
+def format_report_message(report_id, title, summary, date_from, date_to):
+    """
+    Build the text and buttons of a report notification
+    
+    Returns:
+        tuple: (text in Markdown, InlineKeyboardMarkup)
+    """
+    text = (
+        f"📊 *New Report: {title}*\n\n"
+        f"{summary}\n\n"
+        f"Period: {date_from} to {date_to}"
+    )
+    
+    # Add a button to view the full report
+    keyboard = [
+        [InlineKeyboardButton("View Full Report", url=get_report_url(report_id))],
+        [InlineKeyboardButton("Show Details", callback_data=f"report_{report_id}")]
+    ]
+    return text, InlineKeyboardMarkup(keyboard)
+
+def format_digest_message(items):
+    """
+    Build the text and buttons of a digest of several report notifications
+    
+    Args:
+        items: Rows with report_id, title, summary, date_from and date_to
+    
+    Returns:
+        tuple: (text in Markdown, InlineKeyboardMarkup)
+    """
+    parts = [f"📬 *Digest: {len(items)} new reports*"]
+    keyboard = []
+    for number, item in enumerate(items, 1):
+        parts.append(
+            f"*{number}. {item.title}*\n"
+            f"{item.summary}\n"
+            f"Period: {item.date_from} to {item.date_to}"
+        )
+        # Кнопка "Show Details" заменила бы текст всей сводки, поэтому только ссылки
+        keyboard.append([InlineKeyboardButton(f"{number}. {item.title}"[:64], url=get_report_url(item.report_id))])
+    
+    return "\n\n".join(parts), InlineKeyboardMarkup(keyboard)
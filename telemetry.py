@@ -0,0 +1,281 @@
+"""
+Журнал выполнения задач планировщика
+
+Каждое выполнение задачи (отчет, предзагрузка, тик условий, загрузка
+дневной статистики, отчет по запросу из веб-интерфейса) записывается в job_runs: время старта и окончания,
+ожидание в очереди пула, число запросов к API Директа, скачанные байты,
+потраченные баллы (заголовок Units), время запросов к базе и результат.
+
+Счетчики собираются через contextvars: yandex_direct вызывает
+record_api_call после каждого запроса, а время запросов к базе считают
+обработчики событий SQLAlchemy. В рабочие потоки счетчики передаются
+через contextvars.copy_context (см. report_store).
+"""
+import json
+import time
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import pandas as pd
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app import app, db
+from models import JobRun
+from job_pools import current_task
+
+logger = logging.getLogger(__name__)
+
+# Сколько дней хранить журнал
+JOB_RUN_RETENTION_DAYS = 30
+
+OUTCOME_SUCCESS = 'success'
+OUTCOME_SKIPPED = 'skipped'
+OUTCOME_ERROR = 'error'
+
+# Сколько самых медленных расписаний, условий и аккаунтов показывать
+SLOWEST_LIMIT = 10
+
+_current_run = contextvars.ContextVar('job_run', default=None)
+
+
+class JobRunTracker:
+    """Counters and result of one job execution"""
+
+    def __init__(self, job_type, job_key, user_id=None, schedule_id=None):
+        self.job_type = job_type
+        self.job_key = job_key
+        self.user_id = user_id
+        self.schedule_id = schedule_id
+        self.accounts = []
+        self.details = {}
+
+        self.outcome = OUTCOME_SUCCESS
+        self.error = None
+
+        self.api_calls = 0
+        self.bytes_downloaded = 0
+        self.units_spent = 0
+        self.db_time = 0.0
+        self.db_queries = 0
+        self._lock = threading.Lock()
+
+    def skip(self, reason):
+        """Mark the run as skipped"""
+        self.outcome = OUTCOME_SKIPPED
+        self.error = reason
+
+    def fail(self, error):
+        """Mark the run as failed"""
+        self.outcome = OUTCOME_ERROR
+        self.error = str(error)
+
+    def add_api_call(self, size, units):
+        with self._lock:
+            self.api_calls += 1
+            self.bytes_downloaded += size
+            self.units_spent += units
+
+    def add_db_query(self, elapsed):
+        with self._lock:
+            self.db_queries += 1
+            self.db_time += elapsed
+
+
+def parse_units(header):
+    """
+    Get spent points from the Units header ("spent/remaining/daily limit")
+
+    Returns:
+        int: Spent points, 0 if the header is missing or malformed
+    """
+    try:
+        return int(header.split('/')[0])
+    except (AttributeError, ValueError):
+        return 0
+
+
+def record_api_call(response=None):
+    """
+    Count a Yandex Direct API call for the current job run, if any
+
+    Args:
+        response: requests.Response of the call (optional)
+    """
+    run = _current_run.get()
+    if run is None:
+        return
+
+    # Ответ tapi_yandex_direct может не содержать исходного HTTP-ответа
+    content = getattr(response, 'content', None) or b''
+    headers = getattr(response, 'headers', None) or {}
+    run.add_api_call(len(content), parse_units(headers.get('Units')))
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current_run.get() is not None:
+        conn.info.setdefault('job_run_query_start', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    run = _current_run.get()
+    starts = conn.info.get('job_run_query_start')
+    if run is not None and starts:
+        run.add_db_query(time.perf_counter() - starts.pop())
+
+
+@contextmanager
+def track_job_run(job_type, job_key, **fields):
+    """
+    Record one job execution in the job_runs journal
+
+    Exceptions are recorded as errors and re-raised. The journal row is
+    written in its own session, so a failed write never affects the job.
+
+    Args:
+        job_type: 'report', 'prefetch', 'conditions', 'daily_stats' or 'manual_report'
+        job_key: Job ID (e.g. schedule_5)
+        **fields: user_id, schedule_id
+
+    Yields:
+        JobRunTracker: Set accounts, details and the outcome on it
+    """
+    run = JobRunTracker(job_type, job_key, **fields)
+    task = current_task()
+    queue_lag = task.started_at - task.enqueued_at if task is not None else None
+
+    started_at = datetime.utcnow()
+    started = time.perf_counter()
+    token = _current_run.set(run)
+    try:
+        yield run
+    except Exception as e:
+        run.fail(e)
+        raise
+    finally:
+        _current_run.reset(token)
+        duration = time.perf_counter() - started
+        _save_job_run(run, started_at, duration, queue_lag)
+
+
+def _save_job_run(run, started_at, duration, queue_lag):
+    """Write a journal row in a separate application context"""
+    try:
+        with app.app_context():
+            db.session.add(JobRun(
+                job_type=run.job_type,
+                job_key=run.job_key,
+                user_id=run.user_id,
+                schedule_id=run.schedule_id,
+                accounts=json.dumps(run.accounts) if run.accounts else None,
+                started_at=started_at,
+                finished_at=started_at + timedelta(seconds=duration),
+                queue_lag=queue_lag,
+                duration=duration,
+                api_calls=run.api_calls,
+                bytes_downloaded=run.bytes_downloaded,
+                units_spent=run.units_spent,
+                db_time=run.db_time,
+                db_queries=run.db_queries,
+                outcome=run.outcome,
+                error=run.error[:1000] if run.error else None,
+                details=json.dumps(run.details) if run.details else None
+            ))
+            db.session.commit()
+    except Exception as e:
+        logger.warning(f"Could not record job run {run.job_key}: {e}")
+
+
+def prune_job_runs():
+    """Delete journal rows older than JOB_RUN_RETENTION_DAYS"""
+    with app.app_context():
+        cutoff = datetime.utcnow() - timedelta(days=JOB_RUN_RETENTION_DAYS)
+        deleted = JobRun.query.filter(JobRun.started_at < cutoff).delete(synchronize_session=False)
+        db.session.commit()
+
+    logger.info(f"Pruned {deleted} job runs older than {JOB_RUN_RETENTION_DAYS} days")
+
+
+def summarize_job_runs(since):
+    """
+    Aggregate the journal for the admin view
+
+    Args:
+        since: Only runs started after this time (UTC) are included
+
+    Returns:
+        dict: 'types' - per job type counts, percentiles and totals;
+            'schedules', 'conditions', 'accounts' - the slowest ones as
+            lists of dicts with id, runs, p50, p95 and max (seconds)
+    """
+    rows = db.session.query(
+        JobRun.job_type, JobRun.schedule_id, JobRun.accounts, JobRun.duration, JobRun.queue_lag,
+        JobRun.api_calls, JobRun.bytes_downloaded, JobRun.units_spent, JobRun.db_time,
+        JobRun.outcome, JobRun.details
+    ).filter(JobRun.started_at >= since).all()
+
+    summary = {'types': [], 'schedules': [], 'conditions': [], 'accounts': []}
+    if not rows:
+        return summary
+
+    df = pd.DataFrame(rows, columns=['job_type', 'schedule_id', 'accounts', 'duration', 'queue_lag', 'api_calls',
+                                     'bytes_downloaded', 'units_spent', 'db_time', 'outcome', 'details'])
+    df['errors'] = df['outcome'] == OUTCOME_ERROR
+
+    types = df.groupby('job_type').agg(
+        runs=('duration', 'size'),
+        p50=('duration', lambda s: s.quantile(0.5)),
+        p95=('duration', lambda s: s.quantile(0.95)),
+        lag_p95=('queue_lag', lambda s: s.quantile(0.95)),
+        api_calls=('api_calls', 'sum'),
+        units_spent=('units_spent', 'sum'),
+        bytes_downloaded=('bytes_downloaded', 'sum'),
+        db_time=('db_time', 'sum'),
+        errors=('errors', 'sum')
+    ).reset_index()
+    summary['types'] = [
+        {key: (None if pd.isna(value) else value) for key, value in record.items()}
+        for record in types.to_dict('records')
+    ]
+
+    # Отчеты по расписанию (предзагрузка учитывается отдельно)
+    reports = df[(df['job_type'] == 'report') & df['schedule_id'].notna()]
+    summary['schedules'] = _slowest(reports['schedule_id'].astype(int), reports['duration'])
+
+    # Время проверки каждого условия хранится в details тиков
+    checks = [
+        (int(condition_id), seconds)
+        for details in df.loc[df['job_type'] == 'conditions', 'details'].dropna()
+        for condition_id, seconds in json.loads(details).get('conditions', {}).items()
+    ]
+    if checks:
+        checks = pd.DataFrame(checks, columns=['id', 'duration'])
+        summary['conditions'] = _slowest(checks['id'], checks['duration'])
+
+    # Аккаунту засчитывается длительность каждой задачи, которая к нему обращалась
+    usage = df[df['accounts'].notna()].assign(account=lambda d: d['accounts'].map(json.loads)).explode('account')
+    usage = usage[usage['account'].notna()]
+    if not usage.empty:
+        summary['accounts'] = _slowest(usage['account'].astype(int), usage['duration'])
+
+    return summary
+
+
+def _slowest(ids, durations):
+    """Group durations by ID and return the SLOWEST_LIMIT IDs with the highest p95"""
+    if ids.empty:
+        return []
+
+    stats = durations.groupby(ids.values).agg(
+        runs='size',
+        p50=lambda s: s.quantile(0.5),
+        p95=lambda s: s.quantile(0.95),
+        max='max'
+    ).sort_values('p95', ascending=False).head(SLOWEST_LIMIT)
+
+    return [{'id': int(key), **record} for key, record in zip(stats.index, stats.to_dict('records'))]
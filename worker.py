@@ -0,0 +1,83 @@
+"""
+Фоновый процесс: планировщик, пулы задач и бот Telegram без веб-интерфейса
+
+Запуск: python -m worker [--report-workers N] [--condition-workers N] [--scheduler-threads N]
+
+Загружает только модели, клиент Директа, планировщик и отправку в Telegram;
+блюпринты Flask не регистрируются. Процессов можно запустить сколько нужно:
+разделы задач распределяются между ними (sharding.py), бот и служебные
+задачи работают в одном выбранном лидере (leader.py). Веб-процессы
+(gunicorn main:app) только ставят отчеты в очередь report_jobs.
+
+Ссылки на отчеты в сообщениях строятся от APP_BASE_URL.
+"""
+import os
+import signal
+import logging
+import argparse
+import threading
+
+logger = logging.getLogger('worker')
+
+# Параметры воркера и переменные окружения модулей, которые они задают
+CONCURRENCY_SETTINGS = {
+    'report_workers': 'SCHEDULER_REPORT_WORKERS',
+    'condition_workers': 'SCHEDULER_CONDITION_WORKERS',
+    'scheduler_threads': 'SCHEDULER_MAX_WORKERS',
+}
+
+
+def parse_args():
+    """Read concurrency settings from the command line and WORKER_* variables"""
+    parser = argparse.ArgumentParser(description="DirectPulse background worker")
+    parser.add_argument('--report-workers', type=int, default=os.environ.get('WORKER_REPORT_WORKERS'),
+                        help="Threads building scheduled and requested reports")
+    parser.add_argument('--condition-workers', type=int, default=os.environ.get('WORKER_CONDITION_WORKERS'),
+                        help="Threads checking conditions")
+    parser.add_argument('--scheduler-threads', type=int, default=os.environ.get('WORKER_SCHEDULER_THREADS'),
+                        help="APScheduler threads that queue jobs in the pools")
+    parser.add_argument('--log-level', default=os.environ.get('WORKER_LOG_LEVEL', 'INFO'))
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    # Модули читают настройки при импорте, поэтому они задаются до него
+    for option, variable in CONCURRENCY_SETTINGS.items():
+        value = getattr(args, option)
+        if value is not None:
+            os.environ[variable] = str(value)
+
+    from app import app
+    from scheduler import init_scheduler, stop_scheduler
+    from job_pools import POOLS
+
+    logging.getLogger().setLevel(args.log_level.upper())
+
+    stopping = threading.Event()
+
+    def request_stop(signum, frame):
+        logger.info(f"Received signal {signum}, stopping")
+        stopping.set()
+
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+
+    init_scheduler()
+    logger.info("Worker started: " + ", ".join(
+        f"{pool.name} pool {pool.workers} threads" for pool in POOLS
+    ))
+
+    stopping.wait()
+
+    # Сначала отдать разделы и аренду лидера, затем дождаться начатых задач
+    stop_scheduler()
+    for pool in POOLS:
+        pool.shutdown()
+
+    logger.info("Worker stopped")
+
+
+if __name__ == '__main__':
+    main()
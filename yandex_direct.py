@@ -6,6 +6,7 @@ from urllib.parse import urlencode
 import pandas as pd
 from models import YandexToken, User
 from app import db
+from telemetry import record_api_call
 
 # Импортируем tapi для Яндекс Директа
 from tapi_yandex_direct import YandexDirect
@@ -1022,6 +1023,7 @@ class YandexDirectAPI:
             
             # Выполняем запрос
             response = requests.post(url, headers=headers, json=data)
+            record_api_call(response)
             
             if response.status_code == 200:
                 result = response.json()
@@ -1154,6 +1156,7 @@ class YandexDirectAPI:
             # Преобразуем body в JSON строку, как ожидает API
             body_json = json.dumps(body)
             report_result = self.api_client.reports().get(body_json)
+            record_api_call(getattr(report_result, 'response', None))
             
             # Проверяем результат
             if not report_result or not report_result.get('data'):
@@ -1259,6 +1262,27 @@ class YandexDirectAPI:
                 date_range_type='LAST_7_DAYS',
                 campaign_ids=campaign_ids
             )
+    
+    def get_campaign_daily_stats_dataframe(self, date_from, date_to, campaign_ids=None):
+        """
+        Получить статистику по кампаниям с разбивкой по дням одним отчетом
+        
+        Args:
+            date_from: Дата начала в формате YYYY-MM-DD
+            date_to: Дата окончания в формате YYYY-MM-DD
+            campaign_ids: Список ID кампаний (опционально)
+            
+        Returns:
+            pandas.DataFrame: Статистика по кампаниям и дням (колонка Date)
+        """
+        return self._get_stats_report(
+            report_type='CAMPAIGN_PERFORMANCE_REPORT',
+            date_range_type='CUSTOM_DATE',
+            date_from=date_from,
+            date_to=date_to,
+            campaign_ids=campaign_ids,
+            field_names=['Date', 'CampaignId', 'CampaignName', 'Impressions', 'Clicks', 'Cost', 'Conversions']
+        )
 
 
 def get_user_client(user_id):
@@ -1271,10 +1295,7 @@ def get_user_client(user_id):
     Returns:
         YandexDirectAPI: Configured API client or None
     """
-    # Находим либо токен по умолчанию, либо первый активный токен
-    token = YandexToken.query.filter_by(user_id=user_id, is_default=True).first()
-    if not token:
-        token = YandexToken.query.filter_by(user_id=user_id, is_active=True).first()
+    token = get_default_token(user_id)
     
     if not token:
         logger.warning(f"No active Yandex token found for user {user_id}")
@@ -1283,6 +1304,48 @@ def get_user_client(user_id):
     return YandexDirectAPI(token)
 
 
+def get_default_token(user_id):
+    """
+    Get the default Yandex token of a user
+    
+    Args:
+        user_id: User ID
+        
+    Returns:
+        YandexToken: Default token, the first active token, or None
+    """
+    # Находим либо токен по умолчанию, либо первый активный токен
+    token = YandexToken.query.filter_by(user_id=user_id, is_default=True).first()
+    if not token:
+        token = YandexToken.query.filter_by(user_id=user_id, is_active=True).first()
+    return token
+
+
+def get_user_tokens(user_id, accounts=None):
+    """
+    Get the Yandex tokens a report should be built from
+    
+    Args:
+        user_id: User ID
+        accounts: "ALL", a list of token IDs, or None for the default account
+        
+    Returns:
+        list: YandexToken instances (empty if none are available)
+    """
+    if not accounts:
+        token = get_default_token(user_id)
+        return [token] if token else []
+    
+    query = YandexToken.query.filter_by(user_id=user_id, is_active=True)
+    if accounts != 'ALL':
+        query = query.filter(YandexToken.id.in_(accounts))
+    
+    tokens = query.order_by(YandexToken.id).all()
+    if not tokens:
+        logger.warning(f"No active Yandex tokens found for user {user_id} and accounts {accounts}")
+    return tokens
+
+
 def store_token_for_user(user_id, token_data, client_login=None):
     """
     Store or update OAuth token for a user